@@ -50,12 +50,53 @@ CREATE TABLE coupon_redemptions (
     redemption_value_cents INTEGER DEFAULT 299
 );
 
+-- Daily coupon analytics, folded in from coupon_distributions and coupon_redemptions
+CREATE TABLE coupon_daily_stats (
+    id SERIAL PRIMARY KEY,
+    day DATE NOT NULL,
+    coupon_code_id INTEGER NOT NULL REFERENCES coupon_codes(id),
+    postcard_size VARCHAR(20) NOT NULL DEFAULT '', -- redemptions use the size of the redeeming order
+    distributions INTEGER NOT NULL DEFAULT 0,
+    redemptions INTEGER NOT NULL DEFAULT 0,
+    redemption_value_cents INTEGER NOT NULL DEFAULT 0,
+    CONSTRAINT uq_coupon_daily_stats UNIQUE (day, coupon_code_id, postcard_size)
+);
+
+-- How far coupon_daily_stats has folded each source table
+CREATE TABLE rollup_watermarks (
+    source VARCHAR(50) PRIMARY KEY,
+    last_id INTEGER NOT NULL DEFAULT 0, -- rows with id <= last_id are in the rollup
+    seen_max_id INTEGER NOT NULL DEFAULT 0, -- highest id at the previous compaction; folded by the next one
+    updated_at TIMESTAMP
+);
+
+-- Durable queue for Stannp submissions and notification emails
+CREATE TABLE background_jobs (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    dedupe_key VARCHAR(150) UNIQUE, -- one live job per key, e.g. one Stannp submission per transaction
+    status VARCHAR(20) NOT NULL DEFAULT 'queued', -- queued, running, succeeded, dead
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 1,
+    run_after TIMESTAMP NOT NULL,
+    locked_by VARCHAR(100),
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    result TEXT,
+    created_at TIMESTAMP NOT NULL,
+    finished_at TIMESTAMP
+);
+
 -- Create indexes for performance
 CREATE INDEX idx_coupon_codes_code ON coupon_codes(code);
 CREATE INDEX idx_coupon_codes_campaign ON coupon_codes(campaign_id);
 CREATE INDEX idx_distributions_transaction ON coupon_distributions(transaction_id);
 CREATE INDEX idx_redemptions_coupon ON coupon_redemptions(coupon_code_id);
 CREATE INDEX idx_redemptions_payment_intent ON coupon_redemptions(stripe_payment_intent_id);
+-- One redemption per code and order, so concurrent retries of one order cannot count it twice
+CREATE UNIQUE INDEX uq_coupon_redemptions_order ON coupon_redemptions(coupon_code_id, transaction_id);
+CREATE INDEX ix_background_jobs_claim ON background_jobs(status, run_after);
 
 -- Insert initial monthly welcome campaign
 INSERT INTO coupon_campaigns (
@@ -1,4 +1,5 @@
 import os
+import tempfile
 import cloudinary
 import cloudinary.uploader
 import resend
@@ -26,4 +27,103 @@ def configure_services():
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./coupons.db")
 STANNP_API_KEY = os.getenv("STANNP_API_KEY")
-ENVIRONMENT = os.getenv("ENVIRONMENT", "development").lower()
\ No newline at end of file
+ENVIRONMENT = os.getenv("ENVIRONMENT", "development").lower()
+
+# Render executor (process pool for image composition)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+RENDER_MAX_QUEUE = int(os.getenv("RENDER_MAX_QUEUE", "8"))
+RENDER_TIMEOUT_SECONDS = float(os.getenv("RENDER_TIMEOUT_SECONDS", "90"))
+RENDER_RETRY_AFTER_SECONDS = int(os.getenv("RENDER_RETRY_AFTER_SECONDS", "5"))
+
+# Published results reused for repeated identical requests per transaction (0 disables).
+# Safe with several workers: each render is stored under its own fingerprinted key
+RENDER_CACHE_TTL_SECONDS = float(os.getenv("RENDER_CACHE_TTL_SECONDS", "600"))
+RENDER_CACHE_MAX_ENTRIES = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "2000"))
+
+# How long a transaction's replaced render stays in image storage before it is deleted (never less than the render cache TTL)
+SUPERSEDED_IMAGE_RETENTION_SECONDS = float(os.getenv("SUPERSEDED_IMAGE_RETENTION_SECONDS", "3600"))
+
+# Batch sends: recipients accepted per batch, and finished recipients per bulk database write
+BATCH_MAX_RECIPIENTS = int(os.getenv("BATCH_MAX_RECIPIENTS", "1000"))
+BATCH_WRITE_ROWS = max(1, int(os.getenv("BATCH_WRITE_ROWS", "100")))
+
+# Source photo fetching for template fronts
+IMAGE_FETCH_CONCURRENCY = int(os.getenv("IMAGE_FETCH_CONCURRENCY", "6"))
+IMAGE_FETCH_TIMEOUT_SECONDS = float(os.getenv("IMAGE_FETCH_TIMEOUT_SECONDS", "20"))
+
+# Source photo cache (memory tier per render worker, disk tier shared)
+IMAGE_CACHE_MEMORY_MB = int(os.getenv("IMAGE_CACHE_MEMORY_MB", "128"))
+IMAGE_CACHE_DISK_MB = int(os.getenv("IMAGE_CACHE_DISK_MB", "512"))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "xlpostcards-image-cache"))
+
+# Postcard text font; when unset the first usable system font is picked at startup
+FONT_PATH = os.getenv("FONT_PATH", "")
+
+# Back message typesetting: "auto" fits the largest size in range to the message box, "fixed" is the classic 40pt / 20 lines
+MESSAGE_FIT_MODE = os.getenv("MESSAGE_FIT_MODE", "auto").lower()
+MESSAGE_MIN_FONT_SIZE = int(os.getenv("MESSAGE_MIN_FONT_SIZE", "24"))
+MESSAGE_MAX_FONT_SIZE = int(os.getenv("MESSAGE_MAX_FONT_SIZE", "64"))
+MESSAGE_FIT_BUDGET_MS = float(os.getenv("MESSAGE_FIT_BUDGET_MS", "50"))
+
+# Inline previews for in-app editing (preview=true): scale of the print size, "jpeg" or "webp", encoder quality
+PREVIEW_SCALE = min(1.0, max(0.05, float(os.getenv("PREVIEW_SCALE", "0.25"))))
+PREVIEW_FORMAT = os.getenv("PREVIEW_FORMAT", "jpeg").lower()
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "70"))
+
+# Rendered image blobs: staged here before upload and served at /blobs/{id} when the upload fails
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join(tempfile.gettempdir(), "xlpostcards-blobs"))
+BLOB_STORE_MB = int(os.getenv("BLOB_STORE_MB", "1024"))
+BLOB_TTL_HOURS = float(os.getenv("BLOB_TTL_HOURS", "72"))
+UPLOAD_CHUNK_MB = int(os.getenv("UPLOAD_CHUNK_MB", "6"))  # Cloudinary needs at least 5 MB per chunk
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL") or (
+    f"https://{os.getenv('RAILWAY_PUBLIC_DOMAIN')}" if os.getenv("RAILWAY_PUBLIC_DOMAIN") else ""
+)
+
+# Published postcard images: "cloudinary", or "local" to keep them in STORAGE_LOCAL_DIR (served at /storage/)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cloudinary").lower()
+STORAGE_LOCAL_DIR = os.getenv("STORAGE_LOCAL_DIR", os.path.join(tempfile.gettempdir(), "xlpostcards-storage"))
+STORAGE_MAX_CONNECTIONS = int(os.getenv("STORAGE_MAX_CONNECTIONS", "8"))
+STORAGE_TIMEOUT_SECONDS = float(os.getenv("STORAGE_TIMEOUT_SECONDS", "60"))
+
+# Include per-stage start/duration timings in generate-complete-postcard responses
+PIPELINE_TIMINGS = os.getenv("PIPELINE_TIMINGS", "false").lower() == "true"
+
+# Stannp API client (shared pooled connection, bounded concurrency, retries with jittered backoff)
+STANNP_API_URL = os.getenv("STANNP_API_URL", "https://dash.stannp.com/api/v1")
+STANNP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("STANNP_CONNECT_TIMEOUT_SECONDS", "5"))
+STANNP_READ_TIMEOUT_SECONDS = float(os.getenv("STANNP_READ_TIMEOUT_SECONDS", "30"))
+STANNP_MAX_CONCURRENCY = int(os.getenv("STANNP_MAX_CONCURRENCY", "4"))
+STANNP_MAX_RETRIES = int(os.getenv("STANNP_MAX_RETRIES", "3"))
+STANNP_BACKOFF_BASE_SECONDS = float(os.getenv("STANNP_BACKOFF_BASE_SECONDS", "0.5"))
+STANNP_BACKOFF_MAX_SECONDS = float(os.getenv("STANNP_BACKOFF_MAX_SECONDS", "8"))
+
+# Background job queue (Stannp submission and notification emails, stored in the database)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "2"))
+JOB_RETRY_DELAYS_SECONDS = [float(d) for d in os.getenv("JOB_RETRY_DELAYS_SECONDS", "10,60,300,1800").split(",") if d.strip()]
+JOB_LOCK_TIMEOUT_SECONDS = float(os.getenv("JOB_LOCK_TIMEOUT_SECONDS", "300"))
+# Sent as X-Admin-Token to see job payloads and requeue jobs; unset disables both
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+# Database connection pool. Sized per process from a total connection budget shared by WEB_CONCURRENCY uvicorn workers
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+_DB_CONNECTIONS_PER_PROCESS = max(3, DB_MAX_CONNECTIONS // max(1, WEB_CONCURRENCY))
+# The sync pool serves job workers and scripts; async request handlers get the rest of the budget
+DB_SYNC_POOL_SIZE = int(os.getenv("DB_SYNC_POOL_SIZE", str(min(JOB_WORKERS + 1, _DB_CONNECTIONS_PER_PROCESS // 3))))
+DB_SYNC_MAX_OVERFLOW = int(os.getenv("DB_SYNC_MAX_OVERFLOW", "2"))
+_DB_ASYNC_CONNECTIONS = max(2, _DB_CONNECTIONS_PER_PROCESS - DB_SYNC_POOL_SIZE - DB_SYNC_MAX_OVERFLOW)
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(_DB_ASYNC_CONNECTIONS // 4)))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(_DB_ASYNC_CONNECTIONS - DB_MAX_OVERFLOW)))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))  # Postgres only
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "15000"))
+
+# Monthly coupon code lookups are cached; coupon distribution rows are written in batches
+COUPON_CACHE_TTL_SECONDS = float(os.getenv("COUPON_CACHE_TTL_SECONDS", "300"))
+DISTRIBUTION_FLUSH_ROWS = int(os.getenv("DISTRIBUTION_FLUSH_ROWS", "50"))
+DISTRIBUTION_FLUSH_SECONDS = float(os.getenv("DISTRIBUTION_FLUSH_SECONDS", "5"))
+DISTRIBUTION_MAX_PENDING = int(os.getenv("DISTRIBUTION_MAX_PENDING", "10000"))
+# Must stay longer than any insert transaction on the coupon tables (see app/repositories/coupon_stats.py)
+COUPON_ROLLUP_INTERVAL_SECONDS = float(os.getenv("COUPON_ROLLUP_INTERVAL_SECONDS", "60"))
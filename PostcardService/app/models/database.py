@@ -1,8 +1,28 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, ForeignKey, text
+from sqlalchemy import create_engine, event, Column, Integer, String, Date, DateTime, Boolean, Text, ForeignKey, Index, UniqueConstraint, text
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlalchemy.sql import func
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict
 import os
+import threading
+import time
+
+from app.config.settings import (
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_SYNC_POOL_SIZE,
+    DB_SYNC_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT_SECONDS,
+    DB_POOL_RECYCLE_SECONDS,
+    DB_STATEMENT_TIMEOUT_MS,
+    SQLITE_BUSY_TIMEOUT_MS
+)
 
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -12,9 +32,164 @@ if not DATABASE_URL:
 else:
     print(f"[DATABASE] Using provided DATABASE_URL")
 
-# Create engine for all cases
-engine = create_engine(DATABASE_URL)
+
+class PoolStats:
+    """Checkout counts and time spent waiting for a pooled connection"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.wait_seconds = deque(maxlen=1000)
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.wait_seconds.append(seconds)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self.wait_seconds)
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "connectionsOpened": self.connects,
+                "waitMsP50": round(waits[len(waits) // 2] * 1000, 2) if waits else None,
+                "waitMsP95": round(waits[int(len(waits) * 0.95)] * 1000, 2) if waits else None,
+                "waitMsMax": round(waits[-1] * 1000, 2) if waits else None
+            }
+
+
+class _TimedCheckout:
+    """Pool mixin that records how long each checkout waited (including opening a new connection)"""
+
+    stats: PoolStats
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        self.stats.record_wait(time.perf_counter() - started)
+        return connection
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    stats = PoolStats()
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    stats = PoolStats()
+
+
+def _configure_engine(db_engine, url: URL):
+    """Per-connection SQLite pragmas and connection counting, shared by the sync and async engines"""
+    sync_engine = getattr(db_engine, "sync_engine", db_engine)
+
+    if url.get_backend_name() == "sqlite":
+        @event.listens_for(sync_engine, "connect")
+        def _configure_sqlite(dbapi_connection, connection_record):
+            # WAL lets readers run alongside the single writer instead of blocking its commit
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            # WAL is stored in the file, so only the first connection needs the exclusive lock to switch it
+            cursor.execute("PRAGMA journal_mode")
+            if cursor.fetchone()[0].lower() != "wal":
+                cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+    @event.listens_for(sync_engine, "connect")
+    def _count_connect(dbapi_connection, connection_record):
+        sync_engine.pool.stats.record_connect()
+
+
+def _create_engine(url: URL, pool_size: int, max_overflow: int):
+    """Sync engine (job workers and scripts) with an explicitly sized pool"""
+    pool_options = dict(
+        poolclass=TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+        pool_pre_ping=True
+    )
+
+    if url.get_backend_name() == "sqlite":
+        # Busy waits happen in SQLite itself, so the driver timeout matches the busy timeout
+        db_engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+            **pool_options
+        )
+    else:
+        connect_args = {}
+        if url.get_backend_name() == "postgresql":
+            # Caps any single statement server-side so a stuck query cannot hold a pooled connection forever
+            connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+        db_engine = create_engine(
+            url,
+            connect_args=connect_args,
+            pool_recycle=DB_POOL_RECYCLE_SECONDS,
+            **pool_options
+        )
+
+    _configure_engine(db_engine, url)
+    print(f"[DATABASE] Sync pool size {pool_size}, max overflow {max_overflow}, checkout timeout {DB_POOL_TIMEOUT_SECONDS}s")
+    return db_engine
+
+
+def _create_async_engine(url: URL, pool_size: int, max_overflow: int):
+    """Async engine for request handlers: asyncpg on Postgres, aiosqlite for the SQLite fallback"""
+    pool_options = dict(
+        poolclass=TimedAsyncQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+        pool_pre_ping=True
+    )
+
+    if url.get_backend_name() == "sqlite":
+        db_engine = create_async_engine(
+            url.set(drivername="sqlite+aiosqlite"),
+            connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+            **pool_options
+        )
+    elif url.get_backend_name() == "postgresql":
+        # asyncpg takes ssl as a connect argument rather than libpq's sslmode URL parameter
+        query = dict(url.query)
+        sslmode = query.pop("sslmode", None)
+        connect_args = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        if sslmode:
+            connect_args["ssl"] = sslmode
+        db_engine = create_async_engine(
+            url.set(drivername="postgresql+asyncpg", query=query),
+            connect_args=connect_args,
+            pool_recycle=DB_POOL_RECYCLE_SECONDS,
+            **pool_options
+        )
+    else:
+        raise RuntimeError(f"No async driver configured for {url.get_backend_name()} databases")
+
+    _configure_engine(db_engine, url)
+    print(f"[DATABASE] Async pool size {pool_size}, max overflow {max_overflow}, checkout timeout {DB_POOL_TIMEOUT_SECONDS}s")
+    return db_engine
+
+
+_database_url = make_url(DATABASE_URL)
+engine = _create_engine(_database_url, DB_SYNC_POOL_SIZE, DB_SYNC_MAX_OVERFLOW)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = _create_async_engine(_database_url, DB_POOL_SIZE, DB_MAX_OVERFLOW)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -61,7 +236,7 @@ class CouponDistribution(Base):
     transaction_id = Column(String(100), nullable=False, index=True)
     recipient_name = Column(String(255))
     recipient_address = Column(Text)
-    sent_at = Column(DateTime, default=func.now())
+    sent_at = Column(DateTime, default=datetime.utcnow)  # UTC from the app clock, as DistributionBuffer stamps queued rows
     postcard_size = Column(String(20))
     
     coupon_code = relationship("CouponCode", back_populates="distributions")
@@ -75,10 +250,14 @@ class CouponRedemption(Base):
     transaction_id = Column(String(100))
     stripe_payment_intent_id = Column(String(100), index=True)
     customer_email = Column(String(255))
-    redeemed_at = Column(DateTime, default=func.now())
+    redeemed_at = Column(DateTime, default=datetime.utcnow)  # UTC like sent_at, so rollup days are UTC days
     redemption_value_cents = Column(Integer, default=299)
     
     coupon_code = relationship("CouponCode", back_populates="redemptions")
+    
+    # One redemption per code and order, so concurrent retries of one order cannot count it twice.
+    # A named index rather than a constraint, so ensure_redemption_order_index can add it to older tables
+    __table_args__ = (Index("uq_coupon_redemptions_order", "coupon_code_id", "transaction_id", unique=True),)
 
 
 class Customer(Base):
@@ -118,6 +297,52 @@ class PostcardTransaction(Base):
     stannp_status = Column(String(50))
 
 
+class BackgroundJob(Base):
+    __tablename__ = "background_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False, default="{}")
+    dedupe_key = Column(String(150), unique=True)  # One live job per key, e.g. one Stannp submission per transaction
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, succeeded, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=1)
+    run_after = Column(DateTime, nullable=False)
+    locked_by = Column(String(100))
+    locked_at = Column(DateTime)
+    last_error = Column(Text)
+    result = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+    
+    __table_args__ = (Index("ix_background_jobs_claim", "status", "run_after"),)
+
+
+class CouponDailyStats(Base):
+    """Distribution and redemption counts per day, coupon code and postcard size, folded in from the raw tables"""
+    __tablename__ = "coupon_daily_stats"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False)
+    coupon_code_id = Column(Integer, ForeignKey("coupon_codes.id"), nullable=False)
+    postcard_size = Column(String(20), nullable=False, default="")  # Redemptions use the size of the redeeming order
+    distributions = Column(Integer, nullable=False, default=0)
+    redemptions = Column(Integer, nullable=False, default=0)
+    redemption_value_cents = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (UniqueConstraint("day", "coupon_code_id", "postcard_size", name="uq_coupon_daily_stats"),)
+
+
+class RollupWatermark(Base):
+    """How far a rollup has folded in an append-only source table"""
+    __tablename__ = "rollup_watermarks"
+    
+    source = Column(String(50), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)  # Rows with id <= last_id are in the rollup
+    seen_max_id = Column(Integer, nullable=False, default=0)  # Highest id at the previous compaction; folded by the next one
+    updated_at = Column(DateTime)
+
+
 def get_db():
     """Get database session"""
     db = SessionLocal()
@@ -132,10 +357,65 @@ def get_db_session():
     return SessionLocal()
 
 
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """Get async database session (request handlers)"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _pool_snapshot(db_engine, max_overflow: int) -> Dict[str, Any]:
+    pool = db_engine.pool
+    return {
+        "poolSize": pool.size(),
+        "maxOverflow": max_overflow,
+        "checkedOut": pool.checkedout(),
+        "checkedIn": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        **pool.stats.snapshot()
+    }
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Connection pool occupancy and checkout wait times for this process"""
+    return {
+        "backend": engine.dialect.name,
+        "async": _pool_snapshot(async_engine.sync_engine, DB_MAX_OVERFLOW),
+        "sync": _pool_snapshot(engine, DB_SYNC_MAX_OVERFLOW)
+    }
+
+
+def ensure_redemption_order_index(db_engine=None) -> bool:
+    """
+    Add the one-redemption-per-order unique index to a coupon_redemptions table created before it existed
+
+    create_all never alters existing tables. Returns False, after logging the
+    duplicate orders to clean up, when existing rows violate the index.
+    """
+    db_engine = db_engine or engine
+    try:
+        with db_engine.begin() as conn:
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_coupon_redemptions_order "
+                "ON coupon_redemptions (coupon_code_id, transaction_id)"
+            ))
+        return True
+    except IntegrityError:
+        with db_engine.connect() as conn:
+            duplicates = conn.execute(text(
+                "SELECT coupon_code_id, transaction_id, count(*) FROM coupon_redemptions "
+                "GROUP BY coupon_code_id, transaction_id HAVING count(*) > 1"
+            )).all()
+        print(f"[DATABASE] ERROR: uq_coupon_redemptions_order not created: {len(duplicates)} orders redeemed a code "
+              f"more than once, e.g. {[tuple(row) for row in duplicates[:5]]}. Concurrent redemptions for one order "
+              f"can be counted twice until the extra coupon_redemptions rows are removed and the service restarts")
+        return False
+
+
 def init_database():
     """Initialize database tables"""
     try:
         Base.metadata.create_all(bind=engine)
+        ensure_redemption_order_index()
         print("[DATABASE] Tables created successfully")
         
         # Test database connection
@@ -21,6 +21,25 @@ class PostcardRequest(BaseModel):
     frontImageUris: Optional[List[str]] = []  # New multi-image support
     templateType: Optional[str] = "single"  # Template type: single, two_side_by_side, three_photos, four_quarters, two_vertical, five_collage, six_grid, three_horizontal
     userEmail: Optional[str] = ""
+    messageFit: Optional[str] = None  # "auto" (fit font size to the message box) or "fixed" (40pt, 20 lines)
+
+
+class BatchRecipient(Recipient):
+    transactionId: str = ""  # Defaults to "{batchId}-{position}", counting from 1
+
+
+class BatchPostcardRequest(BaseModel):
+    """One message and front sent to many recipients"""
+    batchId: str = ""  # Generated when empty; also names the shared front image
+    recipients: List[BatchRecipient]
+    message: str
+    postcardSize: str
+    returnAddressText: str = ""
+    frontImageUri: Optional[str] = ""
+    frontImageUris: Optional[List[str]] = []
+    templateType: Optional[str] = "single"
+    userEmail: Optional[str] = ""
+    messageFit: Optional[str] = None
 
 
 class PaymentConfirmedRequest(BaseModel):
@@ -48,6 +67,7 @@ class FreePostcardRequest(BaseModel):
     frontImageUris: Optional[List[str]] = []
     templateType: Optional[str] = "single"
     userEmail: Optional[str] = ""
+    messageFit: Optional[str] = None
     promoCode: str
 
 
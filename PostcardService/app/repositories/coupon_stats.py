@@ -0,0 +1,139 @@
+"""
+Coupon analytics rollups: per-day, per-code, per-size counts in coupon_daily_stats
+
+coupon_distributions and coupon_redemptions are append-only, so compaction
+folds rows past each table's watermark into the rollup and advances the
+watermark in the same transaction. Reads combine the rollup with the short
+unfolded tail of the raw tables in one statement, so they are exact and cost
+O(days x codes x sizes) plus the tail, however large the raw tables grow.
+
+The SQL is plain text because Postgres and SQLite (3.24+) share the same
+INSERT ... SELECT ... ON CONFLICT syntax.
+"""
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List
+
+from sqlalchemy import Date, Integer, String, TextClause, bindparam, func, or_, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.database import CouponDistribution, CouponRedemption, RollupWatermark
+
+
+# Per source: the model whose ids the watermark tracks and the SELECT grouping its rows into rollup columns
+_SOURCES = {
+    "coupon_distributions": (
+        CouponDistribution,
+        "SELECT date(coalesce(d.sent_at, CURRENT_TIMESTAMP)) AS day, d.coupon_code_id, "
+        "coalesce(d.postcard_size, '') AS postcard_size, count(*) AS distributions, "
+        "0 AS redemptions, 0 AS redemption_value_cents "
+        "FROM coupon_distributions d WHERE d.coupon_code_id IS NOT NULL AND {id_range} "
+        "GROUP BY 1, 2, 3"
+    ),
+    "coupon_redemptions": (
+        CouponRedemption,
+        # Codes are shared, so a redemption is attributed to the size of the order that redeemed it
+        "SELECT date(coalesce(d.redeemed_at, CURRENT_TIMESTAMP)) AS day, d.coupon_code_id, "
+        "coalesce(t.postcard_size, '') AS postcard_size, 0 AS distributions, "
+        "count(*) AS redemptions, coalesce(sum(d.redemption_value_cents), 0) AS redemption_value_cents "
+        "FROM coupon_redemptions d LEFT JOIN postcard_transactions t ON t.transaction_id = d.transaction_id "
+        "WHERE d.coupon_code_id IS NOT NULL AND {id_range} "
+        "GROUP BY 1, 2, 3"
+    )
+}
+
+SOURCES = tuple(_SOURCES)
+_ROLLUP_COLUMNS = "day, coupon_code_id, postcard_size, distributions, redemptions, redemption_value_cents"
+
+
+@lru_cache(maxsize=None)
+def _fold_sql(source: str) -> TextClause:
+    grouped = _SOURCES[source][1].format(id_range="d.id > :after AND d.id <= :through")
+    return text(
+        f"INSERT INTO coupon_daily_stats ({_ROLLUP_COLUMNS}) {grouped} "
+        f"ON CONFLICT (day, coupon_code_id, postcard_size) DO UPDATE SET "
+        f"distributions = coupon_daily_stats.distributions + excluded.distributions, "
+        f"redemptions = coupon_daily_stats.redemptions + excluded.redemptions, "
+        f"redemption_value_cents = coupon_daily_stats.redemption_value_cents + excluded.redemption_value_cents"
+    )
+
+
+@lru_cache(maxsize=None)
+def _read_sql() -> TextClause:
+    tails = []
+    for source, (_, grouped) in _SOURCES.items():
+        unfolded = f"d.id > coalesce((SELECT last_id FROM rollup_watermarks WHERE source = '{source}'), 0)"
+        tails.append(f"SELECT * FROM ({grouped.format(id_range=unfolded)}) AS tail_{source} WHERE day >= :since")
+    return text(
+        f"SELECT day, coupon_code_id, postcard_size, sum(distributions) AS distributions, "
+        f"sum(redemptions) AS redemptions, sum(redemption_value_cents) AS redemption_value_cents FROM ("
+        f"SELECT {_ROLLUP_COLUMNS} FROM coupon_daily_stats WHERE day >= :since "
+        f"UNION ALL {' UNION ALL '.join(tails)}"
+        f") AS combined GROUP BY day, coupon_code_id, postcard_size ORDER BY day"
+    ).bindparams(bindparam("since", type_=Date)).columns(
+        day=Date, coupon_code_id=Integer, postcard_size=String,
+        distributions=Integer, redemptions=Integer, redemption_value_cents=Integer
+    )
+
+
+async def compact(db: AsyncSession, source: str, min_gap_seconds: float) -> int:
+    """
+    Fold one source table's new rows into coupon_daily_stats; returns how many ids were folded
+
+    Each run folds up to the highest id seen by the previous run, not the
+    current one: with min_gap_seconds longer than any insert transaction
+    lasts, every id below that mark has committed or rolled back, so a row
+    with a lower id cannot appear after the watermark passes it. The gap is
+    checked against the watermark's updated_at, so it holds between runs in
+    different workers too; a run sooner than that after any other, or one
+    that loses the conditional watermark update to a concurrent run, folds
+    nothing.
+    """
+    model = _SOURCES[source][0]
+    await db.execute(
+        text("INSERT INTO rollup_watermarks (source, last_id, seen_max_id) VALUES (:source, 0, 0) ON CONFLICT (source) DO NOTHING"),
+        {"source": source}
+    )
+    watermark = (await db.execute(
+        select(RollupWatermark.last_id, RollupWatermark.seen_max_id).where(RollupWatermark.source == source)
+    )).one()
+    current_max = (await db.execute(select(func.coalesce(func.max(model.id), 0)))).scalar_one()
+    through = max(watermark.last_id, watermark.seen_max_id)
+    now = datetime.utcnow()
+
+    claimed = await db.execute(
+        update(RollupWatermark)
+        .where(
+            RollupWatermark.source == source,
+            RollupWatermark.last_id == watermark.last_id,
+            RollupWatermark.seen_max_id == watermark.seen_max_id,
+            or_(RollupWatermark.updated_at.is_(None), RollupWatermark.updated_at <= now - timedelta(seconds=min_gap_seconds))
+        )
+        .values(last_id=through, seen_max_id=max(current_max, through), updated_at=now)
+    )
+    if not claimed.rowcount:
+        await db.rollback()
+        return 0
+
+    if through > watermark.last_id:
+        await db.execute(_fold_sql(source), {"after": watermark.last_id, "through": through})
+    await db.commit()
+    return through - watermark.last_id
+
+
+async def watermarks(db: AsyncSession) -> Dict[str, Dict[str, Any]]:
+    result = await db.execute(select(RollupWatermark))
+    return {
+        row.source: {
+            "lastId": row.last_id,
+            "seenMaxId": row.seen_max_id,
+            "updatedAt": row.updated_at.isoformat() if row.updated_at else None
+        }
+        for row in result.scalars()
+    }
+
+
+async def daily_stats(db: AsyncSession, since: date) -> List[Dict[str, Any]]:
+    """Rollup rows from since onwards, including rows not folded in yet, one per (day, code, size)"""
+    result = await db.execute(_read_sql(), {"since": since})
+    return [dict(row._mapping) for row in result]
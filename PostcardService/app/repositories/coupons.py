@@ -0,0 +1,135 @@
+"""
+Coupon code, distribution and redemption data access for async request handlers
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.database import CouponCampaign, CouponCode, CouponDistribution, CouponRedemption
+
+
+class DuplicateRedemption(Exception):
+    """Raised when the code was already redeemed for this transaction"""
+
+
+async def get_coupon_by_code(db: AsyncSession, code: str) -> Optional[CouponCode]:
+    result = await db.execute(select(CouponCode).where(CouponCode.code == code))
+    return result.scalar_one_or_none()
+
+
+def add_distribution(
+    db: AsyncSession,
+    coupon_code_id: int,
+    transaction_id: str,
+    recipient_name: str,
+    recipient_address: str,
+    postcard_size: str
+) -> CouponDistribution:
+    """Stage a record that a postcard carrying this coupon code was generated; the caller commits"""
+    distribution = CouponDistribution(
+        coupon_code_id=coupon_code_id,
+        transaction_id=transaction_id,
+        recipient_name=recipient_name,
+        recipient_address=recipient_address,
+        postcard_size=postcard_size
+    )
+    db.add(distribution)
+    return distribution
+
+
+async def add_distributions(db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+    """Bulk insert coupon_distributions rows; the caller commits"""
+    if rows:
+        await db.execute(insert(CouponDistribution), rows)
+
+
+async def get_codes(db: AsyncSession, coupon_code_ids) -> Dict[int, str]:
+    result = await db.execute(select(CouponCode.id, CouponCode.code).where(CouponCode.id.in_(list(coupon_code_ids))))
+    return dict(result.all())
+
+
+async def get_active_codes(db: AsyncSession, now: datetime) -> List[CouponCode]:
+    result = await db.execute(
+        select(CouponCode)
+        .where(CouponCode.is_active.is_(True), or_(CouponCode.expires_at.is_(None), CouponCode.expires_at > now))
+        .order_by(CouponCode.created_at)
+    )
+    return list(result.scalars())
+
+
+async def load_active_codes(db: AsyncSession, now: datetime) -> List[Tuple[int, str, int, int, Optional[datetime], int]]:
+    """(id, code, max_redemptions, times_redeemed, expires_at, discount_percent) for every active, unexpired code; a NULL max_redemptions means unlimited"""
+    result = await db.execute(
+        select(
+            CouponCode.id,
+            CouponCode.code,
+            CouponCode.max_redemptions,
+            func.coalesce(CouponCode.times_redeemed, 0),
+            CouponCode.expires_at,
+            func.coalesce(CouponCampaign.discount_percent, 100)
+        )
+        .outerjoin(CouponCampaign, CouponCampaign.id == CouponCode.campaign_id)
+        .where(CouponCode.is_active.is_(True), or_(CouponCode.expires_at.is_(None), CouponCode.expires_at > now))
+    )
+    return list(result.all())
+
+
+async def get_redemption(db: AsyncSession, coupon_code_id: int, transaction_id: str) -> Optional[CouponRedemption]:
+    result = await db.execute(
+        select(CouponRedemption).where(
+            CouponRedemption.coupon_code_id == coupon_code_id,
+            CouponRedemption.transaction_id == transaction_id
+        )
+    )
+    return result.scalars().first()
+
+
+async def redeem_coupon(
+    db: AsyncSession,
+    coupon_code_id: int,
+    transaction_id: str,
+    customer_email: str,
+    stripe_payment_intent_id: Optional[str] = None
+) -> Optional[Tuple[int, int]]:
+    """
+    Count one redemption and record it in the same transaction
+
+    The conditional UPDATE only matches while the code is active, unexpired
+    and under max_redemptions (NULL is unlimited), so concurrent redeemers can
+    never push times_redeemed past the limit. Returns (times_redeemed, max_redemptions)
+    after this redemption, or None when the code could not be redeemed.
+    Raises DuplicateRedemption, with the count rolled back, when a concurrent
+    request already recorded a redemption for this transaction.
+    """
+    counted = await db.execute(
+        update(CouponCode)
+        .where(
+            CouponCode.id == coupon_code_id,
+            CouponCode.is_active.is_(True),
+            or_(CouponCode.expires_at.is_(None), CouponCode.expires_at > datetime.utcnow()),
+            or_(CouponCode.max_redemptions.is_(None), func.coalesce(CouponCode.times_redeemed, 0) < CouponCode.max_redemptions)
+        )
+        .values(times_redeemed=func.coalesce(CouponCode.times_redeemed, 0) + 1)
+        .returning(CouponCode.times_redeemed, CouponCode.max_redemptions)
+        .execution_options(synchronize_session=False)
+    )
+    row = counted.first()
+    if row is None:
+        await db.rollback()
+        return None
+
+    db.add(CouponRedemption(
+        coupon_code_id=coupon_code_id,
+        transaction_id=transaction_id,
+        stripe_payment_intent_id=stripe_payment_intent_id,
+        customer_email=customer_email
+    ))
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise DuplicateRedemption(transaction_id)
+    return row[0], row[1]
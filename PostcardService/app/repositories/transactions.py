@@ -0,0 +1,123 @@
+"""
+PostcardTransaction data access for async request handlers and job workers
+"""
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import TextClause, or_, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.database import PostcardTransaction
+
+
+async def get_transaction(db: AsyncSession, transaction_id: str) -> Optional[PostcardTransaction]:
+    result = await db.execute(
+        select(PostcardTransaction).where(PostcardTransaction.transaction_id == transaction_id)
+    )
+    return result.scalar_one_or_none()
+
+
+def image_urls_query(transaction_ids: List[str]):
+    """SELECT of the stored front_url and back_url of these transactions, for sync and async sessions"""
+    return select(
+        PostcardTransaction.transaction_id, PostcardTransaction.front_url, PostcardTransaction.back_url
+    ).where(PostcardTransaction.transaction_id.in_(transaction_ids))
+
+
+async def get_image_urls(db: AsyncSession, transaction_ids: List[str]) -> Dict[str, Dict[str, Optional[str]]]:
+    """front_url and back_url per stored transaction; IDs with no row are left out"""
+    result = await db.execute(image_urls_query(transaction_ids))
+    return {row.transaction_id: {"front_url": row.front_url, "back_url": row.back_url} for row in result}
+
+
+async def get_user_email(db: AsyncSession, transaction_id: str) -> str:
+    """Email saved for the transaction, or '' when there is none"""
+    result = await db.execute(
+        select(PostcardTransaction.user_email).where(PostcardTransaction.transaction_id == transaction_id)
+    )
+    return result.scalar_one_or_none() or ""
+
+
+@lru_cache(maxsize=8)
+def _upsert_sql(field_names: Tuple[str, ...], returning: bool = True) -> TextClause:
+    columns = ", ".join(("transaction_id", "user_email") + field_names)
+    values = ", ".join(f":{name}" for name in ("transaction_id", "user_email") + field_names)
+    updates = ", ".join(f"{name} = excluded.{name}" for name in field_names)
+    return text(
+        f"INSERT INTO {PostcardTransaction.__tablename__} ({columns}, created_at, submitted_to_stannp) "
+        f"VALUES ({values}, CURRENT_TIMESTAMP, false) "
+        f"ON CONFLICT (transaction_id) DO UPDATE SET {updates}, "
+        f"user_email = CASE WHEN trim(coalesce(excluded.user_email, '')) <> '' "
+        f"THEN excluded.user_email ELSE {PostcardTransaction.__tablename__}.user_email END"
+        + (" RETURNING user_email" if returning else "")
+    )
+
+
+def upsert_statement(transaction_id: str, fields: Dict[str, Any], user_email: str):
+    """
+    INSERT ... ON CONFLICT (transaction_id) DO UPDATE, as a statement and its parameters
+
+    Postgres and SQLite (3.35+) accept the same SQL. A blank user_email never
+    overwrites a stored one, and the statement returns the email the row ends
+    up with. Written as text because SQLAlchemy 2.0.23 cannot cache the
+    dialect insert() constructs and recompiles them on every call.
+    """
+    statement = _upsert_sql(tuple(sorted(fields)))
+    return statement, {"transaction_id": transaction_id, "user_email": user_email, **fields}
+
+
+async def upsert_transaction(db: AsyncSession, transaction_id: str, fields: Dict[str, Any], user_email: str) -> str:
+    """Create or update the transaction row in one statement without committing; returns the stored email"""
+    statement, params = upsert_statement(transaction_id, fields, user_email)
+    result = await db.execute(statement, params)
+    return result.scalar_one() or ""
+
+
+async def upsert_transactions(db: AsyncSession, fields_by_id: Dict[str, Dict[str, Any]], user_email: str) -> None:
+    """
+    upsert_transaction for many rows in one executemany call, without committing
+
+    Every row must set the same fields. Stored emails are not returned, as
+    executemany cannot return rows.
+    """
+    if not fields_by_id:
+        return
+    field_names = tuple(sorted(next(iter(fields_by_id.values()))))
+    await db.execute(_upsert_sql(field_names, returning=False), [
+        {"transaction_id": transaction_id, "user_email": user_email, **fields}
+        for transaction_id, fields in fields_by_id.items()
+    ])
+
+
+async def claim_submission(db: AsyncSession, transaction_id: str) -> bool:
+    """Atomically move the transaction into 'submitting'; False if it is submitted, in flight or in doubt"""
+    result = await db.execute(
+        update(PostcardTransaction)
+        .where(
+            PostcardTransaction.transaction_id == transaction_id,
+            or_(PostcardTransaction.submitted_to_stannp.is_(None), PostcardTransaction.submitted_to_stannp.is_(False)),
+            or_(PostcardTransaction.stannp_status.is_(None), PostcardTransaction.stannp_status == "failed")
+        )
+        .values(stannp_status="submitting")
+    )
+    await db.commit()
+    return bool(result.rowcount)
+
+
+async def release_submission(db: AsyncSession, transaction_id: str, status: str) -> None:
+    """End a claim without an order: 'failed' allows another attempt, 'unknown' blocks it"""
+    await db.execute(
+        update(PostcardTransaction)
+        .where(PostcardTransaction.transaction_id == transaction_id)
+        .values(stannp_status=status)
+    )
+    await db.commit()
+
+
+async def mark_submitted(db: AsyncSession, transaction_id: str, stannp_order_id: str) -> None:
+    await db.execute(
+        update(PostcardTransaction)
+        .where(PostcardTransaction.transaction_id == transaction_id)
+        .values(submitted_to_stannp=True, stannp_order_id=stannp_order_id, stannp_status="submitted")
+    )
+    await db.commit()
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+import os
+from app.utils.blob_store import blob_store
+
+router = APIRouter()
+
+
+@router.get("/{blob_id}.jpg")
+async def get_blob(blob_id: str):
+    """Serve a rendered image kept locally because its upload failed"""
+    path = blob_store.path(blob_id)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path, media_type="image/jpeg")
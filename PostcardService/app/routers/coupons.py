@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.schemas import PromoCodeValidationRequest
-from app.models.database import get_db
+from app.models.database import get_async_db
 from app.services.coupon_service import (
     create_monthly_coupon,
     validate_promo_code,
@@ -13,7 +13,7 @@ router = APIRouter()
 
 
 @router.post("/create-monthly-coupon")
-async def create_monthly_coupon_endpoint(db: Session = Depends(get_db)):
+async def create_monthly_coupon_endpoint(db: AsyncSession = Depends(get_async_db)):
     """Create monthly coupon campaign"""
     try:
         return await create_monthly_coupon(db)
@@ -23,7 +23,7 @@ async def create_monthly_coupon_endpoint(db: Session = Depends(get_db)):
 
 
 @router.get("/coupon-status")
-async def get_coupon_status_endpoint(db: Session = Depends(get_db)):
+async def get_coupon_status_endpoint(db: AsyncSession = Depends(get_async_db)):
     """Get current coupon status"""
     try:
         return await get_coupon_status(db)
@@ -32,7 +32,7 @@ async def get_coupon_status_endpoint(db: Session = Depends(get_db)):
 
 
 @router.post("/validate-promo-code")
-async def validate_promo_code_endpoint(request: PromoCodeValidationRequest, db: Session = Depends(get_db)):
+async def validate_promo_code_endpoint(request: PromoCodeValidationRequest, db: AsyncSession = Depends(get_async_db)):
     """Validate promo code"""
     try:
         return await validate_promo_code(request, db)
@@ -41,9 +41,9 @@ async def validate_promo_code_endpoint(request: PromoCodeValidationRequest, db:
 
 
 @router.get("/coupon-analytics")
-async def get_coupon_analytics_endpoint(db: Session = Depends(get_db)):
-    """Get coupon analytics"""
+async def get_coupon_analytics_endpoint(days: int = 30, db: AsyncSession = Depends(get_async_db)):
+    """Get coupon analytics for the last `days` days"""
     try:
-        return await get_coupon_analytics(db)
+        return await get_coupon_analytics(db, days)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,40 @@
+import asyncio
+import hmac
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Header, HTTPException
+from app.config.settings import ADMIN_API_TOKEN
+from app.services.job_queue import job_queue
+
+router = APIRouter()
+
+# Fields anyone holding a job ID may see; payloads, results and errors can carry email addresses
+PUBLIC_JOB_FIELDS = ("jobId", "kind", "status", "attempts", "maxAttempts", "runAfter", "createdAt", "finishedAt")
+
+
+def _is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_API_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_API_TOKEN)
+
+
+def _public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: job[field] for field in PUBLIC_JOB_FIELDS}
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: int, x_admin_token: Optional[str] = Header(None)):
+    """Status and attempts of a background job; payload, result and last error need the admin token"""
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job if _is_admin(x_admin_token) else _public_view(job)
+
+
+@router.post("/{job_id}/retry")
+async def retry_job(job_id: int, x_admin_token: Optional[str] = Header(None)):
+    """Put a dead-lettered job back on the queue (admin only: a Stannp job may already have printed)"""
+    if not _is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    job = await asyncio.to_thread(job_queue.requeue, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -0,0 +1,60 @@
+import asyncio
+
+from fastapi import APIRouter
+from app.models.database import pool_stats
+from app.services.coupon_cache import active_codes, coupon_cache, distribution_buffer
+from app.services.coupon_rollups import rollup_compactor
+from app.services.image_storage import image_storage
+from app.services.job_queue import job_queue
+from app.services.render_cache import render_cache
+from app.services.render_executor import render_executor
+from app.utils.image_cache import image_cache_stats
+
+router = APIRouter()
+
+
+@router.get("/render-executor")
+async def render_executor_metrics():
+    """Render pool queue depth and job outcomes"""
+    return render_executor.stats()
+
+
+@router.get("/render-cache")
+async def render_cache_metrics():
+    """Repeated identical render requests answered without rendering: hits, misses and hit rate"""
+    return render_cache.stats()
+
+
+@router.get("/image-cache")
+async def image_cache_metrics():
+    """Source photo cache hits, misses and evictions across render workers"""
+    return image_cache_stats()
+
+
+@router.get("/job-queue")
+async def job_queue_metrics():
+    """Background job counts by status, throughput and queue latency"""
+    return await asyncio.to_thread(job_queue.stats)  # Queries the jobs table on a sync session
+
+
+@router.get("/db-pool")
+async def db_pool_metrics():
+    """Database connection pool occupancy and checkout wait times"""
+    return pool_stats()
+
+
+@router.get("/coupon-cache")
+async def coupon_cache_metrics():
+    """Coupon code cache and promo code index hits, the coupon distribution write-behind buffer and rollup compaction"""
+    return {
+        "cache": coupon_cache.stats(),
+        "activeCodes": active_codes.stats(),
+        "distributionBuffer": distribution_buffer.stats(),
+        "rollupCompactor": rollup_compactor.stats()
+    }
+
+
+@router.get("/storage")
+async def storage_metrics():
+    """Image storage backend, stored images and bytes, failures and last store time"""
+    return image_storage.stats()
@@ -1,4 +1,6 @@
-from fastapi import APIRouter, HTTPException, Request, Header
+from fastapi import APIRouter, HTTPException, Request, Header, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.database import get_async_db
 from app.models.schemas import (
     PaymentConfirmedRequest,
     CreatePaymentSessionRequest,
@@ -60,7 +62,7 @@ async def stripe_webhook(request: Request, stripe_signature: str = Header(None))
 
 
 @router.get("/payment-status/{transaction_id}")
-async def get_payment_status_endpoint(transaction_id: str):
+async def get_payment_status_endpoint(transaction_id: str, db: AsyncSession = Depends(get_async_db)):
     """Get payment status for transaction"""
     from app.services.payment_service import get_payment_status
-    return await get_payment_status(transaction_id)
\ No newline at end of file
+    return await get_payment_status(transaction_id, db)
\ No newline at end of file
@@ -1,35 +1,55 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models.schemas import (
+    BatchPostcardRequest,
     PostcardRequest,
     StannpSubmissionRequest,
     FreePostcardRequest
 )
-from app.models.database import get_db
-from app.services.postcard_generation_service import generate_complete_postcard_service
+from app.models.database import get_db, get_async_db
+from app.services.postcard_generation_service import (
+    generate_complete_postcard_async,
+    generate_postcard_back_async,
+    generate_postcard_front_async,
+    preview_postcard_back_async,
+    preview_postcard_front_async
+)
+from app.services.batch_generation_service import start_postcard_batch
 from app.services.postcard_service import submit_to_stannp
+from app.services.render_executor import RenderQueueFull, RenderTimeout
 
 router = APIRouter()
 
 
+def render_unavailable(error: Exception) -> HTTPException:
+    """Map render executor back-pressure to a retryable HTTP error"""
+    if isinstance(error, RenderQueueFull):
+        return HTTPException(
+            status_code=503,
+            detail=str(error),
+            headers={"Retry-After": str(error.retry_after)}
+        )
+    return HTTPException(status_code=504, detail=str(error))
+
+
 @router.post("/generate-complete-postcard")
-async def generate_complete_postcard(request: PostcardRequest, db: Session = Depends(get_db)):
+async def generate_complete_postcard(request: PostcardRequest, db: AsyncSession = Depends(get_async_db)):
     """Generate both front and back images, upload to Cloudinary"""
     try:
-        from app.models.database import CouponCode, CouponDistribution
-        
         # Create transaction store
         transaction_store = {}
         
         # Call service with all required arguments
-        result = generate_complete_postcard_service(
+        result = await generate_complete_postcard_async(
             request=request,
             transaction_store=transaction_store,
-            db_session=db,
-            coupon_code_model=CouponCode,
-            coupon_distribution_model=CouponDistribution
+            db=db
         )
         return result
+    except (RenderQueueFull, RenderTimeout) as e:
+        raise render_unavailable(e)
     except Exception as e:
         print(f"[POSTCARD] Error generating postcard: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -56,34 +76,43 @@ async def get_transaction_status(transaction_id: str):
 
 
 @router.post("/generate-postcard-back")
-async def generate_postcard_back_endpoint(request: PostcardRequest):
-    """Generate postcard back only"""
+async def generate_postcard_back_endpoint(request: PostcardRequest, preview: bool = False, db: AsyncSession = Depends(get_async_db)):
+    """Generate postcard back only; the front is not fetched, rendered or uploaded. preview=true returns a small inline image instead"""
     try:
-        # Use the complete postcard generation service
-        from app.models.database import CouponCode, CouponDistribution
-        
-        # Create transaction store (simple dict for compatibility)
-        transaction_store = {}
-        
-        # Get database session
-        db = next(get_db())
-        
-        try:
-            # Call the complete service - it generates both front and back
-            result = generate_complete_postcard_service(
-                request=request,
-                transaction_store=transaction_store,
-                db_session=db,
-                coupon_code_model=CouponCode,
-                coupon_distribution_model=CouponDistribution
-            )
-            return result
-        finally:
-            db.close()
+        if preview:
+            return await preview_postcard_back_async(request)
+        return await generate_postcard_back_async(request=request, transaction_store={}, db=db)
+    except (RenderQueueFull, RenderTimeout) as e:
+        raise render_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/generate-postcard-front")
+async def generate_postcard_front_endpoint(request: PostcardRequest, preview: bool = False, db: AsyncSession = Depends(get_async_db)):
+    """Generate postcard front only; the back is left as it is. preview=true returns a small inline image instead"""
+    try:
+        if preview:
+            return await preview_postcard_front_async(request)
+        return await generate_postcard_front_async(request=request, transaction_store={}, db=db)
+    except (RenderQueueFull, RenderTimeout) as e:
+        raise render_unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/generate-postcard-batch")
+async def generate_postcard_batch_endpoint(request: BatchPostcardRequest):
+    """Generate one postcard per recipient from a shared message and front, streaming progress as JSON lines"""
+    try:
+        progress = await start_postcard_batch(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (RenderQueueFull, RenderTimeout) as e:
+        raise render_unavailable(e)
+    return StreamingResponse(progress, media_type="application/x-ndjson")
+
+
 @router.post("/process-free-postcard")
 async def process_free_postcard(request: FreePostcardRequest, db: Session = Depends(get_db)):
     """Process free postcard with promo code"""
@@ -91,4 +120,4 @@ async def process_free_postcard(request: FreePostcardRequest, db: Session = Depe
         # This would contain free postcard processing logic
         pass
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
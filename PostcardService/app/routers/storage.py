@@ -0,0 +1,15 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+import os
+from app.services.image_storage import LocalStorage, image_storage
+
+router = APIRouter()
+
+
+@router.get("/{key:path}")
+async def get_stored_image(key: str):
+    """Serve a published image when STORAGE_BACKEND=local"""
+    path = image_storage.path(key) if isinstance(image_storage, LocalStorage) else None
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path, media_type="image/jpeg")
@@ -0,0 +1,238 @@
+"""
+Batch postcard generation: one message and front sent to many recipients
+
+The front is composed and published once, under the batch ID, and shared by
+every postcard in the batch. Backs are rendered one executor job per
+recipient with at most one job per render worker in flight, so interactive
+requests still find a place in the queue; each worker draws the shared part
+of the back once (see render_batch_back_side). PostcardTransaction and
+CouponDistribution rows are written in bulk every BATCH_WRITE_ROWS finished
+recipients, and progress is streamed as newline-delimited JSON events:
+
+- ``started``: batchId, recipients, frontUrl, frontRendered
+- ``recipient``: index, transactionId, status, and the URLs or the error
+- ``recorded``: rows committed by the last bulk write and in total
+- ``done``: counts of succeeded, failed and recorded recipients
+
+Re-sending a batch with the same batchId and transaction IDs updates its
+transaction rows rather than duplicating them.
+"""
+import asyncio
+import json
+import uuid
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from app.config.settings import BATCH_MAX_RECIPIENTS, BATCH_WRITE_ROWS, PIPELINE_TIMINGS
+from app.models.schemas import BatchPostcardRequest
+from app.services.image_retention import queue_deletions_async, superseded_keys
+from app.services.image_storage import postcard_key
+from app.services.postcard_generation_service import (
+    PostcardRequest,
+    StageTimer,
+    get_next_month_coupon_code,
+    publish_blob,
+    recipient_address,
+    render_batch_back_side,
+    render_fingerprint,
+    render_front_side,
+    transaction_fields
+)
+
+QUEUE_FULL_BACKOFF_SECONDS = 0.2
+
+
+def batch_requests(batch: BatchPostcardRequest) -> Tuple[str, List[PostcardRequest]]:
+    """The batch ID and one PostcardRequest per recipient; raises ValueError for a batch that cannot be sent"""
+    if not batch.recipients:
+        raise ValueError("A batch needs at least one recipient")
+    if len(batch.recipients) > BATCH_MAX_RECIPIENTS:
+        raise ValueError(f"A batch can have at most {BATCH_MAX_RECIPIENTS} recipients")
+
+    batch_id = batch.batchId or f"batch-{uuid.uuid4().hex[:12]}"
+    shared = batch.model_dump(exclude={"batchId", "recipients"})
+    requests = [
+        PostcardRequest(
+            **shared,
+            recipientInfo=recipient.model_dump(exclude={"transactionId"}),
+            transactionId=recipient.transactionId or f"{batch_id}-{position}"
+        )
+        for position, recipient in enumerate(batch.recipients, 1)
+    ]
+    if len({request.transactionId for request in requests}) < len(requests):
+        raise ValueError("Transaction IDs must be unique within a batch")
+    return batch_id, requests
+
+
+async def render_batch_front(batch_id: str, request: PostcardRequest, timer: StageTimer) -> Optional[str]:
+    """Compose and publish the shared front; None when it could not be composed"""
+    from app.services.render_executor import render_executor
+
+    rendered = await timer.time("renderFront", render_executor.run(render_front_side, request))
+    if rendered["frontBlob"] is None:
+        return None
+    key = postcard_key(batch_id, "front", render_fingerprint(request, "front"))
+    return await timer.time("uploadFront", publish_blob(rendered["frontBlob"], key))
+
+
+async def _render_recipient(index: int, request: PostcardRequest, front_url: Optional[str],
+                            slots: asyncio.Semaphore) -> Dict:
+    """Render and publish one recipient's back; failures are reported in the result, not raised"""
+    from app.services.render_executor import RenderQueueFull, render_executor
+
+    try:
+        async with slots:
+            while True:
+                try:
+                    rendered = await render_executor.run(render_batch_back_side, request)
+                    break
+                except RenderQueueFull:
+                    # Interactive requests filled the queue; wait for room rather than failing the recipient
+                    await asyncio.sleep(QUEUE_FULL_BACKOFF_SECONDS)
+        fingerprint = render_fingerprint(request, "back", get_next_month_coupon_code())
+        back_url = await publish_blob(rendered["backBlob"], postcard_key(request.transactionId, "back", fingerprint))
+        return {
+            "index": index,
+            "transactionId": request.transactionId,
+            "status": "ready_for_payment",
+            "frontUrl": front_url or back_url,  # As for a single postcard, the back stands in for a missing front
+            "backUrl": back_url,
+            "messageFontSize": rendered["messageFontSize"],
+            "messageTruncated": rendered["messageTruncated"]
+        }
+    except Exception as e:
+        print(f"[BATCH] Recipient {index} ({request.transactionId}) failed: {e}")
+        return {"index": index, "transactionId": request.transactionId, "status": "failed", "error": str(e)}
+
+
+async def _record_recipients(finished: List[Tuple[PostcardRequest, Dict]], user_email: str, coupon_code_id: Optional[int]) -> int:
+    """
+    Bulk upsert the finished recipients' transactions with their coupon distributions; returns rows committed
+
+    As for a single postcard, if the combined commit fails the transactions
+    are retried on their own, since Stannp submission needs them and the
+    coupon analytics do not, and renders a rerun recipient's row stops
+    pointing at are queued for deletion.
+    """
+    from app.models.database import AsyncSessionLocal
+    from app.repositories import coupons as coupons_repo
+    from app.repositories import transactions as transactions_repo
+
+    fields_by_id = {
+        request.transactionId: transaction_fields(request, result["frontUrl"], result["backUrl"])
+        for request, result in finished
+    }
+    distributions = [
+        {
+            "coupon_code_id": coupon_code_id,
+            "transaction_id": request.transactionId,
+            "recipient_name": request.recipientInfo.to,
+            "recipient_address": recipient_address(request),
+            "postcard_size": request.postcardSize
+        }
+        for request, _ in finished
+    ] if coupon_code_id is not None else []
+
+    async with AsyncSessionLocal() as db:
+        for with_coupon_tracking in (True, False):
+            try:
+                previous = await transactions_repo.get_image_urls(db, list(fields_by_id))
+                await transactions_repo.upsert_transactions(db, fields_by_id, user_email)
+                if with_coupon_tracking:
+                    await coupons_repo.add_distributions(db, distributions)
+                await db.commit()
+                break
+            except Exception as e:
+                retry_note = "; retrying without coupon tracking" if with_coupon_tracking else ""
+                print(f"[BATCH] Warning: Could not store {len(fields_by_id)} transactions: {e}{retry_note}")
+                await db.rollback()
+        else:
+            return 0
+
+    for transaction_id, urls in previous.items():
+        superseded = superseded_keys(transaction_id, urls, fields_by_id[transaction_id])
+        try:
+            await queue_deletions_async(transaction_id, superseded)
+        except Exception as e:
+            print(f"[BATCH] Warning: Could not queue deletion of replaced images {superseded}: {e}")
+    return len(fields_by_id)
+
+
+async def _coupon_code_id() -> Optional[int]:
+    """ID of the monthly code printed on the backs, or None when distributions cannot be tracked"""
+    from app.models.database import AsyncSessionLocal
+    from app.services.coupon_cache import coupon_cache
+
+    try:
+        async with AsyncSessionLocal() as db:
+            coupon = await coupon_cache.get(db, get_next_month_coupon_code())
+        return coupon.id if coupon else None
+    except Exception as e:
+        print(f"[BATCH] Error looking up the coupon code, distributions will not be tracked: {e}")
+        return None
+
+
+def _event(event: str, **fields) -> str:
+    return json.dumps({"event": event, **fields}) + "\n"
+
+
+async def _stream_batch(batch_id: str, requests: List[PostcardRequest], front_url: Optional[str],
+                        front_rendered: bool, user_email: str, timer: StageTimer) -> AsyncIterator[str]:
+    from app.services.render_executor import render_executor
+
+    yield _event("started", batchId=batch_id, recipients=len(requests), frontUrl=front_url, frontRendered=front_rendered)
+
+    coupon_code_id = await _coupon_code_id()
+    slots = asyncio.Semaphore(render_executor.workers)
+    tasks = [
+        asyncio.ensure_future(_render_recipient(index, request, front_url, slots))
+        for index, request in enumerate(requests)
+    ]
+    succeeded = failed = recorded = 0
+    finished: List[Tuple[PostcardRequest, Dict]] = []
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            yield _event("recipient", **result)
+            if result["status"] == "failed":
+                failed += 1
+                continue
+            succeeded += 1
+            finished.append((requests[result["index"]], result))
+            if len(finished) >= BATCH_WRITE_ROWS:
+                committed = await _record_recipients(finished, user_email, coupon_code_id)
+                recorded += committed
+                finished = []
+                yield _event("recorded", count=committed, total=recorded)
+        if finished:
+            committed = await _record_recipients(finished, user_email, coupon_code_id)
+            recorded += committed
+            yield _event("recorded", count=committed, total=recorded)
+    finally:
+        # Only does anything when the client went away mid-batch: stop rendering for it
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    summary = {"batchId": batch_id, "succeeded": succeeded, "failed": failed, "recorded": recorded}
+    if PIPELINE_TIMINGS:
+        summary["timings"] = timer.report()
+    print(f"[BATCH] Batch {batch_id} done: {succeeded} succeeded, {failed} failed, {recorded} recorded")
+    yield _event("done", **summary)
+
+
+async def start_postcard_batch(batch: BatchPostcardRequest) -> AsyncIterator[str]:
+    """
+    Validate the batch and publish its front, then return the stream that renders the backs
+
+    The front is rendered before anything is streamed so that a saturated or
+    failing executor surfaces as an error response. Raises ValueError for an
+    invalid batch, and RenderQueueFull or RenderTimeout from the front render.
+    """
+    timer = StageTimer()
+    batch_id, requests = batch_requests(batch)
+    print(f"[BATCH] Generating {len(requests)} {batch.postcardSize} postcards for batch {batch_id}")
+    front_url = await render_batch_front(batch_id, requests[0], timer)
+    front_rendered = front_url is not None
+    if not front_rendered and requests[0].frontImageUri and requests[0].frontImageUri.startswith('http'):
+        front_url = requests[0].frontImageUri
+    return _stream_batch(batch_id, requests, front_url, front_rendered, batch.userEmail or "", timer)
@@ -0,0 +1,286 @@
+"""
+Coupon code caches and write-behind buffer for coupon distributions
+
+Every generated postcard carries the monthly promo code and records a
+coupon_distributions row. The code row only changes when a campaign is
+created or deactivated, so ActiveCouponCache keeps a snapshot of it per code
+for COUPON_CACHE_TTL_SECONDS. ORM inserts, updates and deletes of CouponCode
+in this process invalidate it at once; other uvicorn workers see the change
+when their entry expires. ActiveCodeIndex holds every active code for promo
+code validation and is invalidated the same way.
+
+Distribution rows are analytics only, so DistributionBuffer takes them off
+the request path: rows are queued in memory and inserted in one batch every
+DISTRIBUTION_FLUSH_ROWS rows or DISTRIBUTION_FLUSH_SECONDS seconds. A failed
+flush keeps its rows for the next one. Graceful shutdown flushes whatever is
+left. A crash (SIGKILL, OOM) loses at most the unflushed rows; the
+transaction rows Stannp submission depends on are still written per request.
+"""
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.settings import (
+    COUPON_CACHE_TTL_SECONDS,
+    DISTRIBUTION_FLUSH_ROWS,
+    DISTRIBUTION_FLUSH_SECONDS,
+    DISTRIBUTION_MAX_PENDING
+)
+from app.models.database import AsyncSessionLocal, CouponCode, CouponDistribution
+
+
+class ActiveCoupon(NamedTuple):
+    id: int
+    code: str
+    expires_at: Optional[datetime]
+    is_active: bool
+
+
+class ActiveCouponCache:
+    """Per-process snapshot of coupon code rows, refreshed after ttl_seconds or on invalidation"""
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[Optional[ActiveCoupon], float]] = {}
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    async def get(self, db: AsyncSession, code: str) -> Optional[ActiveCoupon]:
+        """The coupon row for code, or None if there is none; a missing code is cached too"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is not None and now - entry[1] < self.ttl_seconds:
+                self._counts["hits"] += 1
+                return entry[0]
+            self._counts["misses"] += 1
+
+        from app.repositories import coupons as coupons_repo
+        record = await coupons_repo.get_coupon_by_code(db, code)
+        coupon = ActiveCoupon(record.id, record.code, record.expires_at, bool(record.is_active)) if record else None
+
+        with self._lock:
+            # Drop expired entries so codes from past months do not pile up
+            self._entries = {key: value for key, value in self._entries.items() if now - value[1] < self.ttl_seconds}
+            self._entries[code] = (coupon, now)
+        return coupon
+
+    def invalidate(self, code: Optional[str] = None):
+        """Forget one code, or every code when code is None"""
+        with self._lock:
+            if code is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(code, None)
+            self._counts["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "ttlSeconds": self.ttl_seconds, **self._counts}
+
+
+class IndexedCode(NamedTuple):
+    id: int
+    code: str
+    max_redemptions: Optional[int]  # None: unlimited
+    times_redeemed: int
+    expires_at: Optional[datetime]
+    discount_percent: int
+
+
+class ActiveCodeIndex:
+    """
+    Every active coupon code held in memory for promo code validation, keyed case-insensitively
+
+    The whole set is reloaded after ttl_seconds, on invalidation, or (at most
+    every miss_reload_seconds) when a code is not found, so a code created by
+    another worker is picked up quickly. Redemption counts can lag behind
+    other workers; the redemption UPDATE itself enforces the limit.
+    """
+
+    miss_reload_seconds = 10.0
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._codes: Dict[str, IndexedCode] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._reload_lock: Optional[asyncio.Lock] = None
+        self._counts = {"hits": 0, "misses": 0, "reloads": 0, "invalidations": 0}
+
+    async def _reload(self, db: AsyncSession, stale_before: float):
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        async with self._reload_lock:
+            # Another request may have reloaded while this one waited
+            if self._loaded_at is not None and self._loaded_at >= stale_before:
+                return
+            from app.repositories import coupons as coupons_repo
+            started = time.monotonic()
+            rows = await coupons_repo.load_active_codes(db, datetime.utcnow())
+            with self._lock:
+                self._codes = {row.code.upper(): IndexedCode(*row) for row in rows}
+                self._loaded_at = started
+                self._counts["reloads"] += 1
+
+    async def lookup(self, db: AsyncSession, code: str) -> Optional[IndexedCode]:
+        """The active code matching code in any case, or None"""
+        key = code.strip().upper()
+        now = time.monotonic()
+        if self._loaded_at is None or now - self._loaded_at >= self.ttl_seconds:
+            await self._reload(db, now - self.ttl_seconds)
+        entry = self._codes.get(key)
+        # invalidate() may have cleared _loaded_at while the reload was awaited
+        loaded_at = self._loaded_at
+        if entry is None and (loaded_at is None or now - loaded_at >= self.miss_reload_seconds):
+            await self._reload(db, now - self.miss_reload_seconds)
+            entry = self._codes.get(key)
+        with self._lock:
+            self._counts["hits" if entry is not None else "misses"] += 1
+        return entry
+
+    def record_redemption(self, code: str, times_redeemed: int):
+        """Apply a count returned by a redemption in this process"""
+        with self._lock:
+            entry = self._codes.get(code.upper())
+            if entry is not None:
+                self._codes[code.upper()] = entry._replace(times_redeemed=max(entry.times_redeemed, times_redeemed))
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self._counts["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"codes": len(self._codes), "ttlSeconds": self.ttl_seconds, **self._counts}
+
+
+class DistributionBuffer:
+    """In-memory queue of coupon_distributions rows inserted in batches by a background task"""
+
+    def __init__(self, flush_rows: int, flush_seconds: float, max_pending: int):
+        self.flush_rows = max(1, flush_rows)
+        self.flush_seconds = flush_seconds
+        self.max_pending = max(self.flush_rows, max_pending)
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+        self._counts = {"added": 0, "flushed": 0, "flushes": 0, "failedFlushes": 0, "dropped": 0}
+        self._last_flush_ms: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def add(self, row: Dict[str, Any]):
+        """Queue a distribution row; sent_at is taken now (UTC, like the column default) rather than when the batch is written"""
+        row.setdefault("sent_at", datetime.utcnow())
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                # The database has been unreachable for a while; keep the newest rows
+                self._pending.pop(0)
+                self._counts["dropped"] += 1
+            self._pending.append(row)
+            self._counts["added"] += 1
+            full = len(self._pending) >= self.flush_rows
+        if full and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Insert everything queued so far in one statement; returns the number of rows written"""
+        async with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(insert(CouponDistribution), batch)
+                    await db.commit()
+            except Exception as e:
+                with self._lock:
+                    # Put the batch back in front of rows added meanwhile, within the pending cap
+                    retained = batch + self._pending
+                    self._counts["dropped"] += max(0, len(retained) - self.max_pending)
+                    self._pending = retained[-self.max_pending:]
+                    self._counts["failedFlushes"] += 1
+                print(f"[COUPON] Could not flush {len(batch)} coupon distributions, will retry: {e}")
+                raise
+
+            with self._lock:
+                self._counts["flushed"] += len(batch)
+                self._counts["flushes"] += 1
+                self._last_flush_ms = round((time.perf_counter() - started) * 1000, 1)
+            return len(batch)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                pass  # Already logged; the rows wait for the next flush
+
+    def start(self):
+        """Start the flush task on the running event loop"""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        print(f"[COUPON] Distribution buffer started (every {self.flush_rows} rows or {self.flush_seconds:g}s)")
+
+    async def stop(self):
+        """Stop the flush task and write out every queued row"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        try:
+            written = await self.flush()
+            print(f"[COUPON] Distribution buffer stopped, flushed {written} remaining rows")
+        except Exception:
+            print(f"[COUPON] Distribution buffer stopped with {len(self._pending)} rows unwritten")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self.running,
+                "pending": len(self._pending),
+                "flushRows": self.flush_rows,
+                "flushSeconds": self.flush_seconds,
+                **self._counts,
+                "lastFlushMs": self._last_flush_ms
+            }
+
+
+coupon_cache = ActiveCouponCache(COUPON_CACHE_TTL_SECONDS)
+active_codes = ActiveCodeIndex(COUPON_CACHE_TTL_SECONDS)
+distribution_buffer = DistributionBuffer(DISTRIBUTION_FLUSH_ROWS, DISTRIBUTION_FLUSH_SECONDS, DISTRIBUTION_MAX_PENDING)
+
+
+@event.listens_for(CouponCode, "after_insert")
+@event.listens_for(CouponCode, "after_update")
+@event.listens_for(CouponCode, "after_delete")
+def _invalidate_coupons(mapper, connection, target):
+    # Created, deactivated, renamed or removed through the ORM in this process
+    coupon_cache.invalidate()
+    active_codes.invalidate()
@@ -0,0 +1,73 @@
+"""
+Periodic compaction of coupon distributions and redemptions into coupon_daily_stats
+
+Every process runs one compactor task. Runs in different workers race on the
+watermark update in app/repositories/coupon_stats.py, which also refuses a
+run within interval_seconds of the last one in any worker, so only one of
+them folds each batch of rows and the lag behind inserts holds across workers. Analytics reads stay exact between runs because
+they add the unfolded tail themselves; compaction only keeps that tail short.
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from app.config.settings import COUPON_ROLLUP_INTERVAL_SECONDS
+from app.models.database import AsyncSessionLocal
+from app.repositories import coupon_stats
+
+
+class RollupCompactor:
+    """Background task folding new coupon rows into the daily rollup every interval_seconds"""
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._counts = {"runs": 0, "failedRuns": 0, "rowIdsFolded": 0}
+        self._last_run_ms: Optional[float] = None
+
+    async def run_once(self) -> Dict[str, int]:
+        """Compact every source table once; returns ids folded per table"""
+        started = time.perf_counter()
+        folded = {}
+        for source in coupon_stats.SOURCES:
+            async with AsyncSessionLocal() as db:
+                folded[source] = await coupon_stats.compact(db, source, self.interval_seconds)
+        self._counts["runs"] += 1
+        self._counts["rowIdsFolded"] += sum(folded.values())
+        self._last_run_ms = round((time.perf_counter() - started) * 1000, 1)
+        return folded
+
+    async def _run(self):
+        while True:
+            try:
+                folded = await self.run_once()
+                if any(folded.values()):
+                    print(f"[COUPON] Folded coupon rows into daily stats: {folded} in {self._last_run_ms}ms")
+            except Exception as e:
+                self._counts["failedRuns"] += 1
+                print(f"[COUPON] Coupon stats compaction failed, will retry: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """Start the compaction task on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancel the task; a run cut short rolls back and the next start picks it up"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "intervalSeconds": self.interval_seconds,
+            **self._counts,
+            "lastRunMs": self._last_run_ms
+        }
+
+
+rollup_compactor = RollupCompactor(COUPON_ROLLUP_INTERVAL_SECONDS)
@@ -1,30 +1,150 @@
 """
 Coupon management service for creating, validating, and tracking coupon usage
 """
-from typing import Dict, Any
-from sqlalchemy.orm import Session
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Iterable, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.schemas import PromoCodeValidationRequest
+from app.repositories import coupon_stats
+from app.repositories import coupons as coupons_repo
 
 
-async def create_monthly_coupon(db: Session) -> Dict[str, Any]:
+async def create_monthly_coupon(db: AsyncSession) -> Dict[str, Any]:
     """Create monthly coupon campaign"""
     # TODO: Extract monthly coupon creation logic from main.py
     pass
 
 
-async def validate_promo_code(request: PromoCodeValidationRequest, db: Session) -> Dict[str, Any]:
-    """Validate promo code"""
-    # TODO: Extract promo code validation logic from main.py
-    pass
+def _conversion_rate(distributions: int, redemptions: int) -> Optional[float]:
+    return round(redemptions / distributions, 4) if distributions else None
+
+
+def _totals(rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    distributions = redemptions = value_cents = 0
+    for row in rows:
+        distributions += row["distributions"]
+        redemptions += row["redemptions"]
+        value_cents += row["redemption_value_cents"]
+    return {
+        "distributions": distributions,
+        "redemptions": redemptions,
+        "conversionRate": _conversion_rate(distributions, redemptions),
+        "redemptionValueCents": value_cents
+    }
+
+
+def _grouped(rows, key) -> Dict[Any, Dict[str, Any]]:
+    groups = defaultdict(list)
+    for row in rows:
+        groups[row[key]].append(row)
+    return {name: _totals(group) for name, group in groups.items()}
+
+
+class PromoCodeRejected(Exception):
+    """Raised when a promo code cannot be applied to an order"""
+
+
+async def validate_promo_code(request: PromoCodeValidationRequest, db: AsyncSession) -> Dict[str, Any]:
+    """Validate promo code against the in-memory index of active codes"""
+    from app.services.coupon_cache import active_codes
+
+    code = request.code.strip()
+    coupon = await active_codes.lookup(db, code)
+    if coupon is None:
+        return {"valid": False, "code": code, "message": "Invalid or expired promo code"}
+    if coupon.expires_at and coupon.expires_at <= datetime.utcnow():
+        return {"valid": False, "code": coupon.code, "message": "This promo code has expired"}
+
+    remaining = None if coupon.max_redemptions is None else coupon.max_redemptions - coupon.times_redeemed
+    if remaining is not None and remaining <= 0:
+        return {"valid": False, "code": coupon.code, "message": "This promo code has reached its redemption limit"}
+
+    print(f"[COUPON] Promo code {coupon.code} valid for {request.transactionId or 'unknown transaction'}")
+    return {
+        "valid": True,
+        "code": coupon.code,
+        "discount_percent": coupon.discount_percent,  # Read by the app under this name
+        "remaining": remaining,
+        "message": f"Promo code applied: {coupon.discount_percent}% off"
+    }
 
 
-async def get_coupon_status(db: Session) -> Dict[str, Any]:
+async def redeem_promo_code(code: str, transaction_id: str, customer_email: str, db: AsyncSession,
+                            stripe_payment_intent_id: Optional[str] = None) -> Dict[str, Any]:
+    """Count one use of the code for this transaction; raises PromoCodeRejected when it cannot be used"""
+    from app.services.coupon_cache import active_codes
+
+    coupon = await active_codes.lookup(db, code)
+    if coupon is None:
+        raise PromoCodeRejected("Invalid or expired promo code")
+
+    # A retried request for the same order must not use the code twice
+    already_redeemed = {"code": coupon.code, "discount_percent": coupon.discount_percent, "alreadyRedeemed": True}
+    existing = await coupons_repo.get_redemption(db, coupon.id, transaction_id)
+    if existing is not None:
+        return already_redeemed
+
+    try:
+        counted = await coupons_repo.redeem_coupon(db, coupon.id, transaction_id, customer_email, stripe_payment_intent_id)
+    except coupons_repo.DuplicateRedemption:
+        # A concurrent request for the same order recorded its redemption first
+        return already_redeemed
+    if counted is None:
+        raise PromoCodeRejected("This promo code has reached its redemption limit or is no longer active")
+
+    times_redeemed, max_redemptions = counted
+    active_codes.record_redemption(coupon.code, times_redeemed)
+    print(f"[COUPON] Redeemed {coupon.code} for {transaction_id} ({times_redeemed}/{max_redemptions})")
+    return {
+        "code": coupon.code,
+        "discount_percent": coupon.discount_percent,
+        "remaining": None if max_redemptions is None else max_redemptions - times_redeemed,
+        "alreadyRedeemed": False
+    }
+
+
+async def get_coupon_status(db: AsyncSession) -> Dict[str, Any]:
     """Get current coupon status"""
-    # TODO: Extract coupon status logic from main.py
-    pass
+    from app.services.postcard_generation_service import get_next_month_coupon_code
+
+    active = await coupons_repo.get_active_codes(db, datetime.utcnow())
+    totals = {}
+    if active:
+        since = min((coupon.created_at.date() for coupon in active if coupon.created_at), default=date(2000, 1, 1))
+        totals = _grouped(await coupon_stats.daily_stats(db, since), "coupon_code_id")
+
+    return {
+        "printingCode": get_next_month_coupon_code(),
+        "activeCodes": [
+            {
+                "code": coupon.code,
+                "timesRedeemed": coupon.times_redeemed or 0,
+                "maxRedemptions": coupon.max_redemptions,
+                "remaining": None if coupon.max_redemptions is None else max(0, coupon.max_redemptions - (coupon.times_redeemed or 0)),
+                "expiresAt": coupon.expires_at.isoformat() if coupon.expires_at else None,
+                **totals.get(coupon.id, _totals([]))
+            }
+            for coupon in active
+        ]
+    }
 
 
-async def get_coupon_analytics(db: Session) -> Dict[str, Any]:
+async def get_coupon_analytics(db: AsyncSession, days: int = 30) -> Dict[str, Any]:
     """Get coupon analytics"""
-    # TODO: Extract coupon analytics logic from main.py
-    pass
\ No newline at end of file
+    # Rollup days are UTC dates of sent_at and redeemed_at, so the window is counted in UTC days too
+    since = datetime.utcnow().date() - timedelta(days=max(0, days - 1))
+    rows = await coupon_stats.daily_stats(db, since)
+
+    by_code = _grouped(rows, "coupon_code_id")
+    codes = await coupons_repo.get_codes(db, by_code) if by_code else {}
+    daily = _grouped(rows, "day")
+
+    return {
+        "since": since.isoformat(),
+        "totals": _totals(rows),
+        "byCode": [{"code": codes.get(code_id), **stats} for code_id, stats in by_code.items()],
+        "bySize": [{"postcardSize": size, **stats} for size, stats in sorted(_grouped(rows, "postcard_size").items())],
+        "daily": [{"day": day.isoformat(), **stats} for day, stats in sorted(daily.items())],
+        "rollupWatermarks": await coupon_stats.watermarks(db)
+    }
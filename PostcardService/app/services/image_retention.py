@@ -0,0 +1,69 @@
+"""
+Deletion of superseded postcard renders
+
+Every render is published under its own fingerprinted key (see postcard_key),
+so re-rendering a transaction leaves its previous image in storage. Once the
+transaction row points at the new image, each of its own renders the row no
+longer references is queued for deletion after
+SUPERSEDED_IMAGE_RETENTION_SECONDS, and never sooner than
+RENDER_CACHE_TTL_SECONDS so no worker's render cache can still hand its URL
+out. The job leaves an image alone if the row points at it again by then.
+Fronts shared by a batch are stored under the batch ID and are not deleted.
+"""
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.config.settings import RENDER_CACHE_TTL_SECONDS, SUPERSEDED_IMAGE_RETENTION_SECONDS
+from app.services.image_storage import image_storage, rendered_postcard_key
+from app.services.job_queue import job_queue
+
+URL_COLUMNS = ("front_url", "back_url")
+
+
+def _rendered_keys(transaction_id: str, urls: Iterable[Optional[str]]) -> set:
+    return {key for key in (rendered_postcard_key(url, transaction_id) for url in urls if url) if key}
+
+
+def superseded_keys(transaction_id: str, previous: Optional[Dict[str, Optional[str]]], fields: Dict[str, Any]) -> List[str]:
+    """Storage keys of the transaction's renders that writing fields over its previous URL columns leaves unreferenced"""
+    if not previous:
+        return []
+    current = {column: fields[column] if column in fields else previous.get(column) for column in URL_COLUMNS}
+    return sorted(
+        _rendered_keys(transaction_id, (previous.get(column) for column in URL_COLUMNS))
+        - _rendered_keys(transaction_id, current.values())
+    )
+
+
+def queue_deletions(transaction_id: str, keys: List[str]):
+    """Queue superseded renders for deletion once the retention period has passed; blocking, so async callers use a thread"""
+    for key in keys:
+        job_queue.enqueue(
+            "delete_superseded_image",
+            {"transactionId": transaction_id, "key": key},
+            delay_seconds=max(SUPERSEDED_IMAGE_RETENTION_SECONDS, RENDER_CACHE_TTL_SECONDS)
+        )
+
+
+async def queue_deletions_async(transaction_id: str, keys: List[str]):
+    if keys:
+        await asyncio.to_thread(queue_deletions, transaction_id, keys)
+
+
+async def run_delete_superseded_image_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Delete a replaced render unless its transaction points at it again (delete_superseded_image job handler)"""
+    from app.models.database import AsyncSessionLocal
+    from app.repositories import transactions as transactions_repo
+
+    transaction_id, key = payload["transactionId"], payload["key"]
+    async with AsyncSessionLocal() as db:
+        stored = await transactions_repo.get_image_urls(db, [transaction_id])
+    # A render from the same inputs again publishes under the same key
+    if key in _rendered_keys(transaction_id, stored.get(transaction_id, {}).values()):
+        print(f"[STORAGE] Keeping {key}: transaction {transaction_id} points at it again")
+        return {"deleted": False}
+    await image_storage.delete(key)
+    return {"deleted": True}
+
+
+job_queue.register("delete_superseded_image", run_delete_superseded_image_job)
@@ -0,0 +1,310 @@
+"""
+Image storage for published postcard sides
+
+Rendered sides are published under keys such as
+``postcards/backs/postcard-back-{transactionId}-{version}.jpg`` and every
+public URL is built here, by the backend that stored the image. STORAGE_BACKEND selects:
+
+- ``cloudinary`` (default): signed uploads to the Cloudinary REST API over
+  one pooled httpx.AsyncClient per process. Files are sent as streamed
+  multipart bodies, in UPLOAD_CHUNK_MB parts with Cloudinary's chunked
+  upload headers when larger, so no upload holds a whole image in memory.
+- ``local``: files under STORAGE_LOCAL_DIR, served by the app at /storage/
+  when PUBLIC_BASE_URL is set and addressed as file:// URLs otherwise, so
+  load tests can run without network access.
+"""
+import asyncio
+import os
+import re
+from abc import ABC, abstractmethod
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import cloudinary
+import cloudinary.utils
+import httpx
+
+from app.config.settings import (
+    PUBLIC_BASE_URL,
+    STORAGE_BACKEND,
+    STORAGE_LOCAL_DIR,
+    STORAGE_MAX_CONNECTIONS,
+    STORAGE_TIMEOUT_SECONDS,
+    UPLOAD_CHUNK_MB
+)
+
+
+POSTCARD_FOLDER = "postcards/backs"  # Fronts live here too; the folder name predates them
+
+
+def postcard_key(transaction_id: str, side: str, version: str = "") -> str:
+    """
+    Storage key of one side ("front" or "back") of a postcard
+
+    Renders pass their render fingerprint as version, so an image is never
+    overwritten by a render from different inputs and a URL handed out once
+    keeps showing the same image.
+    """
+    suffix = f"-{version[:16]}" if version else ""
+    return f"{POSTCARD_FOLDER}/postcard-{side}-{transaction_id}{suffix}.jpg"
+
+
+def rendered_postcard_key(url: str, transaction_id: str) -> Optional[str]:
+    """The versioned key of one of this transaction's renders that url points to, or None for any other image"""
+    name = url.split("?", 1)[0].rsplit("/", 1)[-1]
+    if re.fullmatch(rf"postcard-(front|back)-{re.escape(transaction_id)}-[0-9a-f]{{16}}\.jpg", name):
+        return f"{POSTCARD_FOLDER}/{name}"
+    return None
+
+
+class ImageStorage(ABC):
+    """Where published images live and how their public URLs are formed; backends implement _put, get, exists, delete and url"""
+
+    name = "base"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"puts": 0, "failedPuts": 0, "bytesPut": 0}
+        self._last_put_ms: Optional[float] = None
+
+    async def put(self, key: str, path: str) -> str:
+        """Store the file at path under key, replacing any earlier image; returns its public URL"""
+        started = time.perf_counter()
+        try:
+            url = await self._put(key, path)
+        except Exception:
+            with self._lock:
+                self._counts["failedPuts"] += 1
+            raise
+        with self._lock:
+            self._counts["puts"] += 1
+            self._counts["bytesPut"] += os.path.getsize(path)
+            self._last_put_ms = round((time.perf_counter() - started) * 1000, 1)
+        return url
+
+    @abstractmethod
+    async def _put(self, key: str, path: str) -> str:
+        """Store the file at path under key; returns its public URL"""
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        """Bytes of the image stored under key"""
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Whether an image is stored under key"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Remove the image stored under key; a key with no image is not an error"""
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+        """Public URL of the image stored under key"""
+
+    async def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": self.name, **self._counts, "lastPutMs": self._last_put_ms}
+
+
+class _FileRange:
+    """Read-only view of part of an open file, so httpx streams one upload chunk without loading it"""
+
+    def __init__(self, file, start: int, length: int):
+        self.name = getattr(file, "name", "upload")
+        self._file = file
+        self._start = start
+        self._length = length
+        self._pos = 0
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: self._length}[whence]
+        self._pos = min(max(0, base + offset), self._length)
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self._length - self._pos
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        self._file.seek(self._start + self._pos)
+        data = self._file.read(size)
+        self._pos += len(data)
+        return data
+
+
+class CloudinaryStorage(ImageStorage):
+    """Cloudinary image uploads over a shared connection pool"""
+
+    name = "cloudinary"
+    api_url = "https://api.cloudinary.com/v1_1"
+
+    def __init__(self, chunk_bytes: int, timeout: float, max_connections: int):
+        super().__init__()
+        self.chunk_bytes = chunk_bytes
+        self.timeout = httpx.Timeout(timeout)
+        self.max_connections = max(1, max_connections)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _http(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._client
+
+    async def close(self):
+        """Close pooled connections (called on app shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            print("[STORAGE] Cloudinary connections closed")
+
+    @staticmethod
+    def _public_id(key: str) -> str:
+        return os.path.splitext(key)[0]
+
+    def _signed_params(self, public_id: str, **options: str) -> Dict[str, str]:
+        # Credentials are read per call: configure_services() sets them at startup
+        config = cloudinary.config()
+        params = {"public_id": public_id, **options, "timestamp": str(int(time.time()))}
+        params["signature"] = cloudinary.utils.api_sign_request(params, config.api_secret)
+        params["api_key"] = config.api_key
+        return params
+
+    async def _put(self, key: str, path: str) -> str:
+        total = os.path.getsize(path)
+        public_id = self._public_id(key)
+        upload_url = f"{self.api_url}/{cloudinary.config().cloud_name}/image/upload"
+        upload_id = uuid.uuid4().hex
+        print(f"[STORAGE] Uploading {key} to Cloudinary, size: {total} bytes")
+
+        result: Dict[str, Any] = {}
+        with open(path, "rb") as f:
+            for start in range(0, max(total, 1), self.chunk_bytes):
+                length = min(self.chunk_bytes, total - start)
+                headers = {}
+                if total > self.chunk_bytes:
+                    headers = {"Content-Range": f"bytes {start}-{start + length - 1}/{total}", "X-Unique-Upload-Id": upload_id}
+                response = await self._http().post(
+                    upload_url,
+                    data=self._signed_params(public_id, overwrite="true", unique_filename="false"),
+                    files={"file": (os.path.basename(key), _FileRange(f, start, length), "image/jpeg")},
+                    headers=headers
+                )
+                try:
+                    result = response.json()
+                except ValueError:
+                    result = {}
+                if response.status_code >= 400:
+                    raise RuntimeError(f"Cloudinary upload failed with {response.status_code}: {result.get('error', result)}")
+
+        print(f"[STORAGE] Cloudinary upload successful: {result['secure_url']}")
+        return result["secure_url"]
+
+    async def get(self, key: str) -> bytes:
+        response = await self._http().get(self.url(key))
+        response.raise_for_status()
+        return response.content
+
+    async def exists(self, key: str) -> bool:
+        response = await self._http().head(self.url(key))
+        return response.status_code == 200
+
+    async def delete(self, key: str):
+        response = await self._http().post(
+            f"{self.api_url}/{cloudinary.config().cloud_name}/image/destroy",
+            data=self._signed_params(self._public_id(key), invalidate="true")
+        )
+        if response.status_code >= 400:
+            raise RuntimeError(f"Cloudinary delete of {key} failed with {response.status_code}: {response.text}")
+        print(f"[STORAGE] Deleted {key} from Cloudinary: {response.json().get('result')}")
+
+    def url(self, key: str) -> str:
+        return f"https://res.cloudinary.com/{cloudinary.config().cloud_name}/image/upload/{key}"
+
+
+class LocalStorage(ImageStorage):
+    """Images kept on local disk, for development and offline load tests"""
+
+    name = "local"
+
+    def __init__(self, directory: str, base_url: str):
+        super().__init__()
+        self.directory = os.path.abspath(directory)
+        self.base_url = base_url.rstrip("/")
+
+    def path(self, key: str) -> Optional[str]:
+        """Filesystem path for a key, or None if the key would escape the storage directory"""
+        path = os.path.abspath(os.path.join(self.directory, key))
+        if not path.startswith(self.directory + os.sep):
+            return None
+        return path
+
+    def _copy(self, key: str, source: str):
+        path = self.path(key)
+        if path is None:
+            raise ValueError(f"Invalid storage key: {key}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so a reader never sees a partial image
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def _put(self, key: str, path: str) -> str:
+        await asyncio.to_thread(self._copy, key, path)
+        return self.url(key)
+
+    async def get(self, key: str) -> bytes:
+        path = self.path(key)
+        if path is None:
+            raise FileNotFoundError(key)
+        return await asyncio.to_thread(Path(path).read_bytes)
+
+    async def exists(self, key: str) -> bool:
+        path = self.path(key)
+        return path is not None and await asyncio.to_thread(os.path.isfile, path)
+
+    async def delete(self, key: str):
+        path = self.path(key)
+        if path is None:
+            raise ValueError(f"Invalid storage key: {key}")
+        try:
+            await asyncio.to_thread(os.remove, path)
+        except FileNotFoundError:
+            pass
+
+    def url(self, key: str) -> str:
+        if self.base_url:
+            return f"{self.base_url}/storage/{key}"
+        return Path(self.path(key)).as_uri()
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> ImageStorage:
+    """A storage instance for the configured backend"""
+    if backend == "local":
+        return LocalStorage(STORAGE_LOCAL_DIR, PUBLIC_BASE_URL)
+    if backend != "cloudinary":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return CloudinaryStorage(UPLOAD_CHUNK_MB * 1024 * 1024, STORAGE_TIMEOUT_SECONDS, STORAGE_MAX_CONNECTIONS)
+
+
+image_storage = create_storage()
@@ -0,0 +1,349 @@
+"""
+Durable background job queue
+
+Jobs are rows in the background_jobs table, so they survive restarts and are
+shared by every uvicorn worker. Each process runs JOB_WORKERS asyncio tasks
+that claim due jobs, run the registered handler and then finish the job,
+reschedule it on the JOB_RETRY_DELAYS_SECONDS schedule, or dead-letter it.
+
+Claims use SELECT ... FOR UPDATE SKIP LOCKED on Postgres so concurrent
+workers never queue behind each other's rows. SQLite has no row locks, so
+there a claim is a conditional UPDATE that only one worker can win.
+Handlers raise PermanentJobError for failures a retry cannot fix.
+"""
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from app.config.settings import (
+    JOB_WORKERS,
+    JOB_POLL_INTERVAL_SECONDS,
+    JOB_RETRY_DELAYS_SECONDS,
+    JOB_LOCK_TIMEOUT_SECONDS
+)
+from app.models.database import BackgroundJob, SessionLocal, engine
+
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+DeadLetterHook = Callable[[Dict[str, Any], str], Awaitable[None]]
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job cannot succeed"""
+
+
+def _percentile(samples, fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 3)
+
+
+class JobQueue:
+    """Database-backed job queue with in-process asyncio workers"""
+
+    def __init__(self, workers: int, poll_interval: float, retry_delays: List[float], lock_timeout: float):
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.retry_delays = retry_delays
+        self.lock_timeout = lock_timeout
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._handlers: Dict[str, JobHandler] = {}
+        self._dead_letter_hooks: Dict[str, DeadLetterHook] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._counts = {"enqueued": 0, "succeeded": 0, "retried": 0, "deadLettered": 0}
+        self._wait_seconds = deque(maxlen=500)
+        self._run_seconds = deque(maxlen=500)
+        self._finished = deque(maxlen=2000)
+
+    @property
+    def default_max_attempts(self) -> int:
+        return len(self.retry_delays) + 1
+
+    def register(self, kind: str, handler: JobHandler, on_dead: Optional[DeadLetterHook] = None):
+        """Route jobs of this kind to handler; on_dead runs once if the job is dead-lettered"""
+        self._handlers[kind] = handler
+        if on_dead is not None:
+            self._dead_letter_hooks[kind] = on_dead
+
+    def _snapshot(self, job: BackgroundJob) -> Dict[str, Any]:
+        return {
+            "jobId": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "payload": json.loads(job.payload or "{}"),
+            "attempts": job.attempts,
+            "maxAttempts": job.max_attempts,
+            "runAfter": job.run_after.isoformat() if job.run_after else None,
+            "lastError": job.last_error,
+            "result": json.loads(job.result) if job.result else None,
+            "createdAt": job.created_at.isoformat() if job.created_at else None,
+            "finishedAt": job.finished_at.isoformat() if job.finished_at else None
+        }
+
+    def _wake(self):
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None,
+                max_attempts: Optional[int] = None, delay_seconds: float = 0) -> Dict[str, Any]:
+        """Persist a job and wake a local worker; with a dedupe_key, returns the existing job instead of adding one"""
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            if dedupe_key:
+                existing = db.query(BackgroundJob).filter_by(dedupe_key=dedupe_key).first()
+                if existing:
+                    return self._snapshot(existing)
+
+            job = BackgroundJob(
+                kind=kind,
+                payload=json.dumps(payload),
+                dedupe_key=dedupe_key,
+                status="queued",
+                attempts=0,
+                max_attempts=max_attempts or self.default_max_attempts,
+                run_after=now + timedelta(seconds=delay_seconds),
+                created_at=now
+            )
+            db.add(job)
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another request enqueued the same key between our check and insert
+                db.rollback()
+                return self._snapshot(db.query(BackgroundJob).filter_by(dedupe_key=dedupe_key).one())
+
+            with self._lock:
+                self._counts["enqueued"] += 1
+            print(f"[JOBS] Enqueued {kind} job {job.id}")
+            snapshot = self._snapshot(job)
+        finally:
+            db.close()
+
+        self._wake()
+        return snapshot
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            job = db.get(BackgroundJob, job_id)
+            return self._snapshot(job) if job else None
+        finally:
+            db.close()
+
+    def requeue(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Give a dead-lettered job a fresh set of attempts"""
+        db = SessionLocal()
+        try:
+            job = db.get(BackgroundJob, job_id)
+            if job is None:
+                return None
+            if job.status == "dead":
+                job.status = "queued"
+                job.max_attempts = job.attempts + self.default_max_attempts
+                job.run_after = datetime.utcnow()
+                job.finished_at = None
+                db.commit()
+                print(f"[JOBS] Requeued dead {job.kind} job {job.id}")
+            snapshot = self._snapshot(job)
+        finally:
+            db.close()
+
+        self._wake()
+        return snapshot
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Mark the oldest due job as running for this worker, or return None when nothing is due"""
+        now = datetime.utcnow()
+        due = or_(
+            and_(BackgroundJob.status == "queued", BackgroundJob.run_after <= now),
+            # A worker that died mid-job leaves it running; take it over once the lock expires
+            and_(BackgroundJob.status == "running", BackgroundJob.locked_at < now - timedelta(seconds=self.lock_timeout))
+        )
+        db = SessionLocal()
+        try:
+            for _ in range(3):
+                query = db.query(BackgroundJob.id, BackgroundJob.attempts).filter(due).order_by(
+                    BackgroundJob.run_after, BackgroundJob.id
+                ).limit(1)
+                if engine.dialect.name == "postgresql":
+                    query = query.with_for_update(skip_locked=True)
+                row = query.first()
+                if row is None:
+                    db.rollback()
+                    return None
+
+                # attempts doubles as a version number, so without row locks only one worker's UPDATE matches
+                claimed = db.execute(
+                    update(BackgroundJob)
+                    .where(BackgroundJob.id == row.id, BackgroundJob.attempts == row.attempts)
+                    .values(status="running", attempts=row.attempts + 1, locked_by=self.worker_id, locked_at=now)
+                ).rowcount
+                db.commit()
+                if claimed:
+                    job = db.get(BackgroundJob, row.id)
+                    snapshot = self._snapshot(job)
+                    # Waiting time counts from when the job became due, not from when it was created
+                    snapshot["waitSeconds"] = max(0.0, (now - job.run_after).total_seconds())
+                    return snapshot
+            return None
+        finally:
+            db.close()
+
+    def _finish(self, job: Dict[str, Any], **values) -> bool:
+        """Update a running job we still own; False if its lock expired and another worker took it"""
+        db = SessionLocal()
+        try:
+            updated = db.execute(
+                update(BackgroundJob)
+                .where(
+                    BackgroundJob.id == job["jobId"],
+                    BackgroundJob.attempts == job["attempts"],
+                    BackgroundJob.status == "running"
+                )
+                .values(locked_by=None, locked_at=None, **values)
+            ).rowcount
+            db.commit()
+            return bool(updated)
+        finally:
+            db.close()
+
+    async def _run(self, job: Dict[str, Any]):
+        kind, job_id = job["kind"], job["jobId"]
+        handler = self._handlers.get(kind)
+        started = time.monotonic()
+        try:
+            if handler is None:
+                raise PermanentJobError(f"No handler registered for job kind '{kind}'")
+            if job["attempts"] > job["maxAttempts"]:
+                raise PermanentJobError("Lock expired after the final attempt")
+            result = await handler(job["payload"])
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            error = f"{type(e).__name__}: {e}"
+            now = datetime.utcnow()
+            if isinstance(e, PermanentJobError) or job["attempts"] >= job["maxAttempts"]:
+                owned = await asyncio.to_thread(self._finish, job, status="dead", last_error=error, finished_at=now)
+                outcome = "deadLettered"
+                print(f"[JOBS] {kind} job {job_id} dead-lettered after attempt {job['attempts']}: {error}")
+            else:
+                delay = self.retry_delays[min(job["attempts"] - 1, len(self.retry_delays) - 1)]
+                owned = await asyncio.to_thread(
+                    self._finish, job, status="queued", last_error=error, run_after=now + timedelta(seconds=delay)
+                )
+                outcome = "retried"
+                print(f"[JOBS] {kind} job {job_id} failed attempt {job['attempts']}/{job['maxAttempts']}, retrying in {delay:g}s: {error}")
+        else:
+            elapsed = time.monotonic() - started
+            owned = await asyncio.to_thread(
+                self._finish, job, status="succeeded", last_error=None,
+                result=json.dumps(result) if result is not None else None, finished_at=datetime.utcnow()
+            )
+            outcome = "succeeded"
+            print(f"[JOBS] {kind} job {job_id} succeeded in {elapsed:.2f}s (waited {job['waitSeconds']:.2f}s)")
+
+        if not owned:
+            print(f"[JOBS] {kind} job {job_id} lock expired while running; another worker owns it now")
+            return
+
+        with self._lock:
+            self._counts[outcome] += 1
+            self._wait_seconds.append(job["waitSeconds"])
+            self._run_seconds.append(elapsed)
+            if outcome != "retried":
+                self._finished.append(time.monotonic())
+
+        hook = self._dead_letter_hooks.get(kind)
+        if outcome == "deadLettered" and hook is not None:
+            try:
+                await hook(job["payload"], error)
+            except Exception as hook_error:
+                print(f"[JOBS] Dead-letter hook for {kind} job {job_id} failed: {hook_error}")
+
+    async def _work(self, index: int):
+        while not self._stopping:
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                print(f"[JOBS] Worker {index} could not poll the queue: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            try:
+                await self._run(job)
+            except Exception as e:
+                # Recording the outcome failed (e.g. database locked); the job is picked up again once its lock expires
+                print(f"[JOBS] Worker {index} could not record {job['kind']} job {job['jobId']}: {e}")
+
+    def start(self):
+        """Start the worker tasks on the running event loop"""
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._work(i)) for i in range(self.workers)]
+        print(f"[JOBS] Started {self.workers} job workers ({self.worker_id})")
+
+    async def stop(self, grace_seconds: float = 10.0):
+        """Let in-flight jobs finish, then cancel; unfinished jobs are picked up again after their lock expires"""
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        _, pending = await asyncio.wait(self._tasks, timeout=grace_seconds)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        print(f"[JOBS] Job workers stopped ({len(pending)} cancelled mid-job)")
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth by status, throughput and latency for this process"""
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            by_status = dict(db.query(BackgroundJob.status, func.count(BackgroundJob.id)).group_by(BackgroundJob.status).all())
+            oldest_due = db.query(func.min(BackgroundJob.run_after)).filter(
+                BackgroundJob.status == "queued", BackgroundJob.run_after <= now
+            ).scalar()
+        finally:
+            db.close()
+
+        cutoff = time.monotonic() - 60
+        with self._lock:
+            return {
+                "workers": len(self._tasks),
+                "jobsByStatus": by_status,
+                "oldestDueSeconds": round((now - oldest_due).total_seconds(), 3) if oldest_due else 0.0,
+                **self._counts,
+                "finishedLastMinute": sum(1 for t in self._finished if t >= cutoff),
+                "waitSecondsP50": _percentile(self._wait_seconds, 0.5),
+                "waitSecondsP95": _percentile(self._wait_seconds, 0.95),
+                "runSecondsP50": _percentile(self._run_seconds, 0.5),
+                "runSecondsP95": _percentile(self._run_seconds, 0.95)
+            }
+
+
+job_queue = JobQueue(JOB_WORKERS, JOB_POLL_INTERVAL_SECONDS, JOB_RETRY_DELAYS_SECONDS, JOB_LOCK_TIMEOUT_SECONDS)
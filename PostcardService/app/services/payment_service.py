@@ -1,12 +1,15 @@
 """
 Payment processing service containing all payment-related business logic
 """
+import asyncio
 import stripe
 import os
 from typing import Dict, Any
 from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.schemas import PaymentConfirmedRequest, CreatePaymentSessionRequest
-from app.models.database import PostcardTransaction, SessionLocal
+from app.repositories import transactions as transactions_repo
+from app.services.job_queue import job_queue
 
 
 async def create_payment_intent(request: dict) -> Dict[str, Any]:
@@ -50,65 +53,102 @@ async def create_payment_intent(request: dict) -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def get_payment_status(transaction_id: str) -> Dict[str, Any]:
-    """Get payment status and submit to Stannp if payment confirmed"""
+async def get_payment_status(transaction_id: str, db: AsyncSession) -> Dict[str, Any]:
+    """Get payment status, queueing the Stannp submission once payment is confirmed
+
+    Submission and the follow-up emails run on the background job queue, so
+    this returns immediately; clients keep polling until completed is set.
+    """
+    # Image URLs come only from the transaction row: renders are stored under
+    # fingerprinted keys and batch recipients share a front stored under the
+    # batch ID, so no URL can be derived before the row records one
+    status = {
+        "success": True,
+        "transactionId": transaction_id,
+        "paymentStatus": "succeeded",
+        "paymentConfirmed": True,
+        "frontUrl": None,
+        "backUrl": None
+    }
+    
     try:
         print(f"[PAYMENT_STATUS] Checking status for transaction: {transaction_id}")
         
-        # Build the postcard URLs
-        front_url = f"https://res.cloudinary.com/db9totnmb/image/upload/postcards/backs/postcard-front-{transaction_id}.jpg"
-        back_url = f"https://res.cloudinary.com/db9totnmb/image/upload/postcards/backs/postcard-back-{transaction_id}.jpg"
-        
-        # Try to submit to Stannp now that payment is confirmed
-        print(f"[PAYMENT_STATUS] Attempting to submit to Stannp for transaction: {transaction_id}")
+        # Once submitted, the transaction row is the answer; no job lookup needed
+        transaction_record = await transactions_repo.get_transaction(db, transaction_id)
+        if transaction_record is not None:
+            status["frontUrl"] = transaction_record.front_url
+            status["backUrl"] = transaction_record.back_url
+        if transaction_record is None or not (transaction_record.front_url and transaction_record.back_url):
+            # Still being generated, or its images could not be stored yet; a submission job now would only fail
+            return {
+                **status,
+                "status": "awaiting_postcard",
+                "submittedToStannp": False,
+                "completed": False,
+                "finalStatus": False,
+                "message": "Postcard is not ready for submission yet"
+            }
+        if transaction_record.submitted_to_stannp:
+            return {
+                **status,
+                "status": "submitted_to_stannp",
+                "submittedToStannp": True,
+                "completed": True,
+                "finalStatus": True,
+                "stannpOrderId": transaction_record.stannp_order_id or "",
+                "message": "Postcard successfully submitted for printing and mailing"
+            }
         
-        # Use the refactored service (import here to avoid circular imports)
-        from app.services.postcard_service import submit_to_stannp_with_transaction_data
-        result = await submit_to_stannp_with_transaction_data(transaction_id)
+        # Repeated polls find the same job instead of submitting again
+        job = await asyncio.to_thread(
+            job_queue.enqueue,
+            "stannp_submit",
+            {"transactionId": transaction_id},
+            dedupe_key=f"stannp_submit:{transaction_id}"
+        )
+        status["jobId"] = job["jobId"]
+        status["jobStatus"] = job["status"]
         
-        if result.get("success"):
+        if job["status"] == "succeeded":
+            result = job["result"] or {}
             return {
-                "success": True,
+                **status,
                 "status": "submitted_to_stannp",
-                "transactionId": transaction_id,
-                "paymentStatus": "succeeded",
-                "paymentConfirmed": True,
                 "submittedToStannp": True,
                 "completed": True,
                 "finalStatus": True,
                 "stannpOrderId": result.get("stannpOrderId", ""),
                 "message": "Postcard successfully submitted for printing and mailing",
-                "frontUrl": front_url,
-                "backUrl": back_url,
                 "stannpResponse": result.get("stannpResponse", {})
             }
-        else:
+        elif job["status"] == "dead":
             return {
-                "success": True,
+                **status,
                 "status": "stannp_error",
-                "transactionId": transaction_id,
-                "paymentStatus": "succeeded",
-                "paymentConfirmed": True,
                 "submittedToStannp": False,
                 "completed": False,
-                "error": result.get("error", "Unknown error"),
-                "frontUrl": front_url,
-                "backUrl": back_url
+                "error": job["lastError"] or "Unknown error"
+            }
+        else:
+            return {
+                **status,
+                "status": "submission_queued",
+                "submittedToStannp": False,
+                "completed": False,
+                "finalStatus": False,
+                "attempts": job["attempts"],
+                "message": "Postcard is queued for submission to printing"
             }
             
     except Exception as e:
         print(f"[PAYMENT_STATUS] Error checking payment status: {e}")
         return {
-            "success": True,
+            **status,
             "status": "error",
-            "transactionId": transaction_id,
-            "paymentStatus": "succeeded",
-            "paymentConfirmed": True,
             "submittedToStannp": False,
             "completed": False,
-            "error": str(e),
-            "frontUrl": f"https://res.cloudinary.com/db9totnmb/image/upload/postcards/backs/postcard-front-{transaction_id}.jpg",
-            "backUrl": f"https://res.cloudinary.com/db9totnmb/image/upload/postcards/backs/postcard-back-{transaction_id}.jpg"
+            "error": str(e)
         }
 
 
@@ -1,192 +1,255 @@
 """
 Postcard processing service for Stannp submission and postcard back generation
 """
-import requests
+import asyncio
 import os
 from typing import Dict, Any
 from sqlalchemy.orm import Session
 from app.models.schemas import StannpSubmissionRequest, PostcardRequest
-from app.models.database import PostcardTransaction, SessionLocal
+from app.models.database import PostcardTransaction, AsyncSessionLocal
+from app.repositories import transactions as transactions_repo
+from app.services.job_queue import job_queue, PermanentJobError
+from app.services.stannp_client import stannp_client, AMBIGUOUS_ERRORS, NOT_PROCESSED_STATUSES
 
 
-async def submit_to_stannp_with_transaction_data(transaction_id: str) -> Dict[str, Any]:
-    """Submit postcard to Stannp using stored transaction data"""
-    import base64
+def _stannp_data_from_transaction(transaction_record: PostcardTransaction) -> Dict[str, str]:
+    """Stannp create-postcard form fields for a stored transaction"""
+    # Parse recipient name
+    recipient_name = (transaction_record.recipient_name or "").strip()
+    name_parts = recipient_name.split() if recipient_name else []
     
-    try:
-        print(f"[STANNP] Processing submission for transaction: {transaction_id}")
+    # Build recipient data
+    recipient_data = {
+        "recipient[address1]": transaction_record.recipient_address_line1 or "",
+        "recipient[city]": transaction_record.recipient_city or "",
+        "recipient[postcode]": transaction_record.recipient_zipcode or "",
+        "recipient[country]": "US"
+    }
+    
+    # Only add names if we have them
+    if len(name_parts) >= 1:
+        recipient_data["recipient[firstname]"] = name_parts[0]
+    if len(name_parts) >= 2:
+        recipient_data["recipient[lastname]"] = " ".join(name_parts[1:])
+    
+    # Add optional fields if present
+    if transaction_record.recipient_address_line2:
+        recipient_data["recipient[address2]"] = transaction_record.recipient_address_line2
+    if transaction_record.recipient_state:
+        recipient_data["recipient[state]"] = transaction_record.recipient_state
+    
+    # Map postcard size - default to 4x6 for backwards compatibility
+    if transaction_record.postcard_size == "6x9" or transaction_record.postcard_size == "xl":
+        postcard_size = "6x9"
+    elif transaction_record.postcard_size == "4x6" or transaction_record.postcard_size == "regular":
+        postcard_size = "4x6"
+    else:
+        postcard_size = "4x6"  # Default to 4x6
+    
+    # Prepare Stannp API request
+    return {
+        "test": "true",  # Set to false for production
+        "size": postcard_size,
+        "front": transaction_record.front_url,
+        "back": transaction_record.back_url,
+        "clearzone": "true",  # Enable white overlay
+        **recipient_data
+    }
+
+
+class SubmissionInProgress(Exception):
+    """Another worker holds the Stannp submission claim for this transaction"""
+
+
+# Submissions running in this process, so concurrent callers share one Stannp call
+_submissions_in_flight: Dict[str, "asyncio.Task"] = {}
+
+
+def _submission_outcome(transaction_record: PostcardTransaction) -> Dict[str, Any]:
+    """Result for a transaction some earlier call already submitted"""
+    return {"stannpOrderId": transaction_record.stannp_order_id, "stannpResponse": {}, "alreadySubmitted": True}
+
+
+async def _submit_transaction(transaction_id: str) -> Dict[str, Any]:
+    print(f"[STANNP] Processing submission for transaction: {transaction_id}")
+    
+    async with AsyncSessionLocal() as db:
+        transaction_record = await transactions_repo.get_transaction(db, transaction_id)
+        
+        if not transaction_record:
+            # Retried on the queue's schedule: the row may still be on its way from the generate request
+            raise Exception(f"Transaction record not found for {transaction_id}")
+        if not (transaction_record.front_url and transaction_record.back_url):
+            # Cleared when a render could only be served from the local blob store; a new render stores them
+            raise Exception(f"Postcard images for {transaction_id} are not stored yet")
+        
+        if not await transactions_repo.claim_submission(db, transaction_id):
+            await db.refresh(transaction_record)
+            if transaction_record.submitted_to_stannp:
+                print(f"[STANNP] Transaction {transaction_id} already submitted as order {transaction_record.stannp_order_id}")
+                return _submission_outcome(transaction_record)
+            if transaction_record.stannp_status == "unknown":
+                raise PermanentJobError(f"Earlier Stannp submission for {transaction_id} may have succeeded; check Stannp before retrying")
+            raise SubmissionInProgress(f"Stannp submission for {transaction_id} is already in progress")
         
-        # Get transaction data from database
-        db = SessionLocal()
+        # The claim's commit released the connection, so none is held during the Stannp call
+        print(f"[STANNP] Recipient: {transaction_record.recipient_name}")
+        print(f"[STANNP] Address: {transaction_record.recipient_address_line1}, {transaction_record.recipient_city}")
+        print(f"[STANNP] Size: {transaction_record.postcard_size}")
+        
+        # "failed" releases the claim for a later attempt; "unknown" keeps it because Stannp may have printed the postcard
+        release_status = "failed"
         try:
-            transaction_record = db.query(PostcardTransaction).filter_by(
-                transaction_id=transaction_id
-            ).first()
-            
-            if not transaction_record:
-                raise Exception(f"Transaction record not found for {transaction_id}")
-                
-            print(f"[STANNP] Found transaction record for {transaction_id}")
-            print(f"[STANNP] Recipient: {transaction_record.recipient_name}")
-            print(f"[STANNP] Address: {transaction_record.recipient_address_line1}, {transaction_record.recipient_city}")
-            print(f"[STANNP] Size: {transaction_record.postcard_size}")
-            
-            # Build URLs
-            front_url = transaction_record.front_url
-            back_url = transaction_record.back_url
-            
             # Get Stannp API key
             stannp_api_key = os.getenv("STANNP_API_KEY")
             if not stannp_api_key:
                 raise Exception("STANNP_API_KEY not configured")
             
-            print(f"[STANNP] Using Stannp API key: {stannp_api_key[:8]}... (length: {len(stannp_api_key)})")
-            
-            # Parse recipient name
-            recipient_name = (transaction_record.recipient_name or "").strip()
-            name_parts = recipient_name.split() if recipient_name else []
-            
-            # Build recipient data
-            recipient_data = {
-                "recipient[address1]": transaction_record.recipient_address_line1 or "",
-                "recipient[city]": transaction_record.recipient_city or "",
-                "recipient[postcode]": transaction_record.recipient_zipcode or "",
-                "recipient[country]": "US"
-            }
-            
-            # Only add names if we have them
-            if len(name_parts) >= 1:
-                recipient_data["recipient[firstname]"] = name_parts[0]
-            if len(name_parts) >= 2:
-                recipient_data["recipient[lastname]"] = " ".join(name_parts[1:])
-            
-            # Add optional fields if present
-            if transaction_record.recipient_address_line2:
-                recipient_data["recipient[address2]"] = transaction_record.recipient_address_line2
-            if transaction_record.recipient_state:
-                recipient_data["recipient[state]"] = transaction_record.recipient_state
-            
-            # Map postcard size - default to 4x6 for backwards compatibility
-            if transaction_record.postcard_size == "6x9" or transaction_record.postcard_size == "xl":
-                postcard_size = "6x9"
-            elif transaction_record.postcard_size == "4x6" or transaction_record.postcard_size == "regular":
-                postcard_size = "4x6"
-            else:
-                postcard_size = "4x6"  # Default to 4x6
-            
-            # Prepare Stannp API request
-            stannp_url = "https://dash.stannp.com/api/v1/postcards/create"
-            stannp_data = {
-                "test": "true",  # Set to false for production
-                "size": postcard_size,
-                "front": front_url,
-                "back": back_url,
-                "clearzone": "true",  # Enable white overlay
-                **recipient_data
-            }
-            
+            stannp_data = _stannp_data_from_transaction(transaction_record)
             print(f"[STANNP] Sending request to Stannp API")
             
-            # Make API call using Basic auth
-            auth_string = f"{stannp_api_key}:"
-            encoded_auth = base64.b64encode(auth_string.encode()).decode()
-            headers = {
-                "Authorization": f"Basic {encoded_auth}",
-                "Content-Type": "application/x-www-form-urlencoded"
-            }
-            
-            response = requests.post(stannp_url, data=stannp_data, headers=headers)
+            try:
+                response = await stannp_client.create_postcard(stannp_api_key, stannp_data)
+            except AMBIGUOUS_ERRORS as e:
+                release_status = "unknown"
+                raise PermanentJobError(f"Stannp request failed after sending ({type(e).__name__}); check Stannp before retrying")
             print(f"[STANNP] Stannp API response status: {response.status_code}")
             print(f"[STANNP] Stannp API response: {response.text}")
             
-            if response.status_code == 200:
-                stannp_response = response.json()
-                if stannp_response.get("success"):
-                    stannp_order_id = stannp_response.get("data", {}).get("id", "")
-                    print(f"[STANNP] SUCCESS: Postcard submitted with order ID: {stannp_order_id}")
-                    
-                    # Send success email if user has email
-                    if transaction_record.user_email and transaction_record.user_email.strip():
-                        await _send_success_email(transaction_record, stannp_response)
-                    
-                    # Update transaction record
-                    transaction_record.submitted_to_stannp = True
-                    transaction_record.stannp_order_id = str(stannp_order_id)
-                    transaction_record.stannp_status = "submitted"
-                    db.commit()
-                    
-                    return {
-                        "success": True,
-                        "status": "submitted_to_stannp",
-                        "transactionId": transaction_id,
-                        "stannpOrderId": stannp_order_id,
-                        "message": "Postcard successfully submitted for printing and mailing",
-                        "stannpResponse": stannp_response
-                    }
-                else:
-                    error_msg = stannp_response.get("error", "Unknown Stannp error")
-                    await _send_error_email(transaction_id, transaction_record, f"Stannp API error: {error_msg}")
-                    return {"success": False, "error": f"Stannp API error: {error_msg}"}
-            else:
+            if response.status_code != 200:
                 error_msg = f"Stannp HTTP error: {response.status_code}"
-                await _send_error_email(transaction_id, transaction_record, error_msg)
-                return {"success": False, "error": error_msg}
-                
-        finally:
-            db.close()
+                if response.status_code in NOT_PROCESSED_STATUSES:
+                    raise Exception(error_msg)
+                if response.status_code >= 500:
+                    # Server errors may still have created the postcard
+                    release_status = "unknown"
+                raise PermanentJobError(error_msg)
             
+            stannp_response = response.json()
+            if not stannp_response.get("success"):
+                raise PermanentJobError(f"Stannp API error: {stannp_response.get('error', 'Unknown Stannp error')}")
+        except Exception:
+            await transactions_repo.release_submission(db, transaction_id, release_status)
+            raise
+        
+        stannp_order_id = stannp_response.get("data", {}).get("id", "")
+        print(f"[STANNP] SUCCESS: Postcard submitted with order ID: {stannp_order_id}")
+        
+        # Update transaction record
+        await transactions_repo.mark_submitted(db, transaction_id, str(stannp_order_id))
+    
+    # Send success email if user has email
+    if transaction_record.user_email and transaction_record.user_email.strip():
+        await asyncio.to_thread(job_queue.enqueue, "success_email", {
+            "toEmail": transaction_record.user_email,
+            "pdfUrl": stannp_response.get("data", {}).get("pdf", "")
+        }, dedupe_key=f"success_email:{transaction_id}")
+    
+    return {"stannpOrderId": str(stannp_order_id), "stannpResponse": stannp_response}
+
+
+async def submit_transaction_once(transaction_id: str) -> Dict[str, Any]:
+    """Submit a stored transaction to Stannp at most once
+
+    Concurrent callers in this process await the same attempt. Across
+    processes, the 'submitting' claim on the transaction row makes every
+    other caller either reuse the stored outcome or raise SubmissionInProgress.
+    """
+    task = _submissions_in_flight.get(transaction_id)
+    if task is None:
+        task = asyncio.ensure_future(_submit_transaction(transaction_id))
+        _submissions_in_flight[transaction_id] = task
+        task.add_done_callback(lambda _: _submissions_in_flight.pop(transaction_id, None))
+    # Shielded so one caller going away does not cancel the submission for the others
+    return await asyncio.shield(task)
+
+
+async def run_stannp_submission_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Submit a stored transaction to Stannp (stannp_submit job handler)
+
+    Raises PermanentJobError when a retry could not help or could print a
+    second postcard; any other exception is retried on the queue's schedule.
+    """
+    return await submit_transaction_once(payload["transactionId"])
+
+
+async def submit_to_stannp_with_transaction_data(transaction_id: str) -> Dict[str, Any]:
+    """Submit postcard to Stannp using stored transaction data, waiting for the result"""
+    # Only the caller that starts the attempt reports its failure to support
+    leader = transaction_id not in _submissions_in_flight
+    try:
+        result = await submit_transaction_once(transaction_id)
+    except SubmissionInProgress as e:
+        return {"success": False, "status": "submission_in_progress", "error": str(e)}
     except Exception as e:
         print(f"[STANNP] Error in Stannp submission: {e}")
-        await _send_error_email(transaction_id, None, str(e))
+        if leader:
+            await _notify_support_of_failure({"transactionId": transaction_id}, str(e))
         return {"success": False, "error": str(e)}
+    
+    return {
+        "success": True,
+        "status": "submitted_to_stannp",
+        "transactionId": transaction_id,
+        "stannpOrderId": result["stannpOrderId"],
+        "message": "Postcard successfully submitted for printing and mailing",
+        "stannpResponse": result["stannpResponse"]
+    }
 
 
-async def _send_success_email(transaction_record, stannp_response):
-    """Send success email notification"""
-    try:
-        from app.utils.email import send_email_notification
-        
-        pdf_url = stannp_response.get("data", {}).get("pdf", "")
-        print(f"[EMAIL] Sending success notification to: {transaction_record.user_email}")
-        
-        send_email_notification(
-            to_email=transaction_record.user_email,
-            subject="Your postcard has been submitted for printing! ✉️",
-            message="Your postcard has been successfully submitted for printing and mailing!",
-            pdf_url=pdf_url
-        )
-    except Exception as email_error:
-        print(f"[EMAIL] Failed to send success notification: {email_error}")
+async def run_success_email_job(payload: Dict[str, Any]):
+    """Email the customer their Stannp proof (success_email job handler)"""
+    from app.utils.email import send_email_notification
+    
+    print(f"[EMAIL] Sending success notification to: {payload['toEmail']}")
+    # Downloads the PDF and calls Resend with blocking I/O, so keep it off the event loop
+    await asyncio.to_thread(
+        send_email_notification,
+        to_email=payload["toEmail"],
+        subject="Your postcard has been submitted for printing! ✉️",
+        message="Your postcard has been successfully submitted for printing and mailing!",
+        pdf_url=payload.get("pdfUrl") or None,
+        raise_errors=True
+    )
 
 
-async def _send_error_email(transaction_id: str, transaction_record, error_msg: str):
-    """Send error notification to support"""
-    try:
-        from app.utils.email import send_email_notification
-        
-        customer_email = transaction_record.user_email if transaction_record else "Unknown"
-        error_details = f"""
+async def run_support_email_job(payload: Dict[str, Any]):
+    """Tell support about a failed submission (support_email job handler)"""
+    from app.utils.email import send_email_notification
+    
+    transaction_id = payload["transactionId"]
+    error_details = f"""
         Transaction ID: {transaction_id}
-        Error: {error_msg}
-        Customer Email: {customer_email}
+        Error: {payload['error']}
+        Customer Email: {payload.get('customerEmail') or 'Unknown'}
         """
-        
-        send_email_notification(
-            to_email="info@xlpostcards.com",
-            subject=f"Stannp Error - Transaction {transaction_id[:8]}",
-            message=f"Stannp error occurred: {error_details}",
-            pdf_url=None
-        )
-        print(f"[EMAIL] Sent error notification to support")
-    except Exception as email_error:
-        print(f"[EMAIL] Failed to send error notification: {email_error}")
+    
+    await asyncio.to_thread(
+        send_email_notification,
+        to_email="info@xlpostcards.com",
+        subject=f"Stannp Error - Transaction {transaction_id[:8]}",
+        message=f"Stannp error occurred: {error_details}",
+        pdf_url=None,
+        raise_errors=True
+    )
+    print(f"[EMAIL] Sent error notification to support")
+
+
+async def _notify_support_of_failure(payload: Dict[str, Any], error_msg: str):
+    """Queue a support email for a submission that will not be retried"""
+    transaction_id = payload["transactionId"]
+    async with AsyncSessionLocal() as db:
+        customer_email = await transactions_repo.get_user_email(db, transaction_id) or None
+    
+    await asyncio.to_thread(job_queue.enqueue, "support_email", {
+        "transactionId": transaction_id,
+        "error": error_msg,
+        "customerEmail": customer_email
+    })
 
 
 async def submit_to_stannp_legacy(request: dict) -> Dict[str, Any]:
     """Legacy Stannp submission endpoint with request dict"""
-    import requests
-    import base64
-    
     try:
         print(f"[STANNP] Submitting postcard to Stannp for printing")
         transaction_id = request.get("transactionId", "")
@@ -199,9 +262,6 @@ async def submit_to_stannp_legacy(request: dict) -> Dict[str, Any]:
             print(f"[STANNP] ERROR: STANNP_API_KEY not configured")
             return {"success": False, "error": "Stannp API key not configured"}
         
-        # Prepare Stannp API request
-        stannp_url = "https://dash.stannp.com/api/v1/postcards/create"
-        
         # Extract address from request
         address_data = request.get("address", {})
         
@@ -240,16 +300,8 @@ async def submit_to_stannp_legacy(request: dict) -> Dict[str, Any]:
         
         print(f"[STANNP] Sending request to Stannp API with data: {stannp_data}")
         
-        # Make API call to Stannp using Basic auth
-        auth_string = f"{stannp_api_key}:"
-        encoded_auth = base64.b64encode(auth_string.encode()).decode()
-        
-        headers = {
-            "Authorization": f"Basic {encoded_auth}",
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-        
-        response = requests.post(stannp_url, data=stannp_data, headers=headers)
+        # Make API call to Stannp (Basic auth, pooled connection)
+        response = await stannp_client.create_postcard(stannp_api_key, stannp_data)
         
         print(f"[STANNP] Stannp API response status: {response.status_code}")
         print(f"[STANNP] Stannp API response: {response.text}")
@@ -284,4 +336,9 @@ async def submit_to_stannp_legacy(request: dict) -> Dict[str, Any]:
 # Legacy compatibility - kept for backwards compatibility
 async def submit_to_stannp(request: StannpSubmissionRequest, db: Session) -> Dict[str, Any]:
     """Legacy endpoint - redirect to new implementation"""
-    return await submit_to_stannp_with_transaction_data(request.transactionId)
\ No newline at end of file
+    return await submit_to_stannp_with_transaction_data(request.transactionId)
+
+
+job_queue.register("stannp_submit", run_stannp_submission_job, on_dead=_notify_support_of_failure)
+job_queue.register("success_email", run_success_email_job)
+job_queue.register("support_email", run_support_email_job)
@@ -0,0 +1,70 @@
+"""
+Render result cache: identical postcard requests reuse the images already published
+
+Clients often send the same payload twice in a row (generate-complete-postcard
+then generate-postcard-back), and a message edit leaves the front unchanged.
+Entries are keyed by transaction ID and side, and hold the fingerprint of the
+render inputs that produced that side's stored image. Every render is stored
+under a key that includes its fingerprint (see postcard_key), so a published
+image is never overwritten by a different render: a hit always returns a URL
+whose image matches the request, even when other uvicorn workers have since
+rendered the transaction differently. Only published renders are cached,
+never blob fallbacks or fronts that failed to compose.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config.settings import RENDER_CACHE_MAX_ENTRIES, RENDER_CACHE_TTL_SECONDS
+
+
+class RenderResultCache:
+    """Latest published render per transaction and side, reused while its fingerprint matches and it is younger than ttl_seconds"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def get(self, transaction_id: str, side: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """The published result for this side of the transaction if it was rendered from the same inputs, else None"""
+        key = (transaction_id, side)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint and time.monotonic() - entry[2] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self._counts["hits"] += 1
+                return dict(entry[1])
+            self._counts["misses"] += 1
+            return None
+
+    def put(self, transaction_id: str, side: str, fingerprint: str, result: Dict[str, Any]):
+        key = (transaction_id, side)
+        with self._lock:
+            self._entries[key] = (fingerprint, dict(result), time.monotonic())
+            self._entries.move_to_end(key)
+            self._counts["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counts["hits"] + self._counts["misses"]
+            return {
+                "entries": len(self._entries),
+                "maxEntries": self.max_entries,
+                "ttlSeconds": self.ttl_seconds,
+                **self._counts,
+                "hitRate": round(self._counts["hits"] / lookups, 4) if lookups else None
+            }
+
+
+render_cache = RenderResultCache(RENDER_CACHE_TTL_SECONDS, RENDER_CACHE_MAX_ENTRIES)
@@ -0,0 +1,186 @@
+"""
+Render executor that runs CPU-bound postcard composition off the event loop
+
+A bounded ProcessPoolExecutor owns all PIL work (drawing, resizing, JPEG
+encoding). Routes await a job instead of rendering inline, so a slow render
+never stalls health checks or other requests on the same uvicorn worker.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from app.config.settings import (
+    RENDER_WORKERS,
+    RENDER_MAX_QUEUE,
+    RENDER_TIMEOUT_SECONDS,
+    RENDER_RETRY_AFTER_SECONDS
+)
+
+
+def _init_render_worker(image_cache_counters):
+    """Runs once in each worker process before it takes jobs"""
+    from app.utils.image_cache import cache_stats
+    from app.services.postcard_generation_service import warm_back_base_layers
+    cache_stats.attach(image_cache_counters)
+    warm_back_base_layers()
+
+
+def _worker_ready() -> int:
+    """Warm-up job; held briefly so that the jobs of one round land on different workers"""
+    time.sleep(0.05)
+    return os.getpid()
+
+
+class RenderQueueFull(Exception):
+    """Raised when every worker is busy and the wait queue is at capacity"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Render queue is full, try again shortly")
+        self.retry_after = retry_after
+
+
+class RenderTimeout(Exception):
+    """Raised when a render job exceeds its time budget"""
+
+
+class RenderExecutor:
+    """Bounded process pool for postcard rendering jobs"""
+
+    def __init__(self, workers: int, max_queue: int, timeout: float, retry_after: int):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    @property
+    def capacity(self) -> int:
+        """Jobs allowed in the system at once (running + waiting)"""
+        return self.workers + self.max_queue
+
+    def start(self, warm_up: bool = True):
+        """
+        Create the pool; with warm_up, block until every worker process runs jobs
+
+        Worker processes are only forked at the first submit and each runs its
+        initializer (fonts, base layers) before taking a job, so without the
+        warm-up that cost lands on the first request. Startup warms up; run()
+        does not, as it must not block the event loop.
+        """
+        with self._lock:
+            if self._pool is not None:
+                return self._pool
+            from app.utils.image_cache import cache_stats
+            pool = self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_render_worker,
+                initargs=(cache_stats.shared,)
+            )
+        if warm_up:
+            self._warm_up(pool)
+        print(f"[RENDER] Started render pool with {self.workers} workers, queue depth {self.max_queue}")
+        return pool
+
+    def _warm_up(self, pool: ProcessPoolExecutor):
+        """Run rounds of warm-up jobs until every worker has answered or the job timeout passes"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        ready = set()
+        try:
+            while len(ready) < self.workers:
+                futures = [pool.submit(_worker_ready) for _ in range(self.workers)]
+                ready.update(future.result(timeout=max(0, deadline - time.monotonic())) for future in futures)
+        except FutureTimeoutError:
+            print(f"[RENDER] Warm-up timed out with {len(ready)}/{self.workers} workers ready")
+            return
+        print(f"[RENDER] {self.workers} workers ready in {time.monotonic() - started:.2f}s")
+
+    def shutdown(self):
+        """Stop the worker processes, cancelling queued jobs"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print("[RENDER] Render pool shut down")
+
+    def _reserve_slot(self):
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self._rejected += 1
+                raise RenderQueueFull(self.retry_after)
+            self._in_flight += 1
+
+    def _release_slot(self, future):
+        # Runs when the job really finishes, so a timed-out job that is still
+        # burning CPU in a worker keeps holding its slot until it is done.
+        with self._lock:
+            self._in_flight -= 1
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """Run fn(*args) in the pool and await its result"""
+        self._reserve_slot()
+        try:
+            future = self.start(warm_up=False).submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM kill); drop the pool so the next job gets a fresh one
+            with self._lock:
+                self._in_flight -= 1
+                self._pool = None
+            raise
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        future.add_done_callback(self._release_slot)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timed_out += 1
+            print(f"[RENDER] Job exceeded {timeout or self.timeout}s budget")
+            raise RenderTimeout(f"Render did not finish within {timeout or self.timeout} seconds")
+        except BrokenProcessPool:
+            with self._lock:
+                self._pool = None
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of queue depth and job outcomes"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "maxQueue": self.max_queue,
+                "timeoutSeconds": self.timeout,
+                "inFlight": self._in_flight,
+                "queued": max(0, self._in_flight - self.workers),
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "timedOut": self._timed_out,
+                "running": self._pool is not None
+            }
+
+
+render_executor = RenderExecutor(
+    workers=RENDER_WORKERS,
+    max_queue=RENDER_MAX_QUEUE,
+    timeout=RENDER_TIMEOUT_SECONDS,
+    retry_after=RENDER_RETRY_AFTER_SECONDS
+)
@@ -0,0 +1,121 @@
+"""
+Stannp API client
+
+One pooled httpx.AsyncClient per process keeps TLS connections to Stannp
+alive between submissions, with explicit connect/read timeouts and a cap on
+concurrent calls. Failed calls are retried with full-jitter exponential
+backoff, but only when a retry cannot create a second postcard:
+
+- connection failures (the request never reached Stannp)
+- 429 and 503 (Stannp rejected the request without processing it)
+- any 5xx or read timeout, when the caller marks the call idempotent
+"""
+import asyncio
+import random
+from typing import Dict, Optional
+
+import httpx
+
+from app.config.settings import (
+    STANNP_API_URL,
+    STANNP_CONNECT_TIMEOUT_SECONDS,
+    STANNP_READ_TIMEOUT_SECONDS,
+    STANNP_MAX_CONCURRENCY,
+    STANNP_MAX_RETRIES,
+    STANNP_BACKOFF_BASE_SECONDS,
+    STANNP_BACKOFF_MAX_SECONDS
+)
+
+
+# Raised before any bytes reach Stannp, so retrying is always safe
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Raised after the request may have been processed
+AMBIGUOUS_ERRORS = (httpx.ReadTimeout, httpx.WriteTimeout, httpx.RemoteProtocolError, httpx.ReadError)
+
+# Stannp refused the request without acting on it
+NOT_PROCESSED_STATUSES = (429, 503)
+
+
+class StannpClient:
+    """Shared async client for the Stannp REST API"""
+
+    def __init__(self, base_url: str, connect_timeout: float, read_timeout: float,
+                 max_concurrency: int, max_retries: int, backoff_base: float, backoff_max: float):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _http(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def close(self):
+        """Close pooled connections (called on app shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            print("[STANNP] Client connections closed")
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        """Full-jitter exponential delay, or the server's Retry-After when it gives one"""
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def post(self, path: str, api_key: str, data: Dict, idempotent: bool = False) -> httpx.Response:
+        """POST form data to a Stannp endpoint with Basic auth, retrying only where it is safe"""
+        client = self._http()
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    response = await client.post(path, data=data, auth=(api_key, ""))
+            except NOT_SENT_ERRORS + AMBIGUOUS_ERRORS as e:
+                retryable = isinstance(e, NOT_SENT_ERRORS) or idempotent
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, None)
+                print(f"[STANNP] {type(e).__name__} on {path}, retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+            else:
+                retryable = response.status_code in NOT_PROCESSED_STATUSES or (
+                    idempotent and response.status_code >= 500
+                )
+                if not retryable or attempt >= self.max_retries:
+                    return response
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                print(f"[STANNP] HTTP {response.status_code} on {path}, retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def create_postcard(self, api_key: str, data: Dict) -> httpx.Response:
+        """Create (and, outside test mode, print and mail) a postcard"""
+        # Not idempotent: an ambiguous failure may already have created the postcard
+        return await self.post("/postcards/create", api_key, data)
+
+
+stannp_client = StannpClient(
+    base_url=STANNP_API_URL,
+    connect_timeout=STANNP_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=STANNP_READ_TIMEOUT_SECONDS,
+    max_concurrency=STANNP_MAX_CONCURRENCY,
+    max_retries=STANNP_MAX_RETRIES,
+    backoff_base=STANNP_BACKOFF_BASE_SECONDS,
+    backoff_max=STANNP_BACKOFF_MAX_SECONDS
+)
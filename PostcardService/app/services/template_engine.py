@@ -1,51 +1,184 @@
+import math
 from PIL import Image
-from typing import List
-import io
-import base64
-import urllib.request
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from app.utils.image_cache import fitted_image_cache, source_cache_key
+from app.utils.images import decode_image, fetch_image_bytes, run_concurrently
+
+
+class Cell(NamedTuple):
+    """One photo slot on the front canvas"""
+    x: int
+    y: int
+    width: int
+    height: int
+    border: int = 0  # White frame drawn around the photo (overlays only)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return (self.width, self.height)
+
+
+def _grid(columns: int, rows: int, gap: int) -> Callable[[int, int], List[Cell]]:
+    """Evenly sized cells filled row by row, separated by gap pixels"""
+    def cells(width: int, height: int) -> List[Cell]:
+        cell_width = (width - (columns - 1) * gap) // columns
+        cell_height = (height - (rows - 1) * gap) // rows
+        return [
+            Cell(column * (cell_width + gap), row * (cell_height + gap), cell_width, cell_height)
+            for row in range(rows)
+            for column in range(columns)
+        ]
+    return cells
+
+
+def _three_photos(width: int, height: int) -> List[Cell]:
+    """One large photo on left half, two smaller on right half (stacked)"""
+    gap = 20
+    left_width = width // 2 - gap // 2
+    right_width = width // 2 - gap // 2
+    right_height = (height - gap) // 2
+    return [
+        Cell(0, 0, left_width, height),
+        Cell(left_width + gap, 0, right_width, right_height),
+        Cell(left_width + gap, right_height + gap, right_width, right_height),
+    ]
+
+
+def _five_collage(width: int, height: int) -> List[Cell]:
+    """Four quarters with a fifth photo overlaid in the center with a white border"""
+    quarters = _grid(2, 2, 20)(width, height)
+    center_width = int(quarters[0].width * 0.7)
+    center_height = int(quarters[0].height * 0.7)
+    border = 8
+    center_x = (width - (center_width + border * 2)) // 2
+    center_y = (height - (center_height + border * 2)) // 2
+    return quarters + [Cell(center_x + border, center_y + border, center_width, center_height, border)]
+
+
+def _three_sideways(width: int, height: int) -> List[Cell]:
+    """One wide photo on top (40% of height) with two photos below"""
+    gap = 15
+    top_height = int(height * 0.4)
+    bottom_height = height - top_height - gap
+    bottom_width = (width - gap) // 2
+    return [
+        Cell(0, 0, width, top_height),
+        Cell(0, top_height + gap, bottom_width, bottom_height),
+        Cell(bottom_width + gap, top_height + gap, bottom_width, bottom_height),
+    ]
+
+
+# Template name -> cell layout for a given canvas size, in the order photos
+# are supplied and pasted. New templates only need an entry here.
+TEMPLATE_LAYOUTS: Dict[str, Callable[[int, int], List[Cell]]] = {
+    "single": _grid(1, 1, 0),
+    "two_side_by_side": _grid(2, 1, 20),
+    "three_photos": _three_photos,
+    "four_quarters": _grid(2, 2, 20),
+    "two_vertical": _grid(1, 2, 20),
+    "five_collage": _five_collage,
+    "six_grid": _grid(3, 2, 15),
+    "three_horizontal": _grid(3, 1, 15),
+    "three_bookmarks": _grid(1, 3, 15),
+    "three_sideways": _three_sideways,
+}
+
+
+@lru_cache(maxsize=None)
+def layout_cells(template_type: str, canvas_size: Tuple[int, int]) -> Tuple[Cell, ...]:
+    """Cell rectangles for a template on a canvas, computed once per (template, size)"""
+    return tuple(TEMPLATE_LAYOUTS[template_type](*canvas_size))
+
+
+def scale_cells(cells: Tuple[Cell, ...], scale: float) -> Tuple[Cell, ...]:
+    """The layout shrunk for a preview canvas; at scale 1 the print layout is returned untouched"""
+    if scale == 1:
+        return cells
+    return tuple(
+        Cell(round(cell.x * scale), round(cell.y * scale),
+             max(1, round(cell.width * scale)), max(1, round(cell.height * scale)),
+             round(cell.border * scale))
+        for cell in cells
+    )
+
+
+def scale_size(size: Tuple[int, int], scale: float) -> Tuple[int, int]:
+    """Canvas size at a preview scale"""
+    if scale == 1:
+        return size
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
 
 
 class TemplateEngine:
     """Handle multi-photo template layouts for postcard fronts"""
-    
-    # Standard postcard dimensions - exact from old working version
-    REGULAR_SIZE = (1800, 1200)  # 4x6 inches at 300 DPI
-    XL_SIZE = (2754, 1872)       # XL size - exact dimensions from old version
-    
-    def __init__(self, postcard_size: str = "xl"):
-        # Use exact logic from old working version
-        if postcard_size == "regular" or postcard_size == "4x6":
-            self.size = self.REGULAR_SIZE  # 4x6 inches
-        else:
-            self.size = self.XL_SIZE  # XL size
+
+    # Standard postcard dimensions (front canvas at 300 DPI)
+    REGULAR_SIZE = (1800, 1200)  # 6x4 inches at 300 DPI
+    XL_SIZE = (2700, 1800)       # 9x6 inches at 300 DPI
+
+    def __init__(self, postcard_size: str = "xl", scale: float = 1.0):
+        # Layouts are defined on the print canvas; previews compose the same layout shrunk by scale
+        self.print_size = self.XL_SIZE if postcard_size == "xl" else self.REGULAR_SIZE
+        self.scale = scale
+        self.size = scale_size(self.print_size, scale)
         self.width, self.height = self.size
-        
-    def _load_image_from_url(self, image_url: str) -> Image.Image:
-        """Load image from URL or base64 data"""
+
+    def _load_image_from_url(self, image_url: str, target_size: Optional[tuple] = None) -> Image.Image:
+        """Load image from URL or base64 data, decoding only as much resolution as target_size needs"""
+        image_data = fetch_image_bytes(image_url)
+        return decode_image(image_data, target_size)
+
+    def _load_preview_source(self, image_url: str, source_key: str) -> Image.Image:
+        """One shrunk decode per photo that every preview layout fits its cells from"""
+        # A short side as long as the canvas's longest edge covers any cell of any template
+        edge = max(self.size)
+        cache_key = (source_key, ("preview-source", edge))
+        image = fitted_image_cache.get(cache_key)
+        if image is None:
+            image = self._load_image_from_url(image_url, (edge, edge))
+            shrink = edge / min(image.size)
+            if shrink < 0.5:
+                # Draft decoding only applies to JPEGs; shrink other formats before caching them
+                image = image.resize((math.ceil(image.width * shrink), math.ceil(image.height * shrink)),
+                                     Image.Resampling.LANCZOS, reducing_gap=2.0)
+            fitted_image_cache.put(cache_key, image)
+        return image
+
+    def _load_and_fit(self, cell: tuple) -> Image.Image:
+        """Load one (url, size) cell and fit it to its rectangle, reusing cached fits"""
+        image_url, target_size = cell
         try:
-            if image_url.startswith('data:image'):
-                # Handle base64 data URLs
-                header, encoded = image_url.split(',', 1)
-                image_data = base64.b64decode(encoded)
-                return Image.open(io.BytesIO(image_data)).convert('RGB')
-            else:
-                # Handle regular URLs
-                with urllib.request.urlopen(image_url) as response:
-                    return Image.open(response).convert('RGB')
+            source_key = source_cache_key(image_url)
+            cache_key = (source_key, target_size)
+            image = fitted_image_cache.get(cache_key)
+            if image is None:
+                if self.scale < 1:
+                    source = self._load_preview_source(image_url, source_key)
+                else:
+                    source = self._load_image_from_url(image_url, target_size)
+                image = self._resize_and_crop(source, target_size)
+                fitted_image_cache.put(cache_key, image)
+            return image
         except Exception as e:
             print(f"[TEMPLATE] Error loading image from {image_url[:50]}...: {e}")
             # Return a placeholder image
             placeholder = Image.new('RGB', (400, 400), color='lightgray')
-            return placeholder
-    
+            return self._resize_and_crop(placeholder, target_size)
+
+    def _load_and_fit_all(self, cells: List[tuple]) -> List[Image.Image]:
+        """Fetch, decode and fit every (url, size) cell concurrently, preserving order"""
+        return run_concurrently(self._load_and_fit, cells)
+
     def _resize_and_crop(self, image: Image.Image, target_size: tuple) -> Image.Image:
         """Resize and crop image to fit target size while maintaining aspect ratio"""
         target_width, target_height = target_size
-        
+
         # Calculate ratios
         img_ratio = image.width / image.height
         target_ratio = target_width / target_height
-        
+
         if img_ratio > target_ratio:
             # Image is wider than target - crop width
             new_height = image.height
@@ -58,369 +191,41 @@ class TemplateEngine:
             new_height = int(new_width / target_ratio)
             top = (image.height - new_height) // 2
             image = image.crop((0, top, new_width, top + new_height))
-        
+
         return image.resize(target_size, Image.Resampling.LANCZOS)
-    
+
     def apply_template(self, template_type: str, image_urls: List[str]) -> Image.Image:
         """Apply specified template with provided images"""
         print(f"[TEMPLATE] Applying template: {template_type}")
-        
-        if template_type == "single":
-            if len(image_urls) < 1:
-                raise ValueError("Single template requires 1 image")
-            return self._apply_single_photo(image_urls[0])
-            
-        elif template_type == "two_side_by_side":
-            if len(image_urls) < 2:
-                raise ValueError("Two side-by-side template requires 2 images")
-            return self._apply_two_side_by_side(image_urls[0], image_urls[1])
-            
-        elif template_type == "three_photos":
-            if len(image_urls) < 3:
-                raise ValueError("Three photos template requires 3 images")
-            return self._apply_three_photos(image_urls[0], image_urls[1], image_urls[2])
-            
-        elif template_type == "four_quarters":
-            if len(image_urls) < 4:
-                raise ValueError("Four quarters template requires 4 images")
-            return self._apply_four_quarters(image_urls)
-            
-        elif template_type == "two_vertical":
-            if len(image_urls) < 2:
-                raise ValueError("Two vertical template requires 2 images")
-            return self._apply_two_vertical(image_urls[0], image_urls[1])
-            
-        elif template_type == "five_collage":
-            if len(image_urls) < 5:
-                raise ValueError("Five collage template requires 5 images")
-            return self._apply_five_collage(image_urls)
-            
-        elif template_type == "six_grid":
-            if len(image_urls) < 6:
-                raise ValueError("Six grid template requires 6 images")
-            return self._apply_six_grid(image_urls)
-            
-        elif template_type == "three_horizontal":
-            if len(image_urls) < 3:
-                raise ValueError("Three horizontal template requires 3 images")
-            return self._apply_three_horizontal(image_urls[0], image_urls[1], image_urls[2])
-            
-        elif template_type == "three_bookmarks":
-            if len(image_urls) < 3:
-                raise ValueError("Three bookmarks template requires 3 images")
-            return self._apply_three_bookmarks(image_urls[0], image_urls[1], image_urls[2])
-            
-        elif template_type == "three_sideways":
-            if len(image_urls) < 3:
-                raise ValueError("Three sideways template requires 3 images")
-            return self._apply_three_sideways(image_urls[0], image_urls[1], image_urls[2])
-            
-        else:
+
+        if template_type not in TEMPLATE_LAYOUTS:
             # Default to single photo
             print(f"[TEMPLATE] Unknown template type: {template_type}, defaulting to single")
-            return self._apply_single_photo(image_urls[0])
-    
-    def _apply_single_photo(self, image_url: str) -> Image.Image:
-        """Template 1: Single photo covering entire front"""
-        print(f"[TEMPLATE] Applying single photo template")
-        image = self._load_image_from_url(image_url)
-        return self._resize_and_crop(image, self.size)
-    
-    def _apply_two_side_by_side(self, left_image_url: str, right_image_url: str) -> Image.Image:
-        """Template 2: Two photos side by side"""
-        print(f"[TEMPLATE] Applying two side-by-side template")
-        
-        # Create canvas
-        canvas = Image.new('RGB', self.size, color='white')
-        
-        # Calculate sizes (with small gap between images)
-        gap = 20
-        photo_width = (self.width - gap) // 2
-        photo_size = (photo_width, self.height)
-        
-        # Load and resize images
-        left_image = self._load_image_from_url(left_image_url)
-        right_image = self._load_image_from_url(right_image_url)
-        
-        left_image = self._resize_and_crop(left_image, photo_size)
-        right_image = self._resize_and_crop(right_image, photo_size)
-        
-        # Paste images
-        canvas.paste(left_image, (0, 0))
-        canvas.paste(right_image, (photo_width + gap, 0))
-        
-        return canvas
-    
-    def _apply_three_photos(self, left_image_url: str, top_right_url: str, bottom_right_url: str) -> Image.Image:
-        """Template 3: One large photo on left half, two smaller on right half (stacked)"""
-        print(f"[TEMPLATE] Applying three photos template")
-        
-        # Create canvas
-        canvas = Image.new('RGB', self.size, color='white')
-        
-        # Calculate sizes
-        gap = 20
-        left_width = self.width // 2 - gap // 2
-        right_width = self.width // 2 - gap // 2
-        right_height = (self.height - gap) // 2
-        
-        # Define rectangles
-        left_size = (left_width, self.height)
-        right_size = (right_width, right_height)
-        
-        # Load and resize images
-        left_image = self._load_image_from_url(left_image_url)
-        top_right_image = self._load_image_from_url(top_right_url)
-        bottom_right_image = self._load_image_from_url(bottom_right_url)
-        
-        left_image = self._resize_and_crop(left_image, left_size)
-        top_right_image = self._resize_and_crop(top_right_image, right_size)
-        bottom_right_image = self._resize_and_crop(bottom_right_image, right_size)
-        
-        # Paste images
-        canvas.paste(left_image, (0, 0))
-        canvas.paste(top_right_image, (left_width + gap, 0))
-        canvas.paste(bottom_right_image, (left_width + gap, right_height + gap))
-        
-        return canvas
-    
-    def _apply_four_quarters(self, image_urls: List[str]) -> Image.Image:
-        """Template 4: Four photos in quarters"""
-        print(f"[TEMPLATE] Applying four quarters template")
-        
-        if len(image_urls) < 4:
-            raise ValueError("Four quarters template requires exactly 4 images")
-        
-        # Create canvas
-        canvas = Image.new('RGB', self.size, color='white')
-        
-        # Calculate sizes
-        gap = 20
-        quarter_width = (self.width - gap) // 2
-        quarter_height = (self.height - gap) // 2
-        quarter_size = (quarter_width, quarter_height)
-        
-        # Load and resize images
-        images = []
-        for url in image_urls[:4]:  # Only use first 4 images
-            image = self._load_image_from_url(url)
-            image = self._resize_and_crop(image, quarter_size)
-            images.append(image)
-        
-        # Paste images in quarters
-        positions = [
-            (0, 0),                                    # Top left
-            (quarter_width + gap, 0),                  # Top right
-            (0, quarter_height + gap),                 # Bottom left
-            (quarter_width + gap, quarter_height + gap) # Bottom right
-        ]
-        
-        for i, (image, pos) in enumerate(zip(images, positions)):
-            canvas.paste(image, pos)
-        
-        return canvas
-    
-    def _apply_two_vertical(self, top_image_url: str, bottom_image_url: str) -> Image.Image:
-        """Template: Two photos stacked vertically"""
-        print(f"[TEMPLATE] Applying two vertical template")
-        
-        # Create canvas
-        canvas = Image.new('RGB', self.size, color='white')
-        
-        # Calculate sizes (with small gap between images)
-        gap = 20
-        photo_height = (self.height - gap) // 2
-        photo_size = (self.width, photo_height)
-        
-        # Load and resize images
-        top_image = self._load_image_from_url(top_image_url)
-        bottom_image = self._load_image_from_url(bottom_image_url)
-        
-        top_image = self._resize_and_crop(top_image, photo_size)
-        bottom_image = self._resize_and_crop(bottom_image, photo_size)
-        
-        # Paste images
-        canvas.paste(top_image, (0, 0))
-        canvas.paste(bottom_image, (0, photo_height + gap))
-        
-        return canvas
-    
-    def _apply_five_collage(self, image_urls: List[str]) -> Image.Image:
-        """Template: Five photos - four quarters with one overlaid in center"""
-        print(f"[TEMPLATE] Applying five collage template")
-        
-        if len(image_urls) < 5:
-            raise ValueError("Five collage template requires exactly 5 images")
-        
-        # Create canvas
-        canvas = Image.new('RGB', self.size, color='white')
-        
-        # Calculate sizes for background quarters
-        gap = 20
-        quarter_width = (self.width - gap) // 2
-        quarter_height = (self.height - gap) // 2
-        quarter_size = (quarter_width, quarter_height)
-        
-        # Load and resize background images (first 4)
-        background_images = []
-        for url in image_urls[:4]:
-            image = self._load_image_from_url(url)
-            image = self._resize_and_crop(image, quarter_size)
-            background_images.append(image)
-        
-        # Paste background images in quarters
-        positions = [
-            (0, 0),                                    # Top left
-            (quarter_width + gap, 0),                  # Top right
-            (0, quarter_height + gap),                 # Bottom left
-            (quarter_width + gap, quarter_height + gap) # Bottom right
-        ]
-        
-        for i, (image, pos) in enumerate(zip(background_images, positions)):
-            canvas.paste(image, pos)
-        
-        # Add center overlay image (5th image) - smaller and centered with white border
-        center_size = (int(quarter_width * 0.7), int(quarter_height * 0.7))
-        center_image = self._load_image_from_url(image_urls[4])
-        center_image = self._resize_and_crop(center_image, center_size)
-        
-        # Create white border around center image
-        border_width = 8  # Border thickness in pixels
-        bordered_size = (center_size[0] + border_width * 2, center_size[1] + border_width * 2)
-        bordered_image = Image.new('RGB', bordered_size, color='white')
-        bordered_image.paste(center_image, (border_width, border_width))
-        
-        # Calculate center position for bordered image
-        center_x = (self.width - bordered_size[0]) // 2
-        center_y = (self.height - bordered_size[1]) // 2
-        
-        canvas.paste(bordered_image, (center_x, center_y))
-        
-        return canvas
-    
-    def _apply_six_grid(self, image_urls: List[str]) -> Image.Image:
-        """Template: Six photos in a 2x3 grid"""
-        print(f"[TEMPLATE] Applying six grid template")
-        
-        if len(image_urls) < 6:
-            raise ValueError("Six grid template requires exactly 6 images")
-        
-        # Create canvas
-        canvas = Image.new('RGB', self.size, color='white')
-        
-        # Calculate sizes (3 columns, 2 rows)
-        gap = 15
-        cell_width = (self.width - (2 * gap)) // 3  # 3 columns with 2 gaps
-        cell_height = (self.height - gap) // 2      # 2 rows with 1 gap
-        cell_size = (cell_width, cell_height)
-        
-        # Load and resize images
-        images = []
-        for url in image_urls[:6]:  # Only use first 6 images
-            image = self._load_image_from_url(url)
-            image = self._resize_and_crop(image, cell_size)
-            images.append(image)
-        
-        # Paste images in grid (2 rows, 3 columns)
-        positions = [
-            # Top row
-            (0, 0),
-            (cell_width + gap, 0),
-            ((cell_width + gap) * 2, 0),
-            # Bottom row
-            (0, cell_height + gap),
-            (cell_width + gap, cell_height + gap),
-            ((cell_width + gap) * 2, cell_height + gap)
-        ]
-        
-        for i, (image, pos) in enumerate(zip(images, positions)):
-            canvas.paste(image, pos)
-        
-        return canvas
-    
-    def _apply_three_horizontal(self, left_image_url: str, center_image_url: str, right_image_url: str) -> Image.Image:
-        """Template: Three photos side by side horizontally"""
-        print(f"[TEMPLATE] Applying three horizontal template")
-        
-        # Create canvas
-        canvas = Image.new('RGB', self.size, color='white')
-        
-        # Calculate sizes (with small gaps between images)
-        gap = 15
-        photo_width = (self.width - (2 * gap)) // 3  # 3 photos with 2 gaps
-        photo_size = (photo_width, self.height)
-        
-        # Load and resize images
-        left_image = self._load_image_from_url(left_image_url)
-        center_image = self._load_image_from_url(center_image_url)
-        right_image = self._load_image_from_url(right_image_url)
-        
-        left_image = self._resize_and_crop(left_image, photo_size)
-        center_image = self._resize_and_crop(center_image, photo_size)
-        right_image = self._resize_and_crop(right_image, photo_size)
-        
-        # Paste images
-        canvas.paste(left_image, (0, 0))
-        canvas.paste(center_image, (photo_width + gap, 0))
-        canvas.paste(right_image, ((photo_width + gap) * 2, 0))
-        
-        return canvas
+            template_type = "single"
+
+        cells = scale_cells(layout_cells(template_type, self.print_size), self.scale)
+        if len(image_urls) < len(cells):
+            name = template_type.replace("_", " ").capitalize()
+            raise ValueError(f"{name} template requires {len(cells)} image{'s' if len(cells) > 1 else ''}")
+
+        return self._compose(cells, image_urls[:len(cells)])
+
+    def _compose(self, cells: Tuple[Cell, ...], image_urls: List[str]) -> Image.Image:
+        """Fetch, decode and fit every cell concurrently, then paste in layout order"""
+        photos = self._load_and_fit_all([(url, cell.size) for url, cell in zip(image_urls, cells)])
 
-    def _apply_three_bookmarks(self, top_image_url: str, middle_image_url: str, bottom_image_url: str) -> Image.Image:
-        """Template: Three narrow horizontal bookmark-style photos stacked vertically (3:0.67 ratio)"""
-        print(f"[TEMPLATE] Applying three bookmarks template")
-        
-        # Create canvas
         canvas = Image.new('RGB', self.size, color='white')
-        
-        # Calculate sizes for narrow horizontal strips stacked vertically
-        gap = 15
-        photo_height = (self.height - (2 * gap)) // 3  # 3 photos with 2 gaps, stacked vertically
-        photo_size = (self.width, photo_height)  # Full width, narrow height
-        
-        # Load and resize images for bookmark style (wide and narrow)
-        top_image = self._load_image_from_url(top_image_url)
-        middle_image = self._load_image_from_url(middle_image_url)
-        bottom_image = self._load_image_from_url(bottom_image_url)
-        
-        # Apply bookmark aspect ratio (wide, narrow strips)
-        top_image = self._resize_and_crop(top_image, photo_size)
-        middle_image = self._resize_and_crop(middle_image, photo_size)
-        bottom_image = self._resize_and_crop(bottom_image, photo_size)
-        
-        # Paste images vertically stacked
-        canvas.paste(top_image, (0, 0))
-        canvas.paste(middle_image, (0, photo_height + gap))
-        canvas.paste(bottom_image, (0, (photo_height + gap) * 2))
-        
+        for cell, photo in zip(cells, photos):
+            if cell.border:
+                frame = (cell.x - cell.border, cell.y - cell.border,
+                         cell.x + cell.width + cell.border, cell.y + cell.height + cell.border)
+                canvas.paste('white', frame)
+            canvas.paste(photo, (cell.x, cell.y))
+
         return canvas
 
-    def _apply_three_sideways(self, top_image_url: str, bottom_left_image_url: str, bottom_right_image_url: str) -> Image.Image:
-        """Template: One wide photo on top (3:1) with two photos below (1.5:1)"""
-        print(f"[TEMPLATE] Applying three sideways template")
-        
-        # Create canvas
-        canvas = Image.new('RGB', self.size, color='white')
-        
-        # Calculate sizes for top wide photo and bottom two photos
-        gap = 15
-        top_height = int(self.height * 0.4)  # Top photo takes 40% of height
-        bottom_height = self.height - top_height - gap
-        bottom_width = (self.width - gap) // 2  # Two bottom photos split width
-        
-        # Load and resize images
-        top_image = self._load_image_from_url(top_image_url)
-        bottom_left_image = self._load_image_from_url(bottom_left_image_url)
-        bottom_right_image = self._load_image_from_url(bottom_right_image_url)
-        
-        # Resize with appropriate ratios
-        top_image = self._resize_and_crop(top_image, (self.width, top_height))  # 3:1 wide
-        bottom_left_image = self._resize_and_crop(bottom_left_image, (bottom_width, bottom_height))  # 1.5:1
-        bottom_right_image = self._resize_and_crop(bottom_right_image, (bottom_width, bottom_height))  # 1.5:1
-        
-        # Paste images
-        canvas.paste(top_image, (0, 0))  # Top wide photo
-        canvas.paste(bottom_left_image, (0, top_height + gap))  # Bottom left
-        canvas.paste(bottom_right_image, (bottom_width + gap, top_height + gap))  # Bottom right
-        
-        return canvas
\ No newline at end of file
+
+# Precompute the cell table for both canvas sizes at import
+for _template_type in TEMPLATE_LAYOUTS:
+    for _canvas_size in (TemplateEngine.REGULAR_SIZE, TemplateEngine.XL_SIZE):
+        layout_cells(_template_type, _canvas_size)
@@ -0,0 +1,110 @@
+"""
+Local blob store for rendered postcard images
+
+Render workers encode JPEGs straight into files here, so the encoded bytes
+never sit in an in-memory buffer or cross the process-pool pipe. Uploads
+stream from the file, and when an upload fails the blob is served at
+/blobs/{id} instead of being inlined as a base64 data: URL. Those URLs are
+for display only: blobs live on one replica's disk until evicted, so they are
+never stored as the image Stannp prints from.
+"""
+import os
+import re
+import threading
+import time
+import uuid
+from typing import BinaryIO, Callable, Dict, Optional
+
+from app.config.settings import BLOB_STORE_DIR, BLOB_STORE_MB, BLOB_TTL_HOURS, PUBLIC_BASE_URL
+
+
+_BLOB_ID = re.compile(r"^[0-9a-f]{32}$")
+_BLOB_URL = re.compile(r"/blobs/[0-9a-f]{32}\.jpg$")
+
+
+class LocalBlobStore:
+    """Write-once image files addressed by random ID, expired by age and a size cap"""
+
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+    def path(self, blob_id: str) -> Optional[str]:
+        """Filesystem path for a blob, or None for a malformed ID"""
+        if not _BLOB_ID.match(blob_id):
+            return None
+        return os.path.join(self.directory, f"{blob_id}.jpg")
+
+    def save(self, write: Callable[[BinaryIO], None]) -> str:
+        """Create a blob by letting write() stream into its file; returns the new ID"""
+        os.makedirs(self.directory, exist_ok=True)
+        blob_id = uuid.uuid4().hex
+        path = self.path(blob_id)
+        # Write-then-rename so the blob route never serves a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+        return blob_id
+
+    def size(self, blob_id: str) -> int:
+        return os.path.getsize(self.path(blob_id))
+
+    def read(self, blob_id: str) -> bytes:
+        with open(self.path(blob_id), 'rb') as f:
+            return f.read()
+
+    def delete(self, blob_id: str):
+        try:
+            os.remove(self.path(blob_id))
+        except FileNotFoundError:
+            pass
+
+    def url(self, blob_id: str) -> str:
+        """Public URL of the blob route for this ID; raises RuntimeError without an absolute PUBLIC_BASE_URL"""
+        if not PUBLIC_BASE_URL:
+            raise RuntimeError("PUBLIC_BASE_URL is not set, so local blobs cannot be served")
+        return f"{PUBLIC_BASE_URL}/blobs/{blob_id}.jpg"
+
+    def is_blob_url(self, url: Optional[str]) -> bool:
+        """True for a URL of the blob route (absolute or relative)"""
+        return bool(url) and _BLOB_URL.search(url) is not None
+
+    def _entries(self):
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.endswith('.tmp'):
+                        stat = entry.stat()
+                        yield stat.st_mtime, stat.st_size, entry.path
+        except FileNotFoundError:
+            return
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        expires_before = time.time() - self.ttl_seconds
+
+        for mtime, size, path in entries:
+            if mtime >= expires_before and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another worker evicted it first
+                pass
+            total -= size
+
+    def usage(self) -> Dict[str, int]:
+        entries = list(self._entries())
+        return {"blobEntries": len(entries), "blobBytes": sum(size for _, size, _ in entries)}
+
+
+blob_store = LocalBlobStore(BLOB_STORE_DIR, BLOB_STORE_MB * 1024 * 1024, BLOB_TTL_HOURS * 3600)
@@ -4,8 +4,13 @@ import base64
 from typing import Optional
 
 
-def send_email_notification(to_email: str, subject: str, message: str, pdf_url: Optional[str] = None):
-    """Send email notification using Resend with PDF attachment"""
+def send_email_notification(to_email: str, subject: str, message: str, pdf_url: Optional[str] = None,
+                            raise_errors: bool = False):
+    """Send email notification using Resend with PDF attachment
+
+    With raise_errors, a failed send raises instead of only being logged, so a
+    background job can retry it.
+    """
     try:
         if not resend.api_key:
             print(f"[EMAIL] WARNING: Resend API key not configured, skipping email to {to_email}")
@@ -95,4 +100,6 @@ def send_email_notification(to_email: str, subject: str, message: str, pdf_url:
         print(f"[EMAIL] Email sent successfully to {to_email}, ID: {result.get('id', 'unknown')}")
         
     except Exception as e:
-        print(f"[EMAIL] Failed to send email to {to_email}: {e}")
\ No newline at end of file
+        print(f"[EMAIL] Failed to send email to {to_email}: {e}")
+        if raise_errors:
+            raise
\ No newline at end of file
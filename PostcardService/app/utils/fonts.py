@@ -1,104 +1,77 @@
 from PIL import ImageFont
+from functools import lru_cache
 import os
-import tempfile
-import urllib.request
+import threading
+from typing import Optional
+
+from app.config.settings import FONT_PATH
+from app.utils.text_layout import wrap_text
+
+
+# Try fonts that support emojis first
+EMOJI_FONT_PATHS = [
+    "/System/Library/Fonts/Apple Color Emoji.ttc",  # macOS emoji font
+    "/usr/share/fonts/truetype/noto/NotoColorEmoji.ttf",  # Linux emoji font
+    "/Windows/Fonts/seguiemj.ttf",  # Windows emoji font
+]
+
+# Then regular fonts with good Unicode support
+FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/System/Library/Fonts/Arial.ttf",
+    "/System/Library/Fonts/Helvetica.ttc"
+]
+
+# Size used to check a candidate actually loads (bitmap emoji fonts reject most sizes)
+PROBE_SIZE = 32
+
+_resolved_path: Optional[str] = None
+_resolve_lock = threading.Lock()
+
+
+def resolve_font_path() -> str:
+    """Pick the font file once per process; raises if no candidate loads"""
+    global _resolved_path
+    if _resolved_path is not None:
+        return _resolved_path
+
+    with _resolve_lock:
+        if _resolved_path is None:
+            candidates = [FONT_PATH] if FONT_PATH else EMOJI_FONT_PATHS + FONT_PATHS
+            for font_path in candidates:
+                if not os.path.exists(font_path):
+                    continue
+                try:
+                    ImageFont.truetype(font_path, PROBE_SIZE)
+                except Exception as e:
+                    print(f"[FONT] Skipping {font_path}: {e}")
+                    continue
+                print(f"[FONT] Using {font_path} for postcard text")
+                _resolved_path = font_path
+                break
+            else:
+                raise RuntimeError(
+                    f"No usable font found (tried {', '.join(candidates)}); "
+                    "install fonts-dejavu-core or set FONT_PATH"
+                )
+    return _resolved_path
+
+
+@lru_cache(maxsize=64)
+def _truetype(font_path: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, size)
 
 
 def load_font(size: int) -> ImageFont.FreeTypeFont:
-    """Load font with emoji support and fallback options"""
-    print(f"[FONT] Attempting to load {size}pt font with emoji support")
-    
-    # Try fonts that support emojis first
-    emoji_font_paths = [
-        "/System/Library/Fonts/Apple Color Emoji.ttc",  # macOS emoji font
-        "/usr/share/fonts/truetype/noto/NotoColorEmoji.ttf",  # Linux emoji font
-        "/Windows/Fonts/seguiemj.ttf",  # Windows emoji font
-    ]
-    
-    # Try regular fonts with good Unicode support
-    font_paths = [
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", 
-        "/System/Library/Fonts/Arial.ttf",
-        "/System/Library/Fonts/Helvetica.ttc"
-    ]
-    
-    # Try emoji fonts first
-    for font_path in emoji_font_paths:
-        try:
-            if os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, size)
-                print(f"[FONT] SUCCESS: Loaded emoji font {font_path} at {size}pt")
-                return font
-        except Exception as e:
-            print(f"[FONT] Emoji font failed {font_path}: {e}")
-            continue
-    
-    # Try regular fonts
-    for font_path in font_paths:
-        try:
-            if os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, size)
-                print(f"[FONT] SUCCESS: Loaded {font_path} at {size}pt")
-                return font
-        except Exception as e:
-            print(f"[FONT] Failed {font_path}: {e}")
-            continue
-    
-    # Download font as fallback
-    try:
-        print("[FONT] Downloading DejaVu Sans font...")
-        font_url = "https://github.com/dejavu-fonts/dejavu-fonts/raw/version_2_37/ttf/DejaVuSans.ttf"
-        font_path = os.path.join(tempfile.gettempdir(), "DejaVuSans.ttf")
-        urllib.request.urlretrieve(font_url, font_path)
-        font = ImageFont.truetype(font_path, size)
-        print(f"[FONT] SUCCESS: Downloaded font at {size}pt")
-        return font
-    except Exception as e:
-        print(f"[FONT] Download failed: {e}")
-    
-    # Absolute fallback
-    print("[FONT] WARNING: Using default font (will be small)")
-    return ImageFont.load_default()
+    """Return the resolved postcard font at size, loading each (path, size) only once"""
+    return _truetype(resolve_font_path(), size)
 
 
-def process_message_with_line_breaks(message: str, max_width: int, font, draw) -> list:
-    """Process message while preserving user line breaks and handling emojis"""
+def process_message_with_line_breaks(message: str, max_width: int, font, draw=None) -> list:
+    """Wrap message to max_width while preserving user line breaks (blank lines kept as '')"""
     print(f"[MESSAGE] Processing message with line breaks preserved")
-    
-    # Split by user-defined line breaks first
-    user_lines = message.split('\n')
-    processed_lines = []
-    
-    for user_line in user_lines:
-        if not user_line.strip():
-            # Empty line - preserve it for spacing
-            processed_lines.append('')
-            continue
-            
-        # Word wrap each user line individually
-        words = user_line.split()
-        current_line = ""
-        
-        for word in words:
-            test_line = (current_line + " " + word).strip() if current_line else word
-            
-            # Check if line fits
-            try:
-                text_width = draw.textlength(test_line, font=font)
-            except:
-                # Fallback for older PIL versions or compatibility issues
-                text_width = len(test_line) * (font.size * 0.6) if hasattr(font, 'size') else len(test_line) * 20
-                
-            if text_width <= max_width:
-                current_line = test_line
-            else:
-                if current_line:
-                    processed_lines.append(current_line)
-                current_line = word
-        
-        if current_line:
-            processed_lines.append(current_line)
-    
-    print(f"[MESSAGE] Processed {len(user_lines)} user lines into {len(processed_lines)} final lines")
-    return processed_lines
\ No newline at end of file
+    user_line_count = len(message.split('\n'))
+    lines = [text for text, _ in wrap_text(message, max_width, font)]
+    print(f"[MESSAGE] Processed {user_line_count} user lines into {len(lines)} final lines")
+    return lines
@@ -0,0 +1,238 @@
+"""
+Two-tier cache for postcard source photos
+
+Memory tier: an LRU of decoded photos already fitted to a layout cell, keyed
+by (source key, cell size) and bounded by pixel bytes. It lives inside each
+render worker process.
+
+Disk tier: the raw downloaded bytes keyed by source key, shared by every
+worker through the filesystem and evicted oldest-first past a size cap.
+Each worker tracks the directory size from its own writes and only scans
+the directory when that count passes the cap or goes stale.
+
+Source keys are the SHA-256 of the URL for remote photos and the SHA-256 of
+the decoded bytes for data:image URIs.
+"""
+import base64
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from PIL import Image
+
+from app.config.settings import IMAGE_CACHE_DIR, IMAGE_CACHE_DISK_MB, IMAGE_CACHE_MEMORY_MB
+
+
+STAT_FIELDS = (
+    "memoryHits",
+    "memoryMisses",
+    "memoryEvictions",
+    "memoryEntries",
+    "memoryBytes",
+    "diskHits",
+    "diskMisses",
+    "diskEvictions",
+)
+
+# How long a worker trusts its running count of disk tier bytes; other workers' writes show up at the next rescan
+DISK_RESCAN_SECONDS = 60
+# Eviction frees down to this share of the cap, so a full cache is not rescanned on every write
+DISK_EVICT_TO = 0.9
+
+
+class CacheStats:
+    """Counters kept in shared memory so every render worker reports into one place"""
+
+    def __init__(self):
+        self.shared = multiprocessing.Array('q', len(STAT_FIELDS))
+
+    def attach(self, shared):
+        """Adopt the parent's counters inside a worker process"""
+        self.shared = shared
+
+    def incr(self, field: str, amount: int = 1):
+        with self.shared.get_lock():
+            self.shared[STAT_FIELDS.index(field)] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.shared.get_lock():
+            return dict(zip(STAT_FIELDS, self.shared[:]))
+
+
+def source_cache_key(image_url: str) -> str:
+    """Content key for a photo: hash of the URL, or of the decoded bytes for data URIs"""
+    if image_url.startswith('data:image'):
+        header, encoded = image_url.split(',', 1)
+        return hashlib.sha256(base64.b64decode(encoded)).hexdigest()
+    return hashlib.sha256(image_url.encode('utf-8')).hexdigest()
+
+
+class FittedImageCache:
+    """In-process LRU of fitted photos bounded by decoded pixel bytes"""
+
+    def __init__(self, max_bytes: int, stats: CacheStats):
+        self.max_bytes = max_bytes
+        self.stats = stats
+        self._items: "OrderedDict[Hashable, Image.Image]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _image_bytes(image: Image.Image) -> int:
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, key: Hashable) -> Optional[Image.Image]:
+        with self._lock:
+            image = self._items.get(key)
+            if image is None:
+                self.stats.incr("memoryMisses")
+                return None
+            self._items.move_to_end(key)
+        self.stats.incr("memoryHits")
+        return image
+
+    def put(self, key: Hashable, image: Image.Image):
+        size = self._image_bytes(image)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = image
+            self._bytes += size
+            self.stats.incr("memoryEntries")
+            self.stats.incr("memoryBytes", size)
+
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                evicted_size = self._image_bytes(evicted)
+                self._bytes -= evicted_size
+                self.stats.incr("memoryEvictions")
+                self.stats.incr("memoryEntries", -1)
+                self.stats.incr("memoryBytes", -evicted_size)
+
+    def clear(self):
+        with self._lock:
+            self.stats.incr("memoryEntries", -len(self._items))
+            self.stats.incr("memoryBytes", -self._bytes)
+            self._items.clear()
+            self._bytes = 0
+
+
+class DiskImageStore:
+    """Raw source bytes on local disk, evicted least-recently-used past a size cap"""
+
+    def __init__(self, directory: str, max_bytes: int, stats: CacheStats):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = stats
+        self._bytes: Optional[int] = None  # This process's estimate of the directory size
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        if self.max_bytes <= 0:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Bump mtime so eviction treats this entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            self.stats.incr("diskMisses")
+            return None
+        except OSError as e:
+            print(f"[IMAGE_CACHE] Disk read failed for {key[:12]}: {e}")
+            self.stats.incr("diskMisses")
+            return None
+
+        self.stats.incr("diskHits")
+        return data
+
+    def put(self, key: str, data: bytes):
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write-then-rename so concurrent workers never read a partial file
+            tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+            if self._grow(len(data)):
+                self._evict()
+        except OSError as e:
+            print(f"[IMAGE_CACHE] Disk write failed for {key[:12]}: {e}")
+
+    def _entries(self):
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.endswith('.tmp'):
+                        stat = entry.stat()
+                        yield stat.st_mtime, stat.st_size, entry.path
+        except FileNotFoundError:
+            return
+
+    def _grow(self, written: int) -> bool:
+        """Add a write to the running byte count, rescanning when it is stale; True when over the cap"""
+        now = time.monotonic()
+        with self._lock:
+            if self._bytes is None or now - self._scanned_at > DISK_RESCAN_SECONDS:
+                self._bytes = sum(entry_size for _, entry_size, _ in self._entries())
+                self._scanned_at = now
+            else:
+                # Overwriting an existing key counts twice, which only brings the next scan forward
+                self._bytes += written
+            return self._bytes > self.max_bytes
+
+    def _evict(self):
+        entries = list(self._entries())
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            total = self._remove_oldest(entries, total)
+        with self._lock:
+            self._bytes = total
+            self._scanned_at = time.monotonic()
+
+    def _remove_oldest(self, entries, total: int) -> int:
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another worker evicted it first
+                pass
+            total -= size
+            self.stats.incr("diskEvictions")
+            if total <= self.max_bytes * DISK_EVICT_TO:
+                break
+        return total
+
+    def usage(self) -> Dict[str, int]:
+        entries = list(self._entries())
+        return {"diskEntries": len(entries), "diskBytes": sum(size for _, size, _ in entries)}
+
+
+cache_stats = CacheStats()
+fitted_image_cache = FittedImageCache(IMAGE_CACHE_MEMORY_MB * 1024 * 1024, cache_stats)
+disk_image_store = DiskImageStore(IMAGE_CACHE_DIR, IMAGE_CACHE_DISK_MB * 1024 * 1024, cache_stats)
+
+
+def image_cache_stats() -> Dict[str, Any]:
+    """Hit/miss/eviction counters across all render workers plus disk usage"""
+    stats = cache_stats.snapshot()
+    stats.update(disk_image_store.usage())
+    stats["memoryMaxBytes"] = fitted_image_cache.max_bytes
+    stats["diskMaxBytes"] = disk_image_store.max_bytes
+    return stats
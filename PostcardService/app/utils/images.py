@@ -0,0 +1,77 @@
+import base64
+import io
+import math
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageOps
+
+from app.config.settings import IMAGE_FETCH_CONCURRENCY, IMAGE_FETCH_TIMEOUT_SECONDS
+from app.utils.image_cache import disk_image_store, source_cache_key
+
+
+def fetch_image_bytes(image_url: str, timeout: float = IMAGE_FETCH_TIMEOUT_SECONDS) -> bytes:
+    """Return the raw bytes behind an http(s) URL or a base64 data URI"""
+    if image_url.startswith('data:image'):
+        # Handle base64 data URLs
+        header, encoded = image_url.split(',', 1)
+        return base64.b64decode(encoded)
+    
+    # Re-renders of the same card reuse the bytes downloaded last time
+    cache_key = source_cache_key(image_url)
+    cached = disk_image_store.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    # Handle regular URLs
+    with urllib.request.urlopen(image_url, timeout=timeout) as response:
+        image_data = response.read()
+    disk_image_store.put(cache_key, image_data)
+    return image_data
+
+
+def draft_request_size(source_size: Tuple[int, int], target_size: Tuple[int, int], crop_to_fill: bool = True) -> Tuple[int, int]:
+    """Smallest full-frame size that still covers target_size after the layout crop"""
+    source_width, source_height = source_size
+    target_width, target_height = target_size
+    
+    if crop_to_fill:
+        # _resize_and_crop keeps the largest centered region with the target's
+        # aspect ratio, so only that region has to stay at or above target size
+        target_ratio = target_width / target_height
+        usable_height = min(source_height, source_width / target_ratio)
+        scale = target_height / usable_height
+    else:
+        # Plain resize: both axes must independently cover the target
+        scale = max(target_width / source_width, target_height / source_height)
+    
+    return math.ceil(source_width * scale), math.ceil(source_height * scale)
+
+
+def decode_image(image_data: bytes, target_size: Optional[Tuple[int, int]] = None, crop_to_fill: bool = True) -> Image.Image:
+    """Decode photo bytes to upright RGB, skipping JPEG resolution the target can't use"""
+    image = Image.open(io.BytesIO(image_data))
+    
+    if target_size:
+        # EXIF rotations of 90/270 degrees swap the axes the layout sees
+        orientation = image.getexif().get(0x0112, 1)
+        if orientation in (5, 6, 7, 8):
+            target_size = (target_size[1], target_size[0])
+        # JPEG-only: decode at the smallest 1/2, 1/4 or 1/8 DCT scale that still
+        # covers the cell; a no-op for other formats
+        image.draft('RGB', draft_request_size(image.size, target_size, crop_to_fill))
+    
+    ImageOps.exif_transpose(image, in_place=True)
+    return image.convert('RGB')
+
+
+def run_concurrently(fn: Callable[[Any], Any], items: Sequence[Any], max_workers: int = IMAGE_FETCH_CONCURRENCY) -> List[Any]:
+    """Apply fn to every item on a bounded thread pool, returning results in input order"""
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    
+    # Each item runs fetch -> decode -> resize end to end, so pixel work on the
+    # first photo to arrive overlaps the network wait for the rest
+    with ThreadPoolExecutor(max_workers=max(1, min(len(items), max_workers))) as pool:
+        return list(pool.map(fn, items))
@@ -0,0 +1,155 @@
+"""
+Word wrapping for postcard message text
+
+Each word (and the space) is measured once per font and cached, and line
+widths are accumulated from those measurements instead of re-shaping the
+whole growing line for every word. Words wider than the wrap width are
+hard-broken at character boundaries.
+
+fit_message searches for the largest font size at which a message fits its
+box, so long messages shrink instead of being cut off and short ones grow.
+"""
+import time
+from functools import lru_cache
+from typing import Callable, List, NamedTuple, Tuple
+
+from PIL import ImageFont
+
+
+class LineBox(NamedTuple):
+    """One wrapped line and where it is drawn; blank lines have empty text"""
+    text: str
+    x: int
+    y: int
+    width: float
+
+
+@lru_cache(maxsize=32768)
+def text_width(font: ImageFont.FreeTypeFont, text: str) -> float:
+    """Advance width of text in font, cached per (font, text)"""
+    return font.getlength(text)
+
+
+def _hard_break(word: str, max_width: float, font: ImageFont.FreeTypeFont) -> List[str]:
+    """Split a word that cannot fit on one line into chunks that do"""
+    chunks = []
+    chunk = ""
+    chunk_width = 0.0
+    for char in word:
+        char_width = text_width(font, char)
+        if chunk and chunk_width + char_width > max_width:
+            chunks.append(chunk)
+            chunk, chunk_width = "", 0.0
+        chunk += char
+        chunk_width += char_width
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def wrap_paragraph(paragraph: str, max_width: float, font: ImageFont.FreeTypeFont) -> List[tuple]:
+    """Greedy wrap of one user line into (text, width) pairs"""
+    space_width = text_width(font, " ")
+    lines = []
+    current: List[str] = []
+    current_width = 0.0
+
+    for word in paragraph.split():
+        word_width = text_width(font, word)
+
+        if word_width > max_width:
+            if current:
+                lines.append((" ".join(current), current_width))
+                current, current_width = [], 0.0
+            chunks = _hard_break(word, max_width, font)
+            lines.extend((chunk, text_width(font, chunk)) for chunk in chunks[:-1])
+            # The last chunk stays open so following words can join it
+            current, current_width = [chunks[-1]], text_width(font, chunks[-1])
+            continue
+
+        candidate_width = current_width + space_width + word_width if current else word_width
+        if candidate_width <= max_width:
+            current.append(word)
+            current_width = candidate_width
+        else:
+            lines.append((" ".join(current), current_width))
+            current, current_width = [word], word_width
+
+    if current:
+        lines.append((" ".join(current), current_width))
+    return lines
+
+
+def wrap_text(message: str, max_width: float, font: ImageFont.FreeTypeFont) -> List[tuple]:
+    """Wrap message to max_width, preserving user line breaks as blank lines"""
+    lines = []
+    for paragraph in message.split('\n'):
+        if not paragraph.strip():
+            # Empty line - preserve it for spacing
+            lines.append(("", 0.0))
+            continue
+        lines.extend(wrap_paragraph(paragraph, max_width, font))
+    return lines
+
+
+def layout_text(message: str, max_width: float, font: ImageFont.FreeTypeFont,
+                x: int, y: int, line_height: int) -> List[LineBox]:
+    """Wrap message and place each line top-down from (x, y)"""
+    return [
+        LineBox(text, x, y + index * line_height, width)
+        for index, (text, width) in enumerate(wrap_text(message, max_width, font))
+    ]
+
+
+class MessageLayout(NamedTuple):
+    """Typeset message: the font size chosen and the lines that fit the box"""
+    font_size: int
+    line_height: int
+    lines: List[LineBox]
+    truncated: bool
+
+
+def line_height_for(font_size: int) -> int:
+    """Leading used for message text (50px at the classic 40pt)"""
+    return round(font_size * 1.25)
+
+
+def set_message(message: str, font_size: int, font_loader: Callable[[int], ImageFont.FreeTypeFont],
+                box: Tuple[int, int, int, int]) -> MessageLayout:
+    """Lay out message at a fixed size in box (x, y, width, height), dropping lines that overflow"""
+    x, y, width, height = box
+    line_height = line_height_for(font_size)
+    lines = layout_text(message, width, font_loader(font_size), x, y, line_height)
+    capacity = max(1, height // line_height)
+    return MessageLayout(font_size, line_height, lines[:capacity], len(lines) > capacity)
+
+
+def fit_message(message: str, font_loader: Callable[[int], ImageFont.FreeTypeFont],
+                box: Tuple[int, int, int, int], min_size: int, max_size: int,
+                budget_seconds: float) -> MessageLayout:
+    """
+    Largest font size in [min_size, max_size] whose wrapped message fits box
+
+    Binary search over sizes; each probe is one wrap pass over cached word
+    widths. When the time budget runs out the best size found so far is used,
+    and if nothing fits the message is set at min_size and truncated.
+    """
+    x, y, width, height = box
+    deadline = time.perf_counter() + budget_seconds
+    best = None
+    low, high = min_size, max_size
+
+    while low <= high:
+        size = (low + high) // 2
+        line_count = len(wrap_text(message, width, font_loader(size)))
+        if line_count * line_height_for(size) <= height:
+            best = size
+            low = size + 1
+        else:
+            high = size - 1
+
+        if best is not None and time.perf_counter() > deadline:
+            print(f"[MESSAGE] Fit budget spent, settling for {best}pt")
+            break
+
+    return set_message(message, best or min_size, font_loader, box)
@@ -0,0 +1,147 @@
+"""
+Benchmark for coupon analytics served from the daily rollup
+
+Seeds a throwaway database with synthetic coupon distributions and
+redemptions spread over the last 90 days, then times analytics with nothing
+folded (a full scan of the raw tables), the first fold into
+coupon_daily_stats, and analytics read from the rollup. Fails if the rollup
+gives different totals, size or daily figures than the full scan.
+
+Run from the PostcardService directory:
+    python dev/coupon_rollup_benchmark.py --distributions 1000000 --redemptions 20000
+Pass --database-url to run against Postgres instead of a temporary SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DAYS = 90
+SIZES = ("regular", "xl")
+INSERT_BATCH_ROWS = 50_000
+
+
+def seed(engine, distributions: int, redemptions: int, codes: int):
+    from sqlalchemy import insert
+    from app.models.database import CouponCampaign, CouponCode, CouponDistribution, CouponRedemption, PostcardTransaction
+
+    rng = random.Random(0)
+    now = datetime.utcnow()
+
+    def moment():
+        return now - timedelta(seconds=rng.randrange(DAYS * 86400))
+
+    with engine.begin() as conn:
+        campaign_id = conn.execute(insert(CouponCampaign).values(
+            campaign_name="benchmark", campaign_type="benchmark", created_at=now - timedelta(days=DAYS)
+        )).inserted_primary_key[0]
+        code_ids = [
+            conn.execute(insert(CouponCode).values(
+                campaign_id=campaign_id, code=f"BENCH{index}", max_redemptions=None, times_redeemed=0,
+                created_at=now - timedelta(days=DAYS), is_active=True
+            )).inserted_primary_key[0]
+            for index in range(codes)
+        ]
+
+    for start in range(0, distributions, INSERT_BATCH_ROWS):
+        rows = [
+            {"coupon_code_id": rng.choice(code_ids), "transaction_id": f"bench-{index}", "recipient_name": "Ada Lovelace",
+             "recipient_address": "12 St James's Square, London", "sent_at": moment(), "postcard_size": rng.choice(SIZES)}
+            for index in range(start, min(start + INSERT_BATCH_ROWS, distributions))
+        ]
+        with engine.begin() as conn:
+            conn.execute(insert(CouponDistribution), rows)
+
+    # Redemptions take their postcard size from the redeeming order's transaction row
+    redeemed = rng.sample(range(distributions), min(redemptions, distributions))
+    for start in range(0, len(redeemed), INSERT_BATCH_ROWS):
+        batch = redeemed[start:start + INSERT_BATCH_ROWS]
+        with engine.begin() as conn:
+            conn.execute(insert(PostcardTransaction), [
+                {"transaction_id": f"bench-order-{index}", "postcard_size": rng.choice(SIZES)} for index in batch
+            ])
+            conn.execute(insert(CouponRedemption), [
+                {"coupon_code_id": rng.choice(code_ids), "transaction_id": f"bench-order-{index}",
+                 "customer_email": "customer@example.com", "redeemed_at": moment(), "redemption_value_cents": 299}
+                for index in batch
+            ])
+
+
+async def timed(coroutine_fn):
+    started = time.perf_counter()
+    result = await coroutine_fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def comparable(analytics):
+    """The figures that must match between the full scan and the rollup"""
+    return {key: analytics[key] for key in ("totals", "bySize", "daily")}, \
+        sorted(analytics["byCode"], key=lambda row: row["code"])
+
+
+async def run(distributions: int, redemptions: int, codes: int):
+    from app.models.database import AsyncSessionLocal, async_engine, engine, init_database
+    from app.repositories import coupon_stats
+    from app.services.coupon_service import get_coupon_analytics
+
+    async def analytics():
+        async with AsyncSessionLocal() as db:
+            return await get_coupon_analytics(db, days=DAYS + 1)
+
+    async def fold():
+        folded = {}
+        for source in coupon_stats.SOURCES:
+            async with AsyncSessionLocal() as db:
+                # Nothing inserts while the benchmark folds, so runs need no gap between them
+                folded[source] = await coupon_stats.compact(db, source, min_gap_seconds=0)
+        return folded
+
+    init_database()
+    print(f"Seeding {distributions} distributions and {redemptions} redemptions over {DAYS} days...")
+    started = time.perf_counter()
+    seed(engine, distributions, redemptions, codes)
+    print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+    full_scan, full_scan_ms = await timed(analytics)
+    # A compaction folds up to the highest id seen by the previous one, so the first run only records it
+    await fold()
+    folded, fold_ms = await timed(fold)
+    from_rollup, rollup_ms = await timed(analytics)
+    await async_engine.dispose()
+
+    print(f"analytics, nothing folded (full scan):  {full_scan_ms:8.1f}ms")
+    print(f"first fold of all rows:                 {fold_ms:8.1f}ms  {folded}")
+    print(f"analytics from the rollup:              {rollup_ms:8.1f}ms")
+
+    assert full_scan["totals"]["distributions"] == distributions, full_scan["totals"]
+    assert all(row["lastId"] > 0 for row in from_rollup["rollupWatermarks"].values()), from_rollup["rollupWatermarks"]
+    assert comparable(from_rollup) == comparable(full_scan), "rollup figures differ from the full scan"
+    print("Rollup totals, by-code, by-size and daily figures match the full scan")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--distributions", type=int, default=1_000_000)
+    parser.add_argument("--redemptions", type=int, default=20_000)
+    parser.add_argument("--codes", type=int, default=4, help="distinct coupon codes")
+    parser.add_argument("--database-url", help="an empty database to seed (default: a temporary SQLite file)")
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        scratch = tempfile.mkdtemp(prefix="coupon-rollup-bench-")
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(scratch, 'postcards.db')}"
+    # Settings are read when app modules are imported, so the database is chosen before that
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        asyncio.run(run(args.distributions, args.redemptions, args.codes))
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
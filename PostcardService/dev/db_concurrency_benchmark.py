@@ -0,0 +1,164 @@
+"""
+Concurrency benchmark for postcard_transactions upserts on SQLite
+
+Runs 32 concurrent writers, each committing a series of transaction upserts
+through the app's sync engine (WAL, busy timeout and pool settings from
+app/models/database.py), alongside readers scanning the table. Reports
+throughput and commit latency percentiles, and fails if any writer or
+reader hits "database is locked".
+
+Run from the PostcardService directory:
+    python dev/db_concurrency_benchmark.py --writers 32 --upserts 60
+--mode processes (default) runs one process per writer, as uvicorn workers
+and job workers would; --mode threads shares one process and its sync pool,
+sized for every writer and reader unless DB_SYNC_POOL_SIZE is set.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+LOCKED = "database is locked"
+_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import_app():
+    # Settings are read when app modules are imported, so DATABASE_URL is set before this runs
+    if _SERVICE_DIR not in sys.path:
+        sys.path.insert(0, _SERVICE_DIR)
+    from app.models import database
+    from app.repositories import transactions
+    return database, transactions
+
+
+def writer(index: int, upserts: int) -> Dict[str, List]:
+    """Upsert each transaction twice (render, then a later update), one commit per upsert"""
+    from sqlalchemy.exc import SQLAlchemyError
+
+    database, transactions = _import_app()
+    latencies, errors = [], []
+    for step in range(upserts):
+        transaction_id = f"bench-{index}-{step // 2}"
+        fields = {"postcard_size": "xl", "message": f"Wish you were here ({step})", "front_url": f"https://example.com/{step}.jpg"}
+        statement, params = transactions.upsert_statement(transaction_id, fields, "customer@example.com")
+        started = time.perf_counter()
+        try:
+            with database.SessionLocal() as db:
+                db.execute(statement, params)
+                db.commit()
+        except SQLAlchemyError as e:
+            errors.append(str(getattr(e, "orig", None) or e))
+            continue
+        latencies.append(time.perf_counter() - started)
+    return {"latencies": latencies, "errors": errors}
+
+
+def reader(stop, results):
+    from sqlalchemy import text
+    from sqlalchemy.exc import SQLAlchemyError
+
+    database, _ = _import_app()
+    scans, errors = 0, []
+    while not stop.is_set():
+        try:
+            with database.SessionLocal() as db:
+                db.execute(text("SELECT postcard_size, count(*) FROM postcard_transactions GROUP BY postcard_size")).all()
+            scans += 1
+        except SQLAlchemyError as e:
+            errors.append(str(getattr(e, "orig", None) or e))
+    results.put({"scans": scans, "errors": errors})
+
+
+def _process_writer(index: int, upserts: int, results):
+    results.put(writer(index, upserts))
+
+
+def run_processes(writers: int, upserts: int, readers: int):
+    context = multiprocessing.get_context("spawn")
+    results, reader_results, stop = context.Queue(), context.Queue(), context.Event()
+    reading = [context.Process(target=reader, args=(stop, reader_results)) for _ in range(readers)]
+    writing = [context.Process(target=_process_writer, args=(index, upserts, results)) for index in range(writers)]
+    for process in reading:
+        process.start()
+    started = time.perf_counter()
+    for process in writing:
+        process.start()
+    outcomes = [results.get() for _ in writing]
+    elapsed = time.perf_counter() - started
+    stop.set()
+    scans = [reader_results.get() for _ in reading]
+    for process in writing + reading:
+        process.join()
+    return outcomes, scans, elapsed
+
+
+def run_threads(writers: int, upserts: int, readers: int):
+    import queue
+    import threading
+
+    reader_results, stop = queue.Queue(), threading.Event()
+    reading = [threading.Thread(target=reader, args=(stop, reader_results)) for _ in range(readers)]
+    for thread in reading:
+        thread.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=writers) as pool:
+        outcomes = list(pool.map(writer, range(writers), [upserts] * writers))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in reading:
+        thread.join()
+    return outcomes, [reader_results.get() for _ in reading], elapsed
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else float("nan")
+
+
+def main(mode: str, writers: int, upserts: int, readers: int) -> int:
+    database, _ = _import_app()
+    database.init_database()
+    database.engine.dispose()
+
+    print(f"{writers} writers x {upserts} upserts, {readers} readers ({mode})")
+    run_mode = run_processes if mode == "processes" else run_threads
+    outcomes, scans, elapsed = run_mode(writers, upserts, readers)
+
+    latencies = [latency for outcome in outcomes for latency in outcome["latencies"]]
+    errors = [error for outcome in outcomes + scans for error in outcome["errors"]]
+    print(f"commits {len(latencies)} in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} tx/s")
+    print(f"commit latency p50 {percentile(latencies, 0.50) * 1000:.1f}ms  p95 {percentile(latencies, 0.95) * 1000:.1f}ms  "
+          f"max {max(latencies, default=float('nan')) * 1000:.1f}ms")
+    print(f"reader scans {sum(scan['scans'] for scan in scans)}")
+
+    locked = [error for error in errors if LOCKED in error]
+    if errors:
+        print(f"{len(errors)} errors, {len(locked)} of them '{LOCKED}', e.g. {errors[0]}")
+        return 1
+    print(f"No '{LOCKED}' errors")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=("processes", "threads"), default="processes")
+    parser.add_argument("--writers", type=int, default=32)
+    parser.add_argument("--upserts", type=int, default=60, help="commits per writer")
+    parser.add_argument("--readers", type=int, default=8)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="db-concurrency-bench-")
+    # Inherited by the spawned writer and reader processes
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(scratch, 'postcards.db')}"
+    if args.mode == "threads":
+        os.environ.setdefault("DB_SYNC_POOL_SIZE", str(args.writers + args.readers))
+    try:
+        exit_code = main(args.mode, args.writers, args.upserts, args.readers)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    sys.exit(exit_code)
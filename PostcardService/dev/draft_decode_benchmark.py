@@ -0,0 +1,100 @@
+"""
+Micro-benchmark for JPEG draft-mode decoding of front photos
+
+For each synthetic JPEG source size and front template, decodes one photo
+per layout cell and fits it with TemplateEngine._resize_and_crop, first with
+a full decode and then with the draft decode sized to the cell. Each
+measurement runs in a fresh process so peak RSS is its own. The source and
+image caches are bypassed.
+
+Run from the PostcardService directory:
+    python dev/draft_decode_benchmark.py --sources 4000x3000,8000x6000 --templates single,four_quarters,six_grid
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+from typing import List, Tuple
+
+_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def synthetic_jpeg(size: Tuple[int, int], seed: int = 0) -> bytes:
+    """A camera-sized JPEG stand-in: a gradient with random shapes"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse((x, y, x + rng.randrange(size[0] // 20, size[0] // 4), y + rng.randrange(size[1] // 20, size[1] // 4)),
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def fit_front(jpeg: bytes, template: str, draft: bool, runs: int) -> Tuple[float, float, List[Tuple[int, int]]]:
+    """Mean ms to decode and fit every cell, peak RSS in MB, and the fitted sizes"""
+    sys.path.insert(0, _SERVICE_DIR)
+    from app.services.template_engine import TemplateEngine, layout_cells
+    from app.utils.images import decode_image
+
+    engine = TemplateEngine("xl")
+    cells = layout_cells(template, engine.size)
+    timings, sizes = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fitted = [engine._resize_and_crop(decode_image(jpeg, cell.size if draft else None), cell.size) for cell in cells]
+        timings.append((time.perf_counter() - started) * 1000)
+        sizes = [image.size for image in fitted]
+        del fitted
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return statistics.mean(timings), peak_mb, sizes
+
+
+def _measure(jpeg: bytes, template: str, draft: bool, runs: int, results):
+    results.put(fit_front(jpeg, template, draft, runs))
+
+
+def measure(context, jpeg: bytes, template: str, draft: bool, runs: int):
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(jpeg, template, draft, runs, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def parse_size(text: str) -> Tuple[int, int]:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(sources: List[Tuple[int, int]], templates: List[str], runs: int):
+    context = multiprocessing.get_context("spawn")
+    print(f"XL canvas, mean of {runs} runs, peak RSS per process")
+    print(f"{'source':>10}  {'template':<14}  {'full ms':>8}  {'full MB':>8}  {'draft ms':>8}  {'draft MB':>8}  speedup")
+    for source in sources:
+        jpeg = synthetic_jpeg(source)
+        for template in templates:
+            full_ms, full_mb, full_sizes = measure(context, jpeg, template, False, runs)
+            draft_ms, draft_mb, draft_sizes = measure(context, jpeg, template, True, runs)
+            assert draft_sizes == full_sizes, (template, full_sizes, draft_sizes)
+            print(f"{source[0]}x{source[1]:<5}  {template:<14}  {full_ms:>8.0f}  {full_mb:>8.0f}  "
+                  f"{draft_ms:>8.0f}  {draft_mb:>8.0f}  {full_ms / draft_ms:>6.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sources", default="4000x3000,8000x6000", help="comma-separated JPEG sizes")
+    parser.add_argument("--templates", default="single,four_quarters,six_grid", help="comma-separated front templates")
+    parser.add_argument("--runs", type=int, default=2, help="timed runs per measurement")
+    args = parser.parse_args()
+    main([parse_size(size) for size in args.sources.split(",")], args.templates.split(","), args.runs)
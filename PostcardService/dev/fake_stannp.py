@@ -0,0 +1,52 @@
+"""
+Local fake of the Stannp postcards API for exercising the Stannp client
+
+Run:   uvicorn dev.fake_stannp:app --port 9000
+Then:  STANNP_API_URL=http://127.0.0.1:9000/api/v1 STANNP_API_KEY=test uvicorn main:app
+
+Failure injection (environment variables, read at startup):
+- FAKE_STANNP_FAILURES - comma-separated HTTP statuses returned by the first
+  requests before succeeding, e.g. "503,429,500"
+- FAKE_STANNP_DELAY_SECONDS - delay before every response
+"""
+import asyncio
+import itertools
+import os
+from urllib.parse import parse_qsl
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake Stannp")
+
+failures = [int(code) for code in os.getenv("FAKE_STANNP_FAILURES", "").split(",") if code.strip()]
+delay = float(os.getenv("FAKE_STANNP_DELAY_SECONDS", "0"))
+order_ids = itertools.count(1000)
+created = []
+attempts = {"count": 0}
+
+
+@app.post("/api/v1/postcards/create")
+async def create_postcard(request: Request):
+    attempts["count"] += 1
+    await asyncio.sleep(delay)
+
+    if failures:
+        status = failures.pop(0)
+        headers = {"Retry-After": "1"} if status == 429 else {}
+        return JSONResponse({"success": False, "error": f"injected {status}"}, status_code=status, headers=headers)
+
+    if not request.headers.get("authorization", "").startswith("Basic "):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+
+    # Parsed by hand so the fake does not need python-multipart
+    form = dict(parse_qsl((await request.body()).decode()))
+    order_id = next(order_ids)
+    created.append({"id": order_id, **form})
+    return {"success": True, "data": {"id": order_id, "pdf": f"https://fake-stannp.test/{order_id}.pdf", "status": "test"}}
+
+
+@app.get("/_created")
+async def created_postcards():
+    """Postcards created so far and total attempts, for assertions"""
+    return {"attempts": attempts["count"], "created": created}
@@ -0,0 +1,200 @@
+"""
+Load benchmark for postcard generation at increasing concurrency
+
+Sends generate-complete-postcard requests (an XL four-photo front from
+inline data: URLs, so no photo server is needed) at each concurrency level
+and reports latency percentiles and throughput. /health is probed every
+50ms throughout, which shows whether renders stall the event loop.
+
+--mode picks the endpoints: complete, back (generate-postcard-back) and
+front (generate-postcard-front) run at each concurrency level; batch sends
+one generate-postcard-batch request per --recipients count and reports the
+total time, time per postcard and time to the first recipient line. Every
+request uses a new transaction ID, so the render cache never answers it.
+
+Run the service first, e.g.:
+    STORAGE_BACKEND=local uvicorn main:app --port 8000
+Then:
+    python dev/load_benchmark.py --url http://127.0.0.1:8000 --concurrency 1,4,16 --requests 32
+    python dev/load_benchmark.py --mode back,front,complete --concurrency 1 --requests 8
+    python dev/load_benchmark.py --mode batch --recipients 100,1000
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import random
+import time
+import uuid
+from typing import Dict, List
+
+import httpx
+from PIL import Image, ImageDraw
+
+HEALTH_PROBE_SECONDS = 0.05
+ENDPOINTS = {
+    "complete": "/postcards/generate-complete-postcard",
+    "back": "/postcards/generate-postcard-back",
+    "front": "/postcards/generate-postcard-front"
+}
+
+
+def photo_data_url(seed: int, size=(2000, 1500)) -> str:
+    """A JPEG photo stand-in: a gradient with random shapes, so each request decodes distinct bytes"""
+    rng = random.Random(seed)
+    image = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse((x, y, x + rng.randrange(50, 400), y + rng.randrange(50, 400)),
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def postcard_payload(photos: List[str]) -> Dict:
+    return {
+        "message": "Wish you were here! " * 12,
+        "recipientInfo": {"to": "Ada Lovelace", "addressLine1": "12 St James's Square", "city": "London",
+                          "state": "", "zipcode": "SW1Y 4JH"},
+        "postcardSize": "xl",
+        "templateType": "four_quarters",
+        "frontImageUris": photos,
+        "transactionId": f"bench-{uuid.uuid4().hex[:12]}"
+    }
+
+
+def batch_payload(photos: List[str], recipients: int) -> Dict:
+    single = postcard_payload(photos)
+    batch_id = f"bench-batch-{uuid.uuid4().hex[:12]}"
+    return {
+        "batchId": batch_id,
+        "recipients": [{**single["recipientInfo"], "to": f"Recipient {index}"} for index in range(recipients)],
+        **{key: single[key] for key in ("message", "postcardSize", "templateType", "frontImageUris")}
+    }
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else float("nan")
+
+
+async def probe_health(client: httpx.AsyncClient, samples: List[float], stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            await client.get("/health", timeout=30)
+            samples.append(time.perf_counter() - started)
+        except httpx.HTTPError:
+            samples.append(float("inf"))
+        await asyncio.sleep(HEALTH_PROBE_SECONDS)
+
+
+async def run_level(client: httpx.AsyncClient, endpoint: str, concurrency: int, total: int, photo_pool: List[str]) -> Dict:
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    next_request = iter(range(total))
+
+    async def sender():
+        for index in next_request:
+            photos = [photo_pool[(index * 4 + offset) % len(photo_pool)] for offset in range(4)]
+            started = time.perf_counter()
+            response = await client.post(endpoint, json=postcard_payload(photos), timeout=300)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    health: List[float] = []
+    stop = asyncio.Event()
+    prober = asyncio.create_task(probe_health(client, health, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(sender() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await prober
+
+    return {
+        "concurrency": concurrency,
+        "statuses": statuses,
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+        "throughput": total / elapsed,
+        "healthP50": percentile(health, 0.50),
+        "healthMax": max(health, default=float("nan"))
+    }
+
+
+async def run_batch(client: httpx.AsyncClient, recipients: int, photo_pool: List[str]) -> Dict:
+    """One batch request, read to the end of its progress stream"""
+    events: Dict[str, Dict] = {}
+    first_recipient = None
+    health: List[float] = []
+    stop = asyncio.Event()
+    prober = asyncio.create_task(probe_health(client, health, stop))
+    started = time.perf_counter()
+    async with client.stream("POST", "/postcards/generate-postcard-batch",
+                             json=batch_payload(photo_pool[:4], recipients), timeout=None) as response:
+        status = response.status_code
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event.get("event") == "recipient" and first_recipient is None:
+                first_recipient = time.perf_counter() - started
+            events[event.get("event")] = event
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await prober
+
+    done = events.get("done", {})
+    return {
+        "recipients": recipients,
+        "status": status,
+        "seconds": elapsed,
+        "msPerPostcard": elapsed * 1000 / recipients,
+        "firstRecipientMs": (first_recipient or float("nan")) * 1000,
+        "outcome": {key: done.get(key) for key in ("succeeded", "failed", "recorded")},
+        "healthP50": percentile(health, 0.50),
+        "healthMax": max(health, default=float("nan"))
+    }
+
+
+async def main(url: str, modes: List[str], levels: List[int], total: int, photos: int, batch_sizes: List[int]):
+    print(f"Preparing {photos} photos...")
+    photo_pool = [photo_data_url(seed) for seed in range(photos)]
+    async with httpx.AsyncClient(base_url=url, limits=httpx.Limits(max_connections=max(levels) + 2)) as client:
+        await client.post(ENDPOINTS["complete"], json=postcard_payload(photo_pool[:4]), timeout=300)
+        for mode in modes:
+            if mode == "batch":
+                print(f"batch  {'recipients':>10}  {'total s':>7}  {'ms/card':>7}  {'first ms':>8}  "
+                      f"{'health p50 ms':>13}  {'health max ms':>13}  outcome")
+                for recipients in batch_sizes:
+                    result = await run_batch(client, recipients, photo_pool)
+                    print(f"batch  {result['recipients']:>10}  {result['seconds']:>7.2f}  {result['msPerPostcard']:>7.1f}  "
+                          f"{result['firstRecipientMs']:>8.0f}  {result['healthP50'] * 1000:>13.1f}  "
+                          f"{result['healthMax'] * 1000:>13.1f}  {result['status']} {result['outcome']}")
+                continue
+
+            print(f"{mode:<8}  {'conc':>4}  {'p50 s':>7}  {'p99 s':>7}  {'req/s':>6}  {'health p50 ms':>13}  {'health max ms':>13}  statuses")
+            for concurrency in levels:
+                result = await run_level(client, ENDPOINTS[mode], concurrency, total, photo_pool)
+                print(f"{mode:<8}  {result['concurrency']:>4}  {result['p50']:>7.2f}  {result['p99']:>7.2f}  {result['throughput']:>6.2f}  "
+                      f"{result['healthP50'] * 1000:>13.1f}  {result['healthMax'] * 1000:>13.1f}  {result['statuses']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mode", default="complete", help="comma-separated: complete, back, front, batch")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="requests per level")
+    parser.add_argument("--photos", type=int, default=16, help="distinct photos to rotate through")
+    parser.add_argument("--recipients", default="100,1000", help="comma-separated batch sizes for --mode batch")
+    args = parser.parse_args()
+    modes = args.mode.split(",")
+    unknown = [mode for mode in modes if mode not in ENDPOINTS and mode != "batch"]
+    if unknown:
+        parser.error(f"unknown mode: {', '.join(unknown)}")
+    asyncio.run(main(args.url, modes, [int(level) for level in args.concurrency.split(",")], args.requests,
+                     args.photos, [int(size) for size in args.recipients.split(",")]))
@@ -0,0 +1,108 @@
+"""
+Benchmark for message word wrapping on the back of the postcard
+
+Wraps 50 random 20-line messages (25-40 words per line) at the XL and
+regular message widths with the original algorithm, which re-measured the
+whole growing line for every word, and with app/utils/text_layout.py from a
+cold and a warm word-width cache. Fails if any message breaks into
+different lines than the original algorithm gave.
+
+Run from the PostcardService directory:
+    python dev/wrap_benchmark.py --messages 50 --font-size 40
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+from app.utils.fonts import load_font
+from app.utils.text_layout import text_width, wrap_text
+
+MESSAGE_WIDTHS = {"xl": 1400, "regular": 620}
+
+
+def original_wrap(message: str, max_width: int, font, draw) -> List[str]:
+    """The wrapping loop process_message_with_line_breaks used before text_layout"""
+    processed_lines = []
+    for user_line in message.split('\n'):
+        if not user_line.strip():
+            processed_lines.append('')
+            continue
+        current_line = ""
+        for word in user_line.split():
+            test_line = (current_line + " " + word).strip() if current_line else word
+            if draw.textlength(test_line, font=font) <= max_width:
+                current_line = test_line
+            else:
+                if current_line:
+                    processed_lines.append(current_line)
+                current_line = word
+        if current_line:
+            processed_lines.append(current_line)
+    return processed_lines
+
+
+def random_messages(count: int, seed: int = 0) -> List[str]:
+    """20-line messages of 25-40 short words, with the odd blank line"""
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice(string.ascii_letters) for _ in range(rng.randint(1, 12))) for _ in range(2000)]
+    vocabulary += ["Wish", "you", "were", "here!", "Love,", "Grandma", "café", "naïve", "—", "🙂"]
+    messages = []
+    for _ in range(count):
+        lines = [
+            "" if rng.random() < 0.1 else " ".join(rng.choice(vocabulary) for _ in range(rng.randint(25, 40)))
+            for _ in range(20)
+        ]
+        messages.append("\n".join(lines))
+    return messages
+
+
+def per_message_ms(wrap, messages: List[str]) -> float:
+    started = time.perf_counter()
+    for message in messages:
+        wrap(message)
+    return (time.perf_counter() - started) * 1000 / len(messages)
+
+
+def main(count: int, font_size: int) -> int:
+    font = load_font(font_size)
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    messages = random_messages(count)
+    mismatches = 0
+
+    print(f"{count} messages, {font_size}pt")
+    print(f"{'size':>8}  {'width':>5}  {'old ms/msg':>10}  {'cold ms/msg':>11}  {'warm ms/msg':>11}")
+    for size, max_width in MESSAGE_WIDTHS.items():
+        old_ms = per_message_ms(lambda message: original_wrap(message, max_width, font, draw), messages)
+        text_width.cache_clear()
+        cold_ms = per_message_ms(lambda message: wrap_text(message, max_width, font), messages)
+        warm_ms = per_message_ms(lambda message: wrap_text(message, max_width, font), messages)
+        print(f"{size:>8}  {max_width:>5}  {old_ms:>10.2f}  {cold_ms:>11.3f}  {warm_ms:>11.3f}")
+
+        for index, message in enumerate(messages):
+            expected = original_wrap(message, max_width, font, draw)
+            actual = [text for text, _ in wrap_text(message, max_width, font)]
+            if actual != expected:
+                mismatches += 1
+                print(f"  message {index} at {max_width}px: {len(expected)} original lines, {len(actual)} now")
+
+    if mismatches:
+        print(f"{mismatches} messages break differently from the original algorithm")
+        return 1
+    print("Line breaks match the original algorithm for every message")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--font-size", type=int, default=40)
+    args = parser.parse_args()
+    sys.exit(main(args.messages, args.font_size))
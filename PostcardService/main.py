@@ -4,15 +4,16 @@ XLPostcards Service - Clean Entry Point
 A clean, modular FastAPI application for postcard generation and processing.
 """
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 from fastapi.responses import RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # Configuration
 from app.config.settings import configure_services
-from app.models.database import init_database
+from app.models.database import init_database, get_async_db
 
 # Routers
-from app.routers import health, postcards, payments, coupons
+from app.routers import health, postcards, payments, coupons, metrics, blobs, jobs, storage
 
 # Create FastAPI app
 app = FastAPI(
@@ -26,6 +27,10 @@ app.include_router(health.router, tags=["Health"])
 app.include_router(postcards.router, prefix="/postcards", tags=["Postcards"])
 app.include_router(payments.router, prefix="/payments", tags=["Payments"])
 app.include_router(coupons.router, prefix="/coupons", tags=["Coupons"])
+app.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
+app.include_router(blobs.router, prefix="/blobs", tags=["Blobs"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Jobs"])
+app.include_router(storage.router, prefix="/storage", tags=["Storage"])
 
 
 @app.on_event("startup")
@@ -37,6 +42,10 @@ async def startup_event():
     print(f"[STARTUP] Python version: {os.sys.version}")
     print(f"[STARTUP] Working directory: {os.getcwd()}")
     
+    # Postcards cannot be rendered without a font, so this one is not allowed to fail softly
+    from app.utils.fonts import resolve_font_path
+    resolve_font_path()
+    
     try:
         print("[STARTUP] Configuring external services...")
         configure_services()
@@ -46,6 +55,20 @@ async def startup_event():
         init_database()
         print("[STARTUP] Database initialized")
         
+        print("[STARTUP] Starting render executor...")
+        from app.services.render_executor import render_executor
+        render_executor.start()
+        print("[STARTUP] Render executor started")
+        
+        print("[STARTUP] Starting job workers...")
+        from app.services.postcard_service import job_queue  # Registers the Stannp and email job handlers
+        job_queue.start()
+        
+        from app.services.coupon_cache import distribution_buffer
+        from app.services.coupon_rollups import rollup_compactor
+        distribution_buffer.start()
+        rollup_compactor.start()
+        
         print("[STARTUP] XLPostcards Service ready!")
         print("[STARTUP] Health endpoint available at /health")
     except Exception as e:
@@ -55,6 +78,26 @@ async def startup_event():
         print("[STARTUP] Service will continue with limited functionality")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop job workers, flush buffered writes, then release worker processes and pooled connections on shutdown"""
+    from app.services.coupon_cache import distribution_buffer
+    from app.services.coupon_rollups import rollup_compactor
+    from app.services.image_storage import image_storage
+    from app.services.job_queue import job_queue
+    from app.services.render_executor import render_executor
+    from app.services.stannp_client import stannp_client
+    print("[SHUTDOWN] Stopping job workers...")
+    await job_queue.stop()
+    print("[SHUTDOWN] Flushing coupon distributions...")
+    await distribution_buffer.stop()
+    await rollup_compactor.stop()
+    print("[SHUTDOWN] Stopping render executor...")
+    render_executor.shutdown()
+    await stannp_client.close()
+    await image_storage.close()
+
+
 @app.get("/")
 async def root():
     """Root endpoint redirects to docs"""
@@ -92,10 +135,10 @@ async def stripe_webhook_legacy(request):
 
 
 @app.get("/payment-status/{transaction_id}")
-async def payment_status_legacy(transaction_id: str):
+async def payment_status_legacy(transaction_id: str, db: AsyncSession = Depends(get_async_db)):
     """Legacy payment status endpoint"""
     from app.services.payment_service import get_payment_status
-    return await get_payment_status(transaction_id)
+    return await get_payment_status(transaction_id, db)
 
 
 @app.post("/submit-to-stannp")
@@ -106,32 +149,28 @@ async def submit_to_stannp_legacy(request: dict):
 
 
 @app.post("/generate-complete-postcard")
-async def generate_complete_postcard_legacy(request: dict):
+async def generate_complete_postcard_legacy(request: dict, db: AsyncSession = Depends(get_async_db)):
     """Legacy endpoint - redirect to postcards router"""
-    from app.services.postcard_generation_service import generate_complete_postcard_service
-    from app.models.database import get_db, CouponCode, CouponDistribution
+    from app.services.postcard_generation_service import generate_complete_postcard_async
+    from app.services.render_executor import RenderQueueFull, RenderTimeout
+    from app.routers.postcards import render_unavailable
     from app.models.schemas import PostcardRequest
     
     # Convert dict to proper request model
     postcard_request = PostcardRequest(**request)
     
-    # Get database session
-    db = next(get_db())
-    
     try:
         # Create transaction store (simple dict for legacy compatibility)
         transaction_store = {}
         
         # Call the service directly with all required arguments
-        return generate_complete_postcard_service(
+        return await generate_complete_postcard_async(
             request=postcard_request,
             transaction_store=transaction_store,
-            db_session=db,
-            coupon_code_model=CouponCode,
-            coupon_distribution_model=CouponDistribution
+            db=db
         )
-    finally:
-        db.close()
+    except (RenderQueueFull, RenderTimeout) as e:
+        raise render_unavailable(e)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,50 @@
+"""
+Test configuration: a throwaway SQLite database and local image storage
+
+Settings are read from the environment when app modules are imported, so
+they are set here before anything under app/ is loaded.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+_test_dir = tempfile.mkdtemp(prefix="postcard-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(_test_dir, 'postcards.db')}",
+    "STORAGE_BACKEND": "local",
+    "STORAGE_LOCAL_DIR": os.path.join(_test_dir, "storage"),
+    "PUBLIC_BASE_URL": "http://testserver",
+    "BLOB_STORE_DIR": os.path.join(_test_dir, "blobs"),
+    "IMAGE_CACHE_DIR": os.path.join(_test_dir, "image-cache"),
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from app.models.database import async_engine, init_database
+
+init_database()
+
+
+@pytest.fixture(scope="session")
+def event_loop_for_tests():
+    """One event loop for the whole session
+
+    Pooled async connections belong to the loop that opened them. Disposing
+    the engine between per-test loops rebuilds its pool with a thread lock in
+    place of the async one, and concurrent first connects then deadlock, so
+    every test shares this loop and the pool is disposed only at the end.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.run_until_complete(async_engine.dispose())
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def run(event_loop_for_tests):
+    """Run a coroutine to completion on the session's event loop"""
+    return event_loop_for_tests.run_until_complete
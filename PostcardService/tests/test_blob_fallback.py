@@ -0,0 +1,61 @@
+import pytest
+
+from app.models.database import AsyncSessionLocal
+from app.models.schemas import PostcardRequest
+from app.repositories import transactions as transactions_repo
+from app.services import postcard_generation_service as generation
+from app.services.image_storage import image_storage
+from app.services.payment_service import get_payment_status
+from app.services.render_executor import render_executor
+from app.utils.blob_store import blob_store
+
+
+def _failing_storage(monkeypatch):
+    async def run_inline(fn, *args, timeout=None):
+        return fn(*args)
+
+    async def put(key, path):
+        raise ConnectionError("storage is down")
+
+    monkeypatch.setattr(render_executor, "run", run_inline)
+    monkeypatch.setattr(image_storage, "put", put)
+
+
+def _request(transaction_id: str) -> PostcardRequest:
+    return PostcardRequest(
+        message="Served from the blob store",
+        recipientInfo={"to": "Ada Lovelace", "addressLine1": "12 St James's Square", "city": "London"},
+        postcardSize="regular",
+        transactionId=transaction_id
+    )
+
+
+def test_blob_fallback_is_shown_but_never_stored_for_printing(run, monkeypatch):
+    _failing_storage(monkeypatch)
+
+    async def generate_and_poll():
+        async with AsyncSessionLocal() as db:
+            response = await generation.generate_complete_postcard_async(_request("test-blob-fallback"), {}, db)
+            row = await transactions_repo.get_transaction(db, "test-blob-fallback")
+            status = await get_payment_status("test-blob-fallback", db)
+        return response, row, status
+
+    response, row, status = run(generate_and_poll())
+
+    assert blob_store.is_blob_url(response["backUrl"])
+    assert response["backUrl"].startswith("http://testserver/blobs/")
+    assert row.back_url is None and row.front_url is None
+    assert row.recipient_name == "Ada Lovelace"
+    assert status["status"] == "awaiting_postcard"
+
+
+def test_blob_fallback_needs_a_public_base_url(run, monkeypatch):
+    _failing_storage(monkeypatch)
+    monkeypatch.setattr(generation, "PUBLIC_BASE_URL", "")
+
+    async def generate():
+        async with AsyncSessionLocal() as db:
+            await generation.generate_postcard_back_async(_request("test-blob-no-base-url"), {}, db)
+
+    with pytest.raises(ConnectionError):
+        run(generate())
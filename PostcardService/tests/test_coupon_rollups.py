@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+
+from app.models.database import AsyncSessionLocal, CouponCampaign, CouponCode, CouponDistribution, RollupWatermark, SessionLocal
+from app.repositories import coupon_stats
+from app.services.coupon_rollups import RollupCompactor
+
+INTERVAL_SECONDS = 60
+
+
+def _create_code(code: str) -> int:
+    with SessionLocal() as db:
+        coupon = CouponCode(code=code, campaign=CouponCampaign(campaign_name=f"{code} campaign", campaign_type="test"),
+                            times_redeemed=0, expires_at=datetime.utcnow() + timedelta(days=30))
+        db.add(coupon)
+        db.commit()
+        return coupon.id
+
+
+def _distribute(coupon_id: int, distribution_id: int):
+    with SessionLocal() as db:
+        db.add(CouponDistribution(id=distribution_id, coupon_code_id=coupon_id, transaction_id=f"test-rollup-{distribution_id}",
+                                  sent_at=datetime.utcnow(), postcard_size="xl"))
+        db.commit()
+
+
+def _max_distribution_id() -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.coalesce(func.max(CouponDistribution.id), 0)))
+
+
+def _let_interval_pass():
+    """Backdate every watermark as if the last compaction ran an interval ago"""
+    with SessionLocal() as db:
+        db.execute(update(RollupWatermark).values(updated_at=datetime.utcnow() - timedelta(seconds=INTERVAL_SECONDS)))
+        db.commit()
+
+
+async def _rollup(coupon_id: int):
+    async with AsyncSessionLocal() as db:
+        rows = await coupon_stats.daily_stats(db, datetime.utcnow().date() - timedelta(days=1))
+        watermark = (await coupon_stats.watermarks(db))["coupon_distributions"]
+    return sum(row["distributions"] for row in rows if row["coupon_code_id"] == coupon_id), watermark["lastId"]
+
+
+def test_compactors_in_other_workers_wait_for_rows_that_commit_late(run):
+    coupon_id = _create_code("ROLLUPLAG")
+    late_id = _max_distribution_id() + 1
+    # late_id is handed out first but its insert commits after the next one
+    _distribute(coupon_id, late_id + 1)
+    _let_interval_pass()
+
+    async def compact_before_and_after_the_late_commit():
+        first_worker, second_worker = RollupCompactor(INTERVAL_SECONDS), RollupCompactor(INTERVAL_SECONDS)
+        await first_worker.run_once()
+        back_to_back = await second_worker.run_once()
+        before_commit = await _rollup(coupon_id)
+        _distribute(coupon_id, late_id)
+        _let_interval_pass()
+        await second_worker.run_once()
+        return back_to_back, before_commit, await _rollup(coupon_id)
+
+    back_to_back, before_commit, after_commit = run(compact_before_and_after_the_late_commit())
+
+    assert back_to_back == {source: 0 for source in coupon_stats.SOURCES}
+    assert before_commit[1] < late_id
+    assert after_commit == (2, late_id + 1)
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app.models.database import AsyncSessionLocal, CouponDistribution
+from app.repositories import coupons as coupons_repo
+from app.services import coupon_cache
+from app.services.coupon_cache import DistributionBuffer
+
+
+def _row(transaction_id: str):
+    return {
+        "coupon_code_id": None,
+        "transaction_id": transaction_id,
+        "recipient_name": "Ada Lovelace",
+        "recipient_address": "12 St James's Square, London,  SW1Y 4JH",
+        "postcard_size": "xl"
+    }
+
+
+async def _stored(prefix: str):
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(CouponDistribution).where(CouponDistribution.transaction_id.startswith(prefix)))
+        return list(result.scalars())
+
+
+def _idle_buffer() -> DistributionBuffer:
+    """A buffer that only writes when flushed explicitly or stopped"""
+    return DistributionBuffer(flush_rows=1000, flush_seconds=3600, max_pending=10000)
+
+
+def test_stop_writes_every_buffered_row(run):
+    buffer = _idle_buffer()
+
+    async def buffer_and_stop():
+        buffer.start()
+        for i in range(250):
+            buffer.add(_row(f"test-buffer-stop-{i}"))
+        await buffer.stop()
+        return await _stored("test-buffer-stop-")
+
+    stored = run(buffer_and_stop())
+
+    assert len(stored) == 250
+    assert buffer.stats()["pending"] == 0
+
+
+def test_failed_flush_is_requeued_and_written_on_stop(run, monkeypatch):
+    buffer = _idle_buffer()
+
+    def unavailable_database():
+        raise ConnectionError("database is down")
+
+    async def fail_once_then_stop():
+        buffer.start()
+        for i in range(40):
+            buffer.add(_row(f"test-buffer-retry-{i}"))
+        with monkeypatch.context() as patch:
+            patch.setattr(coupon_cache, "AsyncSessionLocal", unavailable_database)
+            try:
+                await buffer.flush()
+            except ConnectionError:
+                pass
+        for i in range(40, 60):
+            buffer.add(_row(f"test-buffer-retry-{i}"))
+        await buffer.stop()
+        return await _stored("test-buffer-retry-")
+
+    stored = run(fail_once_then_stop())
+
+    assert sorted(row.transaction_id for row in stored) == sorted(f"test-buffer-retry-{i}" for i in range(60))
+    assert buffer.stats()["failedFlushes"] == 1
+    assert buffer.stats()["dropped"] == 0
+
+
+def test_buffered_and_direct_rows_use_the_same_clock(run):
+    buffer = _idle_buffer()
+
+    async def write_both_ways():
+        buffer.start()
+        buffer.add(_row("test-buffer-clock-buffered"))
+        await buffer.stop()
+        async with AsyncSessionLocal() as db:
+            coupons_repo.add_distribution(db, **_row("test-buffer-clock-direct"))
+            await db.commit()
+        return {row.transaction_id: row.sent_at for row in await _stored("test-buffer-clock-")}
+
+    before = datetime.utcnow()
+    sent_at = run(write_both_ways())
+    after = datetime.utcnow()
+
+    for stamp in sent_at.values():
+        assert before - timedelta(seconds=1) <= stamp <= after + timedelta(seconds=1)
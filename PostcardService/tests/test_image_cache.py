@@ -0,0 +1,40 @@
+from app.utils.image_cache import CacheStats, DiskImageStore
+
+
+def _counting_scans(store: DiskImageStore, monkeypatch):
+    scans = []
+    entries = store._entries
+
+    def counted():
+        scans.append(1)
+        return entries()
+
+    monkeypatch.setattr(store, "_entries", counted)
+    return scans
+
+
+def test_writes_under_the_cap_scan_the_directory_once(tmp_path, monkeypatch):
+    store = DiskImageStore(str(tmp_path), max_bytes=100 * 1024, stats=CacheStats())
+    scans = _counting_scans(store, monkeypatch)
+
+    for index in range(50):
+        store.put(f"photo-{index}", b"x" * 1024)
+
+    assert len(scans) == 1
+    assert store.usage()["diskEntries"] == 50
+
+
+def test_writes_past_the_cap_evict_the_oldest_entries(tmp_path, monkeypatch):
+    stats = CacheStats()
+    store = DiskImageStore(str(tmp_path), max_bytes=10 * 1024, stats=stats)
+    scans = _counting_scans(store, monkeypatch)
+
+    for index in range(30):
+        store.put(f"photo-{index}", b"x" * 1024)
+
+    assert store.usage()["diskBytes"] <= store.max_bytes
+    assert store.get("photo-29") is not None
+    assert store.get("photo-0") is None
+    assert stats.snapshot()["diskEvictions"] == 30 - store.usage()["diskEntries"]
+    # The first write and each eviction scan; writes in between only update the running count
+    assert len(scans) < 30
@@ -0,0 +1,66 @@
+import json
+from datetime import datetime, timedelta
+
+from app.config.settings import RENDER_CACHE_TTL_SECONDS
+from app.models.database import AsyncSessionLocal, BackgroundJob, SessionLocal
+from app.services.image_retention import run_delete_superseded_image_job, superseded_keys
+from app.services.image_storage import image_storage, postcard_key
+from app.services.postcard_generation_service import PostcardRequest, record_transaction_async
+
+
+def _deletion_jobs(transaction_id: str):
+    with SessionLocal() as db:
+        jobs = db.query(BackgroundJob).filter_by(kind="delete_superseded_image").all()
+        return [(json.loads(job.payload), job.run_after) for job in jobs if json.loads(job.payload)["transactionId"] == transaction_id]
+
+
+def test_rerendered_side_is_deleted_after_the_row_moves_on(run, tmp_path):
+    transaction_id = "test-retention-rerender"
+    request = PostcardRequest(message="Wish you were here", recipientInfo={"to": "Ada Lovelace"},
+                              postcardSize="xl", transactionId=transaction_id)
+    image = tmp_path / "side.jpg"
+    image.write_bytes(b"jpeg")
+    front, first_back, second_back = (
+        postcard_key(transaction_id, "front", "f" * 16),
+        postcard_key(transaction_id, "back", "a" * 16),
+        postcard_key(transaction_id, "back", "b" * 16)
+    )
+
+    async def record(front_url, back_url):
+        async with AsyncSessionLocal() as db:
+            await record_transaction_async(request, front_url, back_url, "", {}, db)
+
+    async def render_twice_then_delete():
+        urls = {key: await image_storage.put(key, str(image)) for key in (front, first_back, second_back)}
+        await record(urls[front], urls[first_back])
+        # A message edit re-renders only the back
+        await record(None, urls[second_back])
+        jobs = _deletion_jobs(transaction_id)
+        results = [await run_delete_superseded_image_job(payload) for payload, _ in jobs]
+        kept = await run_delete_superseded_image_job({"transactionId": transaction_id, "key": second_back})
+        stored = {key: await image_storage.exists(key) for key in (front, first_back, second_back)}
+        return jobs, results, kept, stored
+
+    jobs, results, kept, stored = run(render_twice_then_delete())
+
+    assert [payload["key"] for payload, _ in jobs] == [first_back]
+    assert jobs[0][1] >= datetime.utcnow() + timedelta(seconds=RENDER_CACHE_TTL_SECONDS - 60)
+    assert results == [{"deleted": True}]
+    assert kept == {"deleted": False}
+    assert stored == {front: True, first_back: False, second_back: True}
+
+
+def test_only_unreferenced_renders_of_the_transaction_are_superseded():
+    transaction_id = "test-retention-keys"
+    old_back = f"http://testserver/storage/{postcard_key(transaction_id, 'back', 'a' * 16)}"
+    new_back = f"http://testserver/storage/{postcard_key(transaction_id, 'back', 'b' * 16)}"
+    batch_front = f"http://testserver/storage/{postcard_key('batch-1', 'front', 'c' * 16)}"
+
+    # The old back still stands in for the front, so it stays
+    assert superseded_keys(transaction_id, {"front_url": old_back, "back_url": old_back}, {"back_url": new_back}) == []
+    assert superseded_keys(transaction_id, {"front_url": old_back, "back_url": old_back},
+                           {"front_url": new_back, "back_url": new_back}) == [postcard_key(transaction_id, "back", "a" * 16)]
+    # Fronts shared by a batch and app-provided images are never the transaction's own renders
+    assert superseded_keys(transaction_id, {"front_url": batch_front, "back_url": None},
+                           {"front_url": "https://images.example/photo.jpg"}) == []
+    assert superseded_keys(transaction_id, None, {"back_url": new_back}) == []
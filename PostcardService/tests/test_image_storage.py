@@ -0,0 +1,17 @@
+import pytest
+
+from app.services.image_storage import ImageStorage, LocalStorage
+
+
+def test_incomplete_backend_fails_when_created():
+    class UploadOnlyStorage(ImageStorage):
+        async def _put(self, key, path):
+            return f"https://images.example/{key}"
+
+    with pytest.raises(TypeError):
+        UploadOnlyStorage()
+
+
+def test_local_backend_implements_the_interface(tmp_path):
+    storage = LocalStorage(str(tmp_path), "http://testserver")
+    assert storage.url("postcards/backs/postcard-back-1.jpg").startswith("http://testserver/")
@@ -0,0 +1,42 @@
+from fastapi.testclient import TestClient
+
+from app.models.database import BackgroundJob, SessionLocal
+from app.routers import jobs
+from app.services.job_queue import job_queue
+from main import app
+
+client = TestClient(app)
+
+
+def _dead_job() -> int:
+    job = job_queue.enqueue("test_notification", {"toEmail": "customer@example.com"})
+    with SessionLocal() as db:
+        db.query(BackgroundJob).filter_by(id=job["jobId"]).update(
+            {"status": "dead", "last_error": "Could not send to customer@example.com"}
+        )
+        db.commit()
+    return job["jobId"]
+
+
+def test_job_status_hides_payload_without_admin_token(monkeypatch):
+    monkeypatch.setattr(jobs, "ADMIN_API_TOKEN", "secret")
+    job_id = _dead_job()
+
+    public = client.get(f"/jobs/{job_id}").json()
+    admin = client.get(f"/jobs/{job_id}", headers={"X-Admin-Token": "secret"}).json()
+
+    assert "payload" not in public and "lastError" not in public and "result" not in public
+    assert public["status"] == admin["status"]
+    assert admin["payload"]["toEmail"] == "customer@example.com"
+
+
+def test_retry_requires_admin_token(monkeypatch):
+    job_id = _dead_job()
+
+    monkeypatch.setattr(jobs, "ADMIN_API_TOKEN", "")
+    assert client.post(f"/jobs/{job_id}/retry", headers={"X-Admin-Token": ""}).status_code == 403
+
+    monkeypatch.setattr(jobs, "ADMIN_API_TOKEN", "secret")
+    assert client.post(f"/jobs/{job_id}/retry").status_code == 403
+    assert client.post(f"/jobs/{job_id}/retry", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.post(f"/jobs/{job_id}/retry", headers={"X-Admin-Token": "secret"}).status_code == 200
@@ -0,0 +1,162 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import create_engine, func, inspect, select, text
+
+from app.models.database import (
+    AsyncSessionLocal, CouponCampaign, CouponCode, CouponRedemption, SessionLocal, ensure_redemption_order_index
+)
+from app.models.schemas import PromoCodeValidationRequest
+from app.repositories import coupons as coupons_repo
+from app.services.coupon_cache import active_codes
+from app.services.coupon_service import PromoCodeRejected, redeem_promo_code, validate_promo_code
+
+
+def _create_code(code: str, max_redemptions: Optional[int]) -> int:
+    with SessionLocal() as db:
+        campaign = CouponCampaign(campaign_name=f"{code} campaign", campaign_type="test", discount_percent=100)
+        coupon = CouponCode(code=code, campaign=campaign, max_redemptions=max_redemptions,
+                            times_redeemed=0, expires_at=datetime.utcnow() + timedelta(days=30))
+        db.add(coupon)
+        db.commit()
+        if max_redemptions is None:
+            # The column default would replace None on insert
+            db.query(CouponCode).filter_by(id=coupon.id).update({"max_redemptions": None})
+            db.commit()
+        return coupon.id
+
+
+async def _redeem(code: str, transaction_id: str) -> str:
+    async with AsyncSessionLocal() as db:
+        try:
+            result = await redeem_promo_code(code, transaction_id, "customer@example.com", db)
+        except PromoCodeRejected:
+            return "rejected"
+    return "repeat" if result["alreadyRedeemed"] else "redeemed"
+
+
+async def _usage(coupon_id: int):
+    async with AsyncSessionLocal() as db:
+        times_redeemed = await db.scalar(select(CouponCode.times_redeemed).where(CouponCode.id == coupon_id))
+        redemptions = await db.scalar(
+            select(func.count()).select_from(CouponRedemption).where(CouponRedemption.coupon_code_id == coupon_id)
+        )
+    return times_redeemed, redemptions
+
+
+def test_concurrent_redeemers_never_exceed_max_redemptions(run):
+    coupon_id = _create_code("RACE100", max_redemptions=100)
+
+    async def redeem_concurrently():
+        outcomes = await asyncio.gather(*(_redeem("race100", f"test-race-{i}") for i in range(200)))
+        return outcomes, await _usage(coupon_id)
+
+    outcomes, usage = run(redeem_concurrently())
+
+    assert outcomes.count("redeemed") == 100
+    assert outcomes.count("rejected") == 100
+    assert usage == (100, 100)
+
+
+def test_retry_for_the_same_transaction_is_not_counted_twice(run):
+    coupon_id = _create_code("RETRY10", max_redemptions=10)
+
+    async def redeem_with_retry():
+        outcomes = [await _redeem("RETRY10", "test-retry-order"), await _redeem("retry10", "test-retry-order")]
+        return outcomes, await _usage(coupon_id)
+
+    outcomes, usage = run(redeem_with_retry())
+
+    assert outcomes == ["redeemed", "repeat"]
+    assert usage == (1, 1)
+
+
+def test_concurrent_requests_for_the_same_transaction_count_once(run, monkeypatch):
+    coupon_id = _create_code("DOUBLETAP", max_redemptions=10)
+
+    async def no_redemption_yet(db, coupon_code_id, transaction_id):
+        # Every caller passes the pre-check together, as concurrent requests can on Postgres
+        return None
+
+    async def redeem_concurrently():
+        monkeypatch.setattr(coupons_repo, "get_redemption", no_redemption_yet)
+        outcomes = await asyncio.gather(*(_redeem("DOUBLETAP", "test-double-tap-order") for _ in range(5)))
+        return outcomes, await _usage(coupon_id)
+
+    outcomes, usage = run(redeem_concurrently())
+
+    assert outcomes.count("redeemed") == 1
+    assert outcomes.count("repeat") == 4
+    assert usage == (1, 1)
+
+
+def test_code_without_a_limit_is_never_used_up(run):
+    coupon_id = _create_code("UNLIMITED", max_redemptions=None)
+
+    async def validate_and_redeem():
+        async with AsyncSessionLocal() as db:
+            validation = await validate_promo_code(PromoCodeValidationRequest(code="unlimited"), db)
+        outcomes = await asyncio.gather(*(_redeem("UNLIMITED", f"test-unlimited-{i}") for i in range(20)))
+        return validation, outcomes, await _usage(coupon_id)
+
+    validation, outcomes, usage = run(validate_and_redeem())
+
+    assert validation["valid"] is True
+    assert validation["remaining"] is None
+    assert outcomes.count("redeemed") == 20
+    assert usage == (20, 20)
+
+
+def test_lookup_survives_invalidation_during_reload(run, monkeypatch):
+    _create_code("RELOADED", max_redemptions=5)
+    reload = active_codes._reload
+
+    async def reload_then_invalidate(db, stale_before):
+        await reload(db, stale_before)
+        # A CouponCode changed (e.g. in a job worker's thread) just as the reload finished
+        active_codes.invalidate()
+
+    async def lookup_after_invalidation():
+        active_codes.invalidate()
+        monkeypatch.setattr(active_codes, "_reload", reload_then_invalidate)
+        async with AsyncSessionLocal() as db:
+            found = await active_codes.lookup(db, "reloaded")
+            missing = await active_codes.lookup(db, "no-such-code")
+        return found, missing
+
+    found, missing = run(lookup_after_invalidation())
+
+    assert found is not None and found.code == "RELOADED"
+    assert missing is None
+
+
+def _legacy_redemptions_table(path, rows):
+    """A coupon_redemptions table as created before the one-redemption-per-order index"""
+    legacy = create_engine(f"sqlite:///{path}")
+    with legacy.begin() as conn:
+        conn.execute(text("CREATE TABLE coupon_redemptions (id INTEGER PRIMARY KEY, coupon_code_id INTEGER, transaction_id VARCHAR(100))"))
+        for coupon_code_id, transaction_id in rows:
+            conn.execute(text("INSERT INTO coupon_redemptions (coupon_code_id, transaction_id) VALUES (:code, :order)"),
+                         {"code": coupon_code_id, "order": transaction_id})
+    return legacy
+
+
+def _index_names(db_engine):
+    return {index["name"] for index in inspect(db_engine).get_indexes("coupon_redemptions")}
+
+
+def test_startup_adds_the_order_index_to_an_existing_table(tmp_path):
+    legacy = _legacy_redemptions_table(tmp_path / "legacy.db", [(1, "order-1"), (1, "order-2")])
+
+    assert ensure_redemption_order_index(legacy) is True
+    assert ensure_redemption_order_index(legacy) is True
+    assert "uq_coupon_redemptions_order" in _index_names(legacy)
+
+
+def test_startup_reports_duplicate_redemptions_instead_of_failing(tmp_path, capsys):
+    legacy = _legacy_redemptions_table(tmp_path / "duplicates.db", [(1, "order-1"), (1, "order-1")])
+
+    assert ensure_redemption_order_index(legacy) is False
+    assert "uq_coupon_redemptions_order" not in _index_names(legacy)
+    assert "(1, 'order-1', 2)" in capsys.readouterr().out
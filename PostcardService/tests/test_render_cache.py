@@ -0,0 +1,52 @@
+from app.models.database import AsyncSessionLocal
+from app.models.schemas import PostcardRequest
+from app.services import postcard_generation_service as generation
+from app.services.render_executor import render_executor
+
+
+def _count_renders(monkeypatch):
+    """Run render jobs inline and record the name of each job submitted"""
+    jobs = []
+
+    async def run_inline(fn, *args, timeout=None):
+        jobs.append(fn.__name__)
+        return fn(*args)
+
+    monkeypatch.setattr(render_executor, "run", run_inline)
+    return jobs
+
+
+def _back_request(transaction_id: str, message: str = "Greetings from the coast") -> PostcardRequest:
+    return PostcardRequest(
+        message=message,
+        recipientInfo={"to": "Ada Lovelace", "addressLine1": "12 St James's Square", "city": "London", "zipcode": "SW1Y 4JH"},
+        postcardSize="xl",
+        transactionId=transaction_id
+    )
+
+
+async def _generate_backs(*requests):
+    async with AsyncSessionLocal() as db:
+        return [await generation.generate_postcard_back_async(request, {}, db) for request in requests]
+
+
+def test_identical_back_requests_render_once(run, monkeypatch):
+    jobs = _count_renders(monkeypatch)
+
+    first, second = run(_generate_backs(_back_request("test-cache-identical"), _back_request("test-cache-identical")))
+
+    assert jobs == ["render_back_side"]
+    assert second["backUrl"] == first["backUrl"]
+    assert second["messageFontSize"] == first["messageFontSize"]
+
+
+def test_edited_message_renders_under_a_new_key(run, monkeypatch):
+    jobs = _count_renders(monkeypatch)
+
+    first, edited = run(_generate_backs(
+        _back_request("test-cache-edited"),
+        _back_request("test-cache-edited", message="Greetings from the mountains")
+    ))
+
+    assert jobs == ["render_back_side", "render_back_side"]
+    assert edited["backUrl"] != first["backUrl"]
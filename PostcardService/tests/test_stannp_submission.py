@@ -0,0 +1,152 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.models.database import AsyncSessionLocal, PostcardTransaction, SessionLocal
+from app.services import postcard_service
+from app.services.job_queue import job_queue
+from app.services.payment_service import get_payment_status
+from app.services.postcard_service import SubmissionInProgress, submit_transaction_once
+from app.services.stannp_client import stannp_client
+from dev import fake_stannp
+
+POLLERS = 50
+
+
+@pytest.fixture
+def stannp(monkeypatch):
+    """Point the Stannp client at dev/fake_stannp.py in-process; returns a coroutine function reading /_created"""
+    monkeypatch.setenv("STANNP_API_KEY", "test")
+    monkeypatch.setattr(fake_stannp, "created", [])
+    monkeypatch.setattr(fake_stannp, "attempts", {"count": 0})
+    monkeypatch.setattr(fake_stannp, "failures", [])
+    # Slow enough that every caller arrives while the first submission is still in flight
+    monkeypatch.setattr(fake_stannp, "delay", 0.05)
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_stannp.app), base_url="http://fake-stannp/api/v1")
+    monkeypatch.setattr(stannp_client, "_client", client)
+    monkeypatch.setattr(stannp_client, "_semaphore", asyncio.Semaphore(stannp_client.max_concurrency))
+
+    async def created():
+        response = await client.get("http://fake-stannp/_created")
+        return response.json()
+    return created
+
+
+def _store_transaction(transaction_id: str):
+    with SessionLocal() as db:
+        db.add(PostcardTransaction(
+            transaction_id=transaction_id,
+            recipient_name="Ada Lovelace",
+            recipient_address_line1="12 St James's Square",
+            recipient_city="London",
+            recipient_zipcode="SW1Y 4JH",
+            postcard_size="xl",
+            front_url=f"http://testserver/{transaction_id}-front.jpg",
+            back_url=f"http://testserver/{transaction_id}-back.jpg"
+        ))
+        db.commit()
+
+
+async def _poll(transaction_id: str):
+    async with AsyncSessionLocal() as db:
+        return await get_payment_status(transaction_id, db)
+
+
+def test_simultaneous_status_polls_create_one_postcard(run, stannp):
+    _store_transaction("test-stannp-polls")
+
+    async def poll_until_submitted():
+        job_queue.start()
+        try:
+            polls = await asyncio.gather(*(_poll("test-stannp-polls") for _ in range(POLLERS)))
+            for _ in range(100):
+                status = await _poll("test-stannp-polls")
+                if status["completed"]:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await job_queue.stop()
+        return polls, status, await stannp()
+
+    polls, status, fake = run(poll_until_submitted())
+
+    assert len({poll["jobId"] for poll in polls}) == 1
+    assert status["status"] == "submitted_to_stannp"
+    assert len(fake["created"]) == 1
+    assert status["stannpOrderId"] == str(fake["created"][0]["id"])
+
+
+def test_concurrent_submissions_in_one_process_share_one_call(run, stannp):
+    _store_transaction("test-stannp-once")
+
+    async def submit_concurrently():
+        results = await asyncio.gather(*(submit_transaction_once("test-stannp-once") for _ in range(POLLERS)))
+        return results, await stannp()
+
+    results, fake = run(submit_concurrently())
+
+    assert fake["attempts"] == 1
+    assert len(fake["created"]) == 1
+    assert {result["stannpOrderId"] for result in results} == {str(fake["created"][0]["id"])}
+
+
+def test_submission_claim_admits_one_worker(run, stannp):
+    _store_transaction("test-stannp-claim")
+
+    async def submit_as_separate_workers():
+        # Bypass the in-process coalescing, as callers in different worker processes would
+        results = await asyncio.gather(
+            *(postcard_service._submit_transaction("test-stannp-claim") for _ in range(POLLERS)),
+            return_exceptions=True
+        )
+        return results, await stannp()
+
+    results, fake = run(submit_as_separate_workers())
+
+    submitted = [result for result in results if isinstance(result, dict) and not result.get("alreadySubmitted")]
+    others = [result for result in results if not isinstance(result, dict) or result.get("alreadySubmitted")]
+    assert len(fake["created"]) == 1
+    assert len(submitted) == 1
+    assert all(isinstance(result, (SubmissionInProgress, dict)) for result in others)
+
+
+def test_poll_before_the_transaction_is_stored_does_not_queue_a_submission(run, stannp):
+    async def poll_early_then_after_storing():
+        early = await _poll("test-stannp-early")
+        _store_transaction("test-stannp-early")
+        job_queue.start()
+        try:
+            for _ in range(100):
+                status = await _poll("test-stannp-early")
+                if status["completed"]:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await job_queue.stop()
+        return early, status, await stannp()
+
+    early, status, fake = run(poll_early_then_after_storing())
+
+    assert early["status"] == "awaiting_postcard"
+    assert "jobId" not in early
+    assert status["status"] == "submitted_to_stannp"
+    assert len(fake["created"]) == 1
+
+
+def test_awaiting_poll_reports_only_stored_image_urls(run):
+    with SessionLocal() as db:
+        # The back is stored but the front is still being published
+        db.add(PostcardTransaction(transaction_id="test-stannp-half-stored", postcard_size="xl",
+                                   back_url="http://testserver/test-stannp-half-stored-back.jpg"))
+        db.commit()
+
+    async def poll_both():
+        return await _poll("test-stannp-not-stored"), await _poll("test-stannp-half-stored")
+
+    not_stored, half_stored = run(poll_both())
+
+    assert not_stored["status"] == half_stored["status"] == "awaiting_postcard"
+    assert (not_stored["frontUrl"], not_stored["backUrl"]) == (None, None)
+    assert (half_stored["frontUrl"], half_stored["backUrl"]) == (None, "http://testserver/test-stannp-half-stored-back.jpg")